@@ -81,5 +81,6 @@ def register():
         HospitalBed,
         module='health', type_='model')
     Pool.register(
+        ConfirmAppointment,
         OpenAppointmentReport,
         module='health', type_='wizard')
@@ -23,13 +23,20 @@
 from dateutil.relativedelta import relativedelta
 from datetime import datetime, timedelta
 from sql import Literal, Join
+from sql.aggregate import Max
+from sql.conditionals import Case, NullIf
+from sql.functions import Function, Age, Extract
+from sql.operators import Concat
 from trytond.model import ModelView, ModelSingleton, ModelSQL, fields
-from trytond.wizard import Wizard, StateAction, StateView, Button
+from trytond.wizard import Wizard, StateAction, StateView, StateTransition, \
+    Button
 from trytond.transaction import Transaction
 from trytond import backend
+from trytond.config import CONFIG
 from trytond.pyson import Eval, Not, Bool, PYSONEncoder, Equal, And
 from trytond.pool import Pool
-from trytond.tools import datetime_strftime
+from trytond.cache import Cache
+from trytond.tools import datetime_strftime, reduce_ids
 
 
 __all__ = [
@@ -42,7 +49,8 @@ __all__ = [
     'InsurancePlan', 'Insurance', 'AlternativePersonID',
     'PartyPatient', 'PartyAddress', 'ProductCategory',
     'ProductTemplate', 'Product', 'GnuHealthSequences', 'PatientData',
-    'PatientDiseaseInfo', 'Appointment', 'AppointmentReport',
+    'PatientDiseaseInfo', 'Appointment', 'ConfirmAppointment',
+    'AppointmentReport',
     'OpenAppointmentReportStart', 'OpenAppointmentReport',
     'PatientMedication', 'PatientVaccination',
     'PatientPrescriptionOrder', 'PrescriptionLine', 'PatientEvaluation',
@@ -52,6 +60,37 @@ __all__ = [
     'HospitalBed']
 
 
+def create_trigram_index(cursor, table, column):
+    # Trigram indexes allow the 'ilike' searches on names and codes
+    # (eg, the client autocompletion) to avoid a full table scan.
+    # They require the pg_trgm extension of PostgreSQL to be installed
+    # on the database by its administrator:  CREATE EXTENSION pg_trgm;
+    if CONFIG['db_type'] != 'postgresql':
+        return
+    cursor.execute('SELECT 1 FROM pg_extension WHERE extname = %s',
+        ('pg_trgm',))
+    if not cursor.fetchone():
+        return
+    index_name = '%s_%s_trgm_index' % (table, column)
+    cursor.execute('SELECT 1 FROM pg_indexes WHERE indexname = %s',
+        (index_name,))
+    if not cursor.fetchone():
+        cursor.execute('CREATE INDEX "' + index_name + '" '
+            'ON "' + table + '" USING gin ("' + column + '" gin_trgm_ops)')
+
+
+class ConcatWs(Function):
+    # Concatenate the non NULL arguments with the first one as separator
+    __slots__ = ()
+    _function = 'CONCAT_WS'
+
+
+class DateTrunc(Function):
+    # sql.functions.DateTrunc is not rendered as the date_trunc function
+    __slots__ = ()
+    _function = 'DATE_TRUNC'
+
+
 class DrugDoseUnits(ModelSQL, ModelView):
     'Drug Dose Unit'
     __name__ = 'gnuhealth.dose.unit'
@@ -171,24 +210,68 @@ class HealthProfessional(ModelSQL, ModelView):
     'Health Professional'
     __name__ = 'gnuhealth.healthprofessional'
 
+    _health_professional_cache = Cache(
+        'gnuhealth.healthprofessional.get_health_professional',
+        context=False)
+
     @classmethod
-    def get_health_professional(cls):
+    def get_health_professional_info(cls):
         # Get the professional associated to the internal user id
-        # that logs into GNU Health
+        # that logs into GNU Health, and his/her main specialty.
+        # The result is cached per user and the cache is cleared when
+        # the health professionals or the internal users of the parties
+        # change
+        user_id = Transaction().user
+        info = cls._health_professional_cache.get(user_id)
+        if info is not None:
+            return info
+
+        pool = Pool()
         cursor = Transaction().cursor
-        User = Pool().get('res.user')
-        user = User(Transaction().user)
-        login_user_id = int(user.id)
-        cursor.execute('SELECT id FROM party_party WHERE is_healthprof=True AND \
-            internal_user = %s LIMIT 1', (login_user_id,))
-        partner_id = cursor.fetchone()
-        if partner_id:
-            cursor = Transaction().cursor
-            cursor.execute('SELECT id FROM gnuhealth_healthprofessional WHERE \
-                name = %s LIMIT 1', (partner_id[0],))
-            healthprof_id = cursor.fetchone()
-            if (healthprof_id):
-                return int(healthprof_id[0])
+        party = pool.get('party.party').__table__()
+        healthprof = cls.__table__()
+        hp_specialty = pool.get('gnuhealth.hp_specialty').__table__()
+
+        join1 = Join(party, healthprof)
+        join1.condition = join1.right.name == party.id
+        join2 = Join(join1, hp_specialty, 'LEFT')
+        join2.condition = join2.right.id == healthprof.main_specialty
+        cursor.execute(*join2.select(healthprof.id, hp_specialty.specialty,
+                where=(party.is_healthprof == True)
+                & (party.internal_user == user_id),
+                limit=1))
+        info = cursor.fetchone()
+        if info:
+            info = tuple(info)
+        else:
+            info = (None, None)
+        cls._health_professional_cache.set(user_id, info)
+        return info
+
+    @classmethod
+    def get_health_professional(cls):
+        return cls.get_health_professional_info()[0]
+
+    @classmethod
+    def get_health_professional_specialty(cls):
+        # Main specialty of the professional of the login user
+        return cls.get_health_professional_info()[1]
+
+    @classmethod
+    def create(cls, vlist):
+        cls._health_professional_cache.clear()
+        return super(HealthProfessional, cls).create(vlist)
+
+    @classmethod
+    def write(cls, healthprofs, values):
+        if 'name' in values or 'main_specialty' in values:
+            cls._health_professional_cache.clear()
+        return super(HealthProfessional, cls).write(healthprofs, values)
+
+    @classmethod
+    def delete(cls, healthprofs):
+        cls._health_professional_cache.clear()
+        return super(HealthProfessional, cls).delete(healthprofs)
 
     name = fields.Many2One(
         'party.party', 'Health Professional', required=True,
@@ -251,6 +334,20 @@ class HealthProfessionalSpecialties(ModelSQL, ModelView):
     def get_rec_name(self, name):
         return self.specialty.name
 
+    @classmethod
+    def write(cls, specialties, values):
+        HealthProfessional = Pool().get('gnuhealth.healthprofessional')
+        if 'specialty' in values:
+            HealthProfessional._health_professional_cache.clear()
+        return super(HealthProfessionalSpecialties, cls).write(specialties,
+            values)
+
+    @classmethod
+    def delete(cls, specialties):
+        HealthProfessional = Pool().get('gnuhealth.healthprofessional')
+        HealthProfessional._health_professional_cache.clear()
+        return super(HealthProfessionalSpecialties, cls).delete(specialties)
+
 
 class PhysicianSP(ModelSQL, ModelView):
     # Add Main Specialty field after from the Health Professional Speciality
@@ -763,6 +860,50 @@ class DiseaseMembers(ModelSQL, ModelView):
     disease_group = fields.Many2One(
         'gnuhealth.pathology.group', 'Group', required=True)
 
+    @staticmethod
+    def _get_patients(pathology_ids):
+        # Patients suffering any of the pathologies
+        cursor = Transaction().cursor
+        disease = Pool().get('gnuhealth.patient.disease').__table__()
+
+        patient_ids = []
+        pathology_ids = list(set(i for i in pathology_ids if i))
+        for i in range(0, len(pathology_ids), cursor.IN_MAX):
+            sub_ids = pathology_ids[i:i + cursor.IN_MAX]
+            cursor.execute(*disease.select(disease.name,
+                    where=reduce_ids(disease.pathology, sub_ids)
+                    & (disease.name != None),
+                    group_by=disease.name))
+            patient_ids.extend(x[0] for x in cursor.fetchall())
+        return patient_ids
+
+    @classmethod
+    def create(cls, vlist):
+        Patient = Pool().get('gnuhealth.patient')
+
+        members = super(DiseaseMembers, cls).create(vlist)
+        Patient.update_critical_summary(cls._get_patients(
+                [m.name.id for m in members if m.name]))
+        return members
+
+    @classmethod
+    def write(cls, members, values):
+        Patient = Pool().get('gnuhealth.patient')
+
+        pathology_ids = [m.name.id for m in members if m.name]
+        super(DiseaseMembers, cls).write(members, values)
+        if values.get('name'):
+            pathology_ids.append(values['name'])
+        Patient.update_critical_summary(cls._get_patients(pathology_ids))
+
+    @classmethod
+    def delete(cls, members):
+        Patient = Pool().get('gnuhealth.patient')
+
+        pathology_ids = [m.name.id for m in members if m.name]
+        super(DiseaseMembers, cls).delete(members)
+        Patient.update_critical_summary(cls._get_patients(pathology_ids))
+
 
 class ProcedureCode(ModelSQL, ModelView):
     'Medical Procedures'
@@ -980,6 +1121,9 @@ class PartyPatient (ModelSQL, ModelView):
 
         if vals.get('ref') == '':
             vals['ref'] = None
+        if 'internal_user' in vals or 'is_healthprof' in vals:
+            HealthProfessional = Pool().get('gnuhealth.healthprofessional')
+            HealthProfessional._health_professional_cache.clear()
         return super(PartyPatient, cls).write(parties, vals)
 
     @classmethod
@@ -993,6 +1137,9 @@ class PartyPatient (ModelSQL, ModelView):
             if 'ref' in values and not values['ref']:
                 values['ref'] = None
 
+        if any(values.get('internal_user') for values in vlist):
+            HealthProfessional = Pool().get('gnuhealth.healthprofessional')
+            HealthProfessional._health_professional_cache.clear()
         return super(PartyPatient, cls).create(vlist)
 
     @classmethod
@@ -1011,14 +1158,16 @@ class PartyPatient (ModelSQL, ModelView):
 
     @classmethod
     def search_rec_name(cls, name, clause):
-        field = None
-        for field in ('name', 'lastname', 'ref'):
-            parties = cls.search([(field,) + tuple(clause[1:])], limit=1)
-            if parties:
-                break
-        if parties:
-            return [(field,) + tuple(clause[1:])]
-        return [(cls._rec_name,) + tuple(clause[1:])]
+        # Search by the name, lastname or SSN in a single query
+        if clause[1].startswith('!') or clause[1].startswith('not '):
+            bool_op = 'AND'
+        else:
+            bool_op = 'OR'
+        return [bool_op,
+            ('name',) + tuple(clause[1:]),
+            ('lastname',) + tuple(clause[1:]),
+            ('ref',) + tuple(clause[1:]),
+            ]
 
     def on_change_with_is_person(self):
         # Set is_person if the party is a health professional or a patient
@@ -1055,6 +1204,9 @@ class PartyPatient (ModelSQL, ModelView):
 
         super(PartyPatient, cls).__register__(module_name)
 
+        for column in ('name', 'lastname', 'ref'):
+            create_trigram_index(cursor, cls._table, column)
+
 class PartyAddress(ModelSQL, ModelView):
     'Party Address'
     __name__ = 'party.address'
@@ -1161,45 +1313,137 @@ class GnuHealthSequences(ModelSingleton, ModelSQL, ModelView):
         'ir.sequence', 'Prescription Sequence', required=True,
         domain=[('code', '=', 'gnuhealth.prescription.order')]))
 
+    @classmethod
+    def get_sequence_codes(cls, sequence_field, number):
+        # Return a list of "number" codes of the sequence configured in
+        # sequence_field. On PostgreSQL the codes of an incremental
+        # sequence are reserved with a single nextval query on its SQL
+        # sequence, so the concurrent callers never get the same code.
+        # Otherwise each code is taken with Sequence.get_id.
+        Sequence = Pool().get('ir.sequence')
+        cursor = Transaction().cursor
+
+        if number < 1:
+            return []
+        config = cls(1)
+        with Transaction().set_user(0):
+            sequence = Sequence(getattr(config, sequence_field).id)
+            if (CONFIG['db_type'] != 'postgresql'
+                    or sequence.type != 'incremental'):
+                return [Sequence.get_id(sequence.id)
+                    for i in range(number)]
+
+            cursor.execute('SELECT nextval(\'"%s"\') '
+                'FROM generate_series(1, %%s)' % sequence._sql_sequence_name,
+                (number,))
+            date = Transaction().context.get('date')
+            prefix = Sequence._process(sequence.prefix, date=date)
+            suffix = Sequence._process(sequence.suffix, date=date)
+            return ['%s%s%s' % (prefix, '%%0%sd' % sequence.padding % n,
+                    suffix) for n, in cursor.fetchall()]
+
 
 # PATIENT GENERAL INFORMATION
 class PatientData(ModelSQL, ModelView):
     'Patient related information'
     __name__ = 'gnuhealth.patient'
 
-    def patient_critical_summary(self, name):
+    @classmethod
+    def patient_critical_summary(cls, patient_ids):
         # Patient Critical Information Summary
         # The information will be shown in the front page
+        # The summary is computed for the whole set of patients with
+        # a single query on the patient diseases and their groups
+
+        pool = Pool()
+        cursor = Transaction().cursor
+        disease = pool.get('gnuhealth.patient.disease').__table__()
+        pathology = pool.get('gnuhealth.pathology').__table__()
+        member = pool.get('gnuhealth.disease_group.members').__table__()
+        group = pool.get('gnuhealth.pathology.group').__table__()
+
+        allergic = member.join(group,
+            condition=member.disease_group == group.id
+            ).select(member.name,
+                where=group.code == 'ALLERGIC')
+
+        rows = []
+        for i in range(0, len(patient_ids), cursor.IN_MAX):
+            sub_ids = patient_ids[i:i + cursor.IN_MAX]
+            cursor.execute(*disease.join(pathology,
+                    condition=disease.pathology == pathology.id
+                    ).select(disease.name, pathology.name,
+                    disease.pathology.in_(allergic).as_('allergy'),
+                    ((disease.status == 'c')
+                        | (disease.is_active == True)).as_('relevant'),
+                    where=reduce_ids(disease.name, sub_ids),
+                    order_by=[disease.is_active.desc,
+                        disease.disease_severity.desc,
+                        disease.is_infectious.desc,
+                        disease.diagnosed_date.desc,
+                        disease.id.asc]))
+            rows.extend(cursor.fetchall())
+
+        allergies = dict((i, []) for i in patient_ids)
+        other_conditions = dict((i, []) for i in patient_ids)
+        for patient_id, pathology_name, allergy, relevant in rows:
+            # Retrieve patient allergies
+            if allergy and pathology_name not in allergies[patient_id]:
+                allergies[patient_id].append(pathology_name)
+
+            # Retrieve patient other relevant conditions
+            # Chronic and active
+            if relevant and pathology_name not in allergies[patient_id]:
+                other_conditions[patient_id].append(pathology_name)
+
+        result = {}
+        for patient_id in patient_ids:
+            result[patient_id] = ''.join(condition + "\n"
+                for condition in (allergies[patient_id]
+                    + other_conditions[patient_id])) or None
+        return result
+
+    @classmethod
+    def update_critical_summary(cls, patient_ids):
+        # Store the critical summary of the patients.
+        # Patients sharing the same summary are updated together
+        cursor = Transaction().cursor
+        patient = cls.__table__()
+
+        patient_ids = list(set(i for i in patient_ids if i))
+        summaries = {}
+        for patient_id, summary in \
+                cls.patient_critical_summary(patient_ids).items():
+            summaries.setdefault(summary, []).append(patient_id)
+
+        for summary, ids in summaries.items():
+            for i in range(0, len(ids), cursor.IN_MAX):
+                sub_ids = ids[i:i + cursor.IN_MAX]
+                cursor.execute(*patient.update(
+                        columns=[patient.critical_summary],
+                        values=[summary],
+                        where=reduce_ids(patient.id, sub_ids)))
+
+    @classmethod
+    def update_all_critical_summary(cls):
+        # Backfill the critical summary of every patient
+        cursor = Transaction().cursor
+        patient = cls.__table__()
+
+        cursor.execute(*patient.select(patient.id))
+        patient_ids = [x[0] for x in cursor.fetchall()]
+        for i in range(0, len(patient_ids), cursor.IN_MAX):
+            cls.update_critical_summary(patient_ids[i:i + cursor.IN_MAX])
 
-        critical_info = ""
-        allergies=""
-        other_conditions=""
-        conditions=[]
-        for disease in self.diseases:
-            for member in disease.pathology.groups:
-                '''Retrieve patient allergies'''
-                if (member.disease_group.name == "ALLERGIC"):
-                    if disease.pathology.name not in conditions:
-                        allergies=allergies + str(disease.pathology.name) + "\n"
-                        conditions.append (disease.pathology.name)
-
-            '''Retrieve patient other relevant conditions '''
-            '''Chronic and active'''        
-            if (disease.status == "c" or disease.is_active):
-                if disease.pathology.name not in conditions:
-                            other_conditions=other_conditions + \
-                             disease.pathology.name + "\n"
-
-        return allergies + other_conditions
-        
     # Get the patient age in the following format : 'YEARS MONTHS DAYS'
     # It will calculate the age of the patient while the patient is alive.
     # When the patient dies, it will show the age at time of death.
 
-    def patient_age(self, name):
+    @classmethod
+    def patient_age(cls, patients, names):
 
         def compute_age_from_dates(patient_dob, patient_deceased,
-                                   patient_dod, patient_sex):
+                                   patient_dod, patient_sex, name):
 
             now = datetime.now()
 
@@ -1208,7 +1452,7 @@ class PatientData(ModelSQL, ModelView):
 
                 if patient_deceased:
                     dod = datetime.strptime(
-                        str(patient_dod), '%Y-%m-%d %H:%M:%S')
+                        str(patient_dod)[:19], '%Y-%m-%d %H:%M:%S')
                     delta = relativedelta(dod, dob)
                     deceased = ' (deceased)'
                 else:
@@ -1234,8 +1478,25 @@ class PatientData(ModelSQL, ModelView):
                 else:
                     return False
 
-        return compute_age_from_dates(self.dob, self.deceased,
-                                      self.dod, self.sex)
+        pool = Pool()
+        cursor = Transaction().cursor
+        patient = cls.__table__()
+        party = pool.get('party.party').__table__()
+
+        result = dict((name, {}) for name in names)
+        ids = [p.id for p in patients]
+        for i in range(0, len(ids), cursor.IN_MAX):
+            sub_ids = ids[i:i + cursor.IN_MAX]
+            cursor.execute(*patient.join(party,
+                    condition=patient.name == party.id
+                    ).select(patient.id, party.dob, patient.deceased,
+                    patient.dod, party.sex,
+                    where=reduce_ids(patient.id, sub_ids)))
+            for patient_id, dob, deceased, dod, sex in cursor.fetchall():
+                for name in names:
+                    result[name][patient_id] = compute_age_from_dates(
+                        dob, deceased, dod, sex, name)
+        return result
 
     name = fields.Many2One(
         'party.party', 'Patient', required=True,
@@ -1247,15 +1508,15 @@ class PatientData(ModelSQL, ModelView):
         help="Person associated to this patient")
 
     lastname = fields.Function(
-        fields.Char('Lastname'), 'get_patient_lastname',
+        fields.Char('Lastname'), 'get_patient_party_data',
         searcher='search_patient_lastname')
 
     ssn = fields.Function(
         fields.Char('SSN'),
-        'get_patient_ssn', searcher='search_patient_ssn')
+        'get_patient_party_data', searcher='search_patient_ssn')
 
     identification_code = fields.Char(
-        'Code', readonly=True,
+        'Code', readonly=True, select=True,
         help='Patient Identifier provided by the Health Center.Is not the'
         ' Social Security Number')
 
@@ -1284,13 +1545,14 @@ class PatientData(ModelSQL, ModelView):
     # Removed in 2.0 . PHOTO It's now a functional field
     # Retrieves the information from the party.
 
-    photo = fields.Function(fields.Binary('Picture'), 'get_patient_photo')
+    photo = fields.Function(fields.Binary('Picture'),
+        'get_patient_party_data')
 
     # Removed in 2.0 . DOB It's now a functional field
     # Retrieves the information from the party.
     #    dob = fields.Date('DoB', help='Date of Birth')
 
-    dob = fields.Function(fields.Date('DoB'), 'get_patient_dob')
+    dob = fields.Function(fields.Date('DoB'), 'get_patient_party_data')
 
     age = fields.Function(fields.Char('Age'), 'patient_age')
 
@@ -1305,7 +1567,7 @@ class PatientData(ModelSQL, ModelView):
     sex = fields.Function(fields.Selection([
         ('m', 'Male'),
         ('f', 'Female'),
-        ], 'Sex'), 'get_patient_sex')
+        ], 'Sex'), 'get_patient_party_data')
 
     # Removed in 2.0 . MARITAL STATUS It's now a functional field
     # Retrieves the information from the party.
@@ -1319,7 +1581,8 @@ class PatientData(ModelSQL, ModelView):
             ('w', 'Widowed'),
             ('d', 'Divorced'),
             ('x', 'Separated'),
-            ], 'Marital Status', sort=False), 'get_patient_marital_status')
+            ], 'Marital Status', sort=False),
+        'get_patient_party_data')
 
     blood_type = fields.Selection([
         (None, ''),
@@ -1348,11 +1611,13 @@ class PatientData(ModelSQL, ModelView):
 #        'Prescriptions')
 
     diseases = fields.One2Many('gnuhealth.patient.disease', 'name', 'Diseases')
-    critical_summary = fields.Function(fields.Text(
+    # The summary is stored and updated when the patient diseases
+    # or the disease groups change
+    critical_summary = fields.Text(
         'Important disease about patient allergies or procedures',
+        readonly=True,
         help='Automated summary of patient allergies and '
-        'other critical information'),
-        'patient_critical_summary')
+        'other critical information')
 
     critical_info = fields.Text(
         'Free text information not included in the automatic summary',
@@ -1402,20 +1667,37 @@ class PatientData(ModelSQL, ModelView):
             ('name_uniq', 'UNIQUE(name)', 'The Patient already exists !'),
         ]
 
-    def get_patient_dob(self, name):
-        return self.name.dob
-
-    def get_patient_sex(self, name):
-        return self.name.sex
-
-    def get_patient_photo(self, name):
-        return self.name.photo
-
-    def get_patient_ssn(self, name):
-        return self.name.ref
+    @classmethod
+    def get_patient_party_data(cls, patients, names):
+        # The fields stored on the party are read in a single query
+        # for the whole set of patients
+        pool = Pool()
+        cursor = Transaction().cursor
+        patient = cls.__table__()
+        party = pool.get('party.party').__table__()
 
-    def get_patient_marital_status(self, name):
-        return self.name.marital_status
+        columns = {
+            'lastname': party.lastname,
+            'ssn': party.ref,
+            'dob': party.dob,
+            'sex': party.sex,
+            'photo': party.photo,
+            'marital_status': party.marital_status,
+            }
+
+        result = dict((name, {}) for name in names)
+        ids = [p.id for p in patients]
+        for i in range(0, len(ids), cursor.IN_MAX):
+            sub_ids = ids[i:i + cursor.IN_MAX]
+            cursor.execute(*patient.join(party,
+                    condition=patient.name == party.id
+                    ).select(patient.id,
+                    *[columns[name] for name in names],
+                    where=reduce_ids(patient.id, sub_ids)))
+            for row in cursor.fetchall():
+                for name, value in zip(names, row[1:]):
+                    result[name][row[0]] = value
+        return result
 
     @classmethod
     def search_patient_ssn(cls, name, clause):
@@ -1424,9 +1706,6 @@ class PatientData(ModelSQL, ModelView):
         res.append(('name.ref', clause[1], value))
         return res
 
-    def get_patient_lastname(self, name):
-        return self.name.lastname
-
     @classmethod
     def search_patient_lastname(cls, name, clause):
         res = []
@@ -1438,26 +1717,26 @@ class PatientData(ModelSQL, ModelView):
 
     @classmethod
     def search_rec_name(cls, name, clause):
-        field = None
-        for field in ('name', 'lastname', 'ssn', 'identification_code'):
-            patients = cls.search([(field,) + tuple(clause[1:])], limit=1)
-            if patients:
-                break
-        if patients:
-            return [(field,) + tuple(clause[1:])]
-        return [(cls._rec_name,) + tuple(clause[1:])]
+        if clause[1].startswith('!') or clause[1].startswith('not '):
+            bool_op = 'AND'
+        else:
+            bool_op = 'OR'
+        return [bool_op,
+            ('name.name',) + tuple(clause[1:]),
+            ('name.lastname',) + tuple(clause[1:]),
+            ('name.ref',) + tuple(clause[1:]),
+            ('identification_code',) + tuple(clause[1:]),
+            ]
 
     @classmethod
     def create(cls, vlist):
-        Sequence = Pool().get('ir.sequence')
         Config = Pool().get('gnuhealth.sequences')
 
         vlist = [x.copy() for x in vlist]
-        for values in vlist:
-            if not values.get('identification_code'):
-                config = Config(1)
-                values['identification_code'] = Sequence.get_id(
-                    config.patient_sequence.id)
+        to_number = [x for x in vlist if not x.get('identification_code')]
+        codes = Config.get_sequence_codes('patient_sequence', len(to_number))
+        for values, code in zip(to_number, codes):
+            values['identification_code'] = code
 
         return super(PatientData, cls).create(vlist)
 
@@ -1470,11 +1749,20 @@ class PatientData(ModelSQL, ModelView):
     @classmethod
     # Update to version 2.0
     def __register__(cls, module_name):
-        super(PatientData, cls).__register__(module_name)
-
         cursor = Transaction().cursor
         TableHandler = backend.get('TableHandler')
         table = TableHandler(cursor, cls, module_name)
+        summary_exist = table.column_exist('critical_summary')
+
+        super(PatientData, cls).__register__(module_name)
+
+        table = TableHandler(cursor, cls, module_name)
+
+        # Migration from 2.4: the critical summary is now stored
+        if (not summary_exist
+                and TableHandler.table_exist(cursor,
+                    'gnuhealth_patient_disease')):
+            cls.update_all_critical_summary()
         # Move Date of Birth from patient to party
 
         if table.column_exist('dob'):
@@ -1530,6 +1818,8 @@ class PatientData(ModelSQL, ModelView):
 
             table.drop_column('marital_status')
 
+        create_trigram_index(cursor, cls._table, 'identification_code')
+
 
 # PATIENT DISESASES INFORMATION
 class PatientDiseaseInfo(ModelSQL, ModelView):
@@ -1539,7 +1829,8 @@ class PatientDiseaseInfo(ModelSQL, ModelView):
     name = fields.Many2One('gnuhealth.patient', 'Patient')
 
     pathology = fields.Many2One(
-        'gnuhealth.pathology', 'Disease', required=True, help='Disease')
+        'gnuhealth.pathology', 'Disease', required=True, select=True,
+        help='Disease')
 
     disease_severity = fields.Selection([
         (None, ''),
@@ -1668,6 +1959,40 @@ class PatientDiseaseInfo(ModelSQL, ModelView):
 
         super(PatientDiseaseInfo, cls).__register__(module_name)
 
+    # Fields that modify the patient critical summary
+    _critical_summary_fields = set(['name', 'pathology', 'status',
+        'is_active', 'disease_severity', 'is_infectious', 'diagnosed_date'])
+
+    @classmethod
+    def create(cls, vlist):
+        Patient = Pool().get('gnuhealth.patient')
+
+        diseases = super(PatientDiseaseInfo, cls).create(vlist)
+        Patient.update_critical_summary([d.name.id for d in diseases
+                if d.name])
+        return diseases
+
+    @classmethod
+    def write(cls, diseases, values):
+        Patient = Pool().get('gnuhealth.patient')
+
+        if not cls._critical_summary_fields.intersection(values):
+            return super(PatientDiseaseInfo, cls).write(diseases, values)
+
+        patient_ids = [d.name.id for d in diseases if d.name]
+        super(PatientDiseaseInfo, cls).write(diseases, values)
+        if values.get('name'):
+            patient_ids.append(values['name'])
+        Patient.update_critical_summary(patient_ids)
+
+    @classmethod
+    def delete(cls, diseases):
+        Patient = Pool().get('gnuhealth.patient')
+
+        patient_ids = [d.name.id for d in diseases if d.name]
+        super(PatientDiseaseInfo, cls).delete(diseases)
+        Patient.update_critical_summary(patient_ids)
+
 # PATIENT APPOINTMENT
 class Appointment(ModelSQL, ModelView):
     'Patient Appointments'
@@ -1740,33 +2065,85 @@ class Appointment(ModelSQL, ModelView):
     def __setup__(cls):
         super(Appointment, cls).__setup__()
         cls._order.insert(0, ('appointment_date', 'ASC'))
+        cls._error_messages.update({
+            'confirm_without_patient': 'Appointments without patient can'
+                ' not be confirmed: %(appointments)s',
+            'confirm_state': 'Only the free appointments can be'
+                ' confirmed: %(appointments)s',
+            })
+        cls._buttons.update({
+            'confirm': {
+                'invisible': Not(Equal(Eval('state'), 'free')),
+            },
+        })
 
     @classmethod
     def create(cls, vlist):
-        Sequence = Pool().get('ir.sequence')
         Config = Pool().get('gnuhealth.sequences')
 
         vlist = [x.copy() for x in vlist]
-        for values in vlist:
-            if values['state'] == 'confirmed' and not values.get('name'):
-                config = Config(1)
-                values['name'] = Sequence.get_id(
-                    config.appointment_sequence.id)
+        to_number = [x for x in vlist
+            if x['state'] == 'confirmed' and not x.get('name')]
+        codes = Config.get_sequence_codes('appointment_sequence',
+            len(to_number))
+        for values, code in zip(to_number, codes):
+            values['name'] = code
 
         return super(Appointment, cls).create(vlist)
 
     @classmethod
     def write(cls, appointments, values):
-        Sequence = Pool().get('ir.sequence')
-        Config = Pool().get('gnuhealth.sequences')
+        # The appointments that are confirmed without a code get each
+        # their own code, allocated in a single batch
+        to_number = []
+        if values.get('state') == 'confirmed' and not values.get('name'):
+            to_number = [a for a in appointments if not a.name]
+
+        result = super(Appointment, cls).write(appointments, values)
+        if to_number:
+            cls.set_codes(to_number)
+        return result
 
-        for appointment in appointments:
-            if values.get('state') == 'confirmed' and not values.get('name'):
-                config = Config(1)
-                values['name'] = Sequence.get_id(
-                    config.appointment_sequence.id)
+    @classmethod
+    def set_codes(cls, appointments):
+        Config = Pool().get('gnuhealth.sequences')
+        cursor = Transaction().cursor
+        table = cls.__table__()
+
+        codes = Config.get_sequence_codes('appointment_sequence',
+            len(appointments))
+        for i in range(0, len(appointments), cursor.IN_MAX):
+            sub_appointments = appointments[i:i + cursor.IN_MAX]
+            sub_codes = codes[i:i + cursor.IN_MAX]
+            cursor.execute(*table.update(
+                    columns=[table.name],
+                    values=[Case(*[(table.id == a.id, code)
+                                for a, code in zip(sub_appointments,
+                                    sub_codes)])],
+                    where=reduce_ids(table.id,
+                        [a.id for a in sub_appointments])))
 
-        return super(Appointment, cls).write(appointments, values)
+    @classmethod
+    @ModelView.button
+    def confirm(cls, appointments):
+        # Confirm all the selected free appointments at once, the done,
+        # cancelled and no show appointments can not be confirmed again
+        wrong_state = [a for a in appointments
+            if a.state not in ('free', 'confirmed')]
+        if wrong_state:
+            cls.raise_user_error('confirm_state', {
+                    'appointments': ', '.join(
+                        str(a.appointment_date) for a in wrong_state[:5]),
+                    })
+        to_confirm = [a for a in appointments if a.state == 'free']
+        without_patient = [a for a in to_confirm if not a.patient]
+        if without_patient:
+            cls.raise_user_error('confirm_without_patient', {
+                    'appointments': ', '.join(
+                        str(a.appointment_date) for a in without_patient[:5]),
+                    })
+        if to_confirm:
+            cls.write(to_confirm, {'state': 'confirmed'})
 
     @classmethod
     def copy(cls, appointments, default=None):
@@ -1780,7 +2157,8 @@ class Appointment(ModelSQL, ModelView):
 
     @staticmethod
     def default_healthprof():
-        return HealthProfessional().get_health_professional()
+        HealthProf = Pool().get('gnuhealth.healthprofessional')
+        return HealthProf.get_health_professional()
 
     @staticmethod
     def default_urgency():
@@ -1823,19 +2201,8 @@ class Appointment(ModelSQL, ModelView):
         # It will be overwritten if the health professional is modified in
         # this view, the on_change_with will take effect.
 
-        # Get Party ID associated to the Health Professional
-        hp_party_id = HealthProfessional().get_health_professional()
-
-        if hp_party_id:
-            # Retrieve the health professional Main specialty, if assigned
-
-            health_professional_obj = Pool().get('gnuhealth.healthprofessional')
-            health_professional = health_professional_obj.search(
-                [('id', '=', hp_party_id)], limit=1)[0]
-            hp_main_specialty = health_professional.main_specialty
-
-            if hp_main_specialty:
-                return hp_main_specialty.specialty.id
+        HealthProf = Pool().get('gnuhealth.healthprofessional')
+        return HealthProf.get_health_professional_specialty()
 
     def get_rec_name(self, name):
         return self.name
@@ -1856,6 +2223,21 @@ class Appointment(ModelSQL, ModelView):
         super(Appointment, cls).__register__(module_name)
 
 
+class ConfirmAppointment(Wizard):
+    'Confirm Appointments'
+    __name__ = 'gnuhealth.appointment.confirm'
+
+    start_state = 'confirm'
+    confirm = StateTransition()
+
+    def transition_confirm(self):
+        Appointment = Pool().get('gnuhealth.appointment')
+
+        Appointment.confirm(Appointment.browse(
+                Transaction().context.get('active_ids')))
+        return 'end'
+
+
 class AppointmentReport(ModelSQL, ModelView):
     'Appointment Report'
     __name__ = 'gnuhealth.appointment.report'
@@ -1864,16 +2246,14 @@ class AppointmentReport(ModelSQL, ModelView):
     ref = fields.Char('SSN')
     patient = fields.Many2One('gnuhealth.patient', 'Patient')
     healthprof = fields.Many2One('gnuhealth.healthprofessional', 'Health Prof')
-    age = fields.Function(fields.Char('Age'), 'get_patient_age')
+    age = fields.Char('Age', help='Age of the patient at the appointment')
     sex = fields.Selection([('m', 'Male'), ('f', 'Female')], 'Sex')
-    address = fields.Function(fields.Char('Address'), 'get_address')
-    insurance = fields.Function(fields.Char('Insurance'), 'get_insurance')
+    address = fields.Char('Address')
+    insurance = fields.Char('Insurance')
     appointment_date = fields.Date('Date')
     appointment_date_time = fields.DateTime('Date and Time')
-    diagnosis = fields.Function(
-        fields.Many2One(
-            'gnuhealth.pathology',
-            'Presumptive Diagnosis'), 'get_diagnosis')
+    diagnosis = fields.Many2One('gnuhealth.pathology',
+        'Presumptive Diagnosis')
 
     @classmethod
     def __setup__(cls):
@@ -1882,14 +2262,54 @@ class AppointmentReport(ModelSQL, ModelView):
 
     @classmethod
     def table_query(cls):
+        # The address, insurance, age and diagnosis are resolved here so
+        # the whole report is read with a single query
         pool = Pool()
         appointment = pool.get('gnuhealth.appointment').__table__()
         party = pool.get('party.party').__table__()
         patient = pool.get('gnuhealth.patient').__table__()
-        join1 = Join(appointment, patient)
-        join1.condition = join1.right.id == appointment.patient
-        join2 = Join(join1, party)
-        join2.condition = join2.right.id == join1.right.name
+        Address = pool.get('party.address')
+        address = Address.__table__()
+        party_address = Address.__table__()
+        subdivision = pool.get('country.subdivision').__table__()
+        country = pool.get('country.country').__table__()
+        insurance = pool.get('gnuhealth.insurance').__table__()
+        company = pool.get('party.party').__table__()
+        Evaluation = pool.get('gnuhealth.patient.evaluation')
+        evaluation = Evaluation.__table__()
+        appointment_evaluation = Evaluation.__table__()
+
+        # The address and the evaluation are correlated sub-queries, run
+        # only for the appointments selected instead of aggregating the
+        # whole address and evaluation tables
+        # First address of the party, by sequence
+        first_address = party_address.select(party_address.id,
+            where=(party_address.party == party.id)
+            & (party_address.active == True),
+            order_by=[party_address.sequence, party_address.id],
+            limit=1)
+        # Latest evaluation of the appointment
+        last_evaluation = appointment_evaluation.select(
+            Max(appointment_evaluation.id),
+            where=(appointment_evaluation.patient == appointment.patient)
+            & (appointment_evaluation.evaluation_date == appointment.id))
+
+        join = appointment.join(patient,
+            condition=patient.id == appointment.patient
+            ).join(party, condition=party.id == patient.name
+            ).join(address, 'LEFT',
+                condition=address.id == first_address
+            ).join(subdivision, 'LEFT',
+                condition=subdivision.id == address.subdivision
+            ).join(country, 'LEFT',
+                condition=country.id == address.country
+            ).join(insurance, 'LEFT',
+                condition=insurance.id == patient.current_insurance
+            ).join(company, 'LEFT',
+                condition=company.id == insurance.company
+            ).join(evaluation, 'LEFT',
+                condition=evaluation.id == last_evaluation)
+
         where = Literal(True)
         if Transaction().context.get('date_start'):
             where &= (appointment.appointment_date >=
@@ -1901,49 +2321,41 @@ class AppointmentReport(ModelSQL, ModelView):
             where &= \
                 appointment.healthprof == Transaction().context['healthprof']
 
-        return join2.select(
+        # Same format as the patient age, but at the appointment date
+        age = Age(appointment.appointment_date, party.dob)
+        patient_age = Case((party.dob == None, 'No DoB !'),
+            else_=Concat(Concat(Concat(Concat(Concat(
+                            Extract('YEAR', age), 'y '),
+                        Extract('MONTH', age)), 'm '),
+                    Extract('DAY', age)), 'd'))
+
+        full_address = ConcatWs(', ',
+            NullIf(address.street, ''),
+            NullIf(address.streetbis, ''),
+            NullIf(ConcatWs(' ', NullIf(address.zip, ''),
+                    NullIf(address.city, '')), ''),
+            subdivision.name,
+            country.name)
+
+        return join.select(
             appointment.id,
             appointment.create_uid,
             appointment.create_date,
             appointment.write_uid,
             appointment.write_date,
-            join1.right.identification_code,
-            join2.right.ref,
-            join1.right.id.as_('patient'),
-            join2.right.sex,
+            patient.identification_code,
+            party.ref,
+            patient.id.as_('patient'),
+            party.sex,
+            patient_age.as_('age'),
+            full_address.as_('address'),
+            company.name.as_('insurance'),
             appointment.appointment_date,
             appointment.appointment_date.as_('appointment_date_time'),
             appointment.healthprof,
+            evaluation.diagnosis,
             where=where)
 
-    def get_address(self, name):
-        res = ''
-        if self.patient.name.addresses:
-            res = self.patient.name.addresses[0].full_address
-        return res
-
-    def get_insurance(self, name):
-        res = ''
-        if self.patient.current_insurance:
-            res = self.patient.current_insurance.company.name
-        return res
-
-    def get_diagnosis(self, name):
-        Evaluation = Pool().get('gnuhealth.patient.evaluation')
-
-        res = None
-        evaluations = Evaluation.search([
-            ('evaluation_date', '=', self.id)
-        ])
-        if evaluations:
-            evaluation = evaluations[0]
-            if evaluation.diagnosis:
-                res = evaluation.diagnosis.id
-        return res
-
-    def get_patient_age(self, name):
-        return self.patient.age
-
 
 class OpenAppointmentReportStart(ModelView):
     'Open Appointment Report'
@@ -1963,7 +2375,8 @@ class OpenAppointmentReportStart(ModelView):
 
     @staticmethod
     def default_healthprof():
-        return HealthProfessional().get_health_professional()
+        HealthProf = Pool().get('gnuhealth.healthprofessional')
+        return HealthProf.get_health_professional()
 
 
 class OpenAppointmentReport(Wizard):
@@ -2360,7 +2773,8 @@ class PatientPrescriptionOrder(ModelSQL, ModelView):
 
     @staticmethod
     def default_healthprof():
-        return HealthProfessional().get_health_professional()
+        HealthProf = Pool().get('gnuhealth.healthprofessional')
+        return HealthProf.get_health_professional()
 
     # Method that makes the doctor to acknowledge if there is any
     # warning in the prescription
@@ -2390,15 +2804,14 @@ class PatientPrescriptionOrder(ModelSQL, ModelView):
 
     @classmethod
     def create(cls, vlist):
-        Sequence = Pool().get('ir.sequence')
         Config = Pool().get('gnuhealth.sequences')
 
         vlist = [x.copy() for x in vlist]
-        for values in vlist:
-            if not values.get('prescription_id'):
-                config = Config(1)
-                values['prescription_id'] = Sequence.get_id(
-                    config.prescription_sequence.id)
+        to_number = [x for x in vlist if not x.get('prescription_id')]
+        codes = Config.get_sequence_codes('prescription_sequence',
+            len(to_number))
+        for values, code in zip(to_number, codes):
+            values['prescription_id'] = code
 
         return super(PatientPrescriptionOrder, cls).create(vlist)
 
@@ -2610,7 +3023,7 @@ class PatientEvaluation(ModelSQL, ModelView):
     patient = fields.Many2One('gnuhealth.patient', 'Patient')
 
     evaluation_date = fields.Many2One(
-        'gnuhealth.appointment', 'Appointment',
+        'gnuhealth.appointment', 'Appointment', select=True,
         domain=[('patient', '=', Eval('patient'))], depends=['patient'],
         help='Enter or select the date / ID of the appointment related to'
         ' this evaluation')
@@ -2957,7 +3370,8 @@ class PatientEvaluation(ModelSQL, ModelView):
         # Change the state of the evaluation to "Done"
         # and write the name of the signing health professional
 
-        signing_hp = HealthProfessional().get_health_professional()
+        HealthProf = Pool().get('gnuhealth.healthprofessional')
+        signing_hp = HealthProf.get_health_professional()
         if not signing_hp:
             cls.raise_user_error(
                 "No health professional associated to this user !")
@@ -2968,7 +3382,8 @@ class PatientEvaluation(ModelSQL, ModelView):
 
     @staticmethod
     def default_healthprof():
-        return HealthProfessional().get_health_professional()
+        HealthProf = Pool().get('gnuhealth.healthprofessional')
+        return HealthProf.get_health_professional()
 
     @staticmethod
     def default_loc_eyes():
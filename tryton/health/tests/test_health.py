@@ -9,6 +9,8 @@ if os.path.isdir(DIR):
 import unittest
 import trytond.tests.test_tryton
 from trytond.tests.test_tryton import test_view, test_depends
+from trytond.tests.test_tryton import POOL, DB_NAME, USER, CONTEXT
+from trytond.transaction import Transaction
 
 
 class HealthTestCase(unittest.TestCase):
@@ -31,6 +33,47 @@ class HealthTestCase(unittest.TestCase):
         '''
         test_depends()
 
+    def test0010sequence_codes(self):
+        '''
+        Test the codes reserved from a sequence.
+        '''
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            SequenceType = POOL.get('ir.sequence.type')
+            Sequence = POOL.get('ir.sequence')
+            ModelField = POOL.get('ir.model.field')
+            Property = POOL.get('ir.property')
+            Config = POOL.get('gnuhealth.sequences')
+
+            with Transaction().set_user(0):
+                SequenceType.create([{
+                            'name': 'Patient',
+                            'code': 'gnuhealth.patient',
+                            }])
+                sequence, = Sequence.create([{
+                            'name': 'Patient',
+                            'code': 'gnuhealth.patient',
+                            'prefix': 'PAC',
+                            'padding': 3,
+                            }])
+                # The other sequences of the configuration are not needed
+                field, = ModelField.search([
+                        ('model.model', '=', 'gnuhealth.sequences'),
+                        ('name', '=', 'patient_sequence'),
+                        ])
+                Property.create([{
+                            'field': field.id,
+                            'value': 'ir.sequence,%s' % sequence.id,
+                            }])
+
+            self.assertEqual(Config.get_sequence_codes('patient_sequence', 0),
+                [])
+            self.assertEqual(Config.get_sequence_codes('patient_sequence', 3),
+                ['PAC001', 'PAC002', 'PAC003'])
+            self.assertEqual(Sequence.get_id(sequence.id), 'PAC004')
+
+            transaction.cursor.rollback()
+
 def suite():
     suite = trytond.tests.test_tryton.suite()
     suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
@@ -29,6 +29,7 @@ def register():
         User,
         Appointment,
         CreateAppointmentStart,
+        CreateAppointmentResult,
         module='health_calendar', type_='model')
     Pool.register(
         CreateAppointment,
@@ -18,9 +18,13 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 ##############################################################################
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from sql.functions import Now
 from trytond.model import fields
 from trytond.pyson import Eval, Not, Bool
 from trytond.pool import Pool, PoolMeta
+from trytond.transaction import Transaction
 
 
 __all__ = ['User', 'Appointment']
@@ -128,3 +132,108 @@ class Appointment:
             if appointment.event:
                 Event.delete([appointment.event])
         return super(Appointment, cls).delete(appointments)
+
+    @staticmethod
+    def generate_slots(healthprof, specialty, institution, date_start,
+            date_end, time_start, time_end, minutes, weekdays):
+        # Return the free slots of the work schedule.
+        # weekdays is the list of the week days (0 is monday) to include
+        slots = []
+        day_count = (date_end - date_start).days + 1
+        for single_date in (date_start + timedelta(n)
+                for n in range(day_count)):
+            if single_date.weekday() not in weekdays:
+                continue
+            dt = datetime.combine(single_date, time_start)
+            dt_end = datetime.combine(single_date, time_end)
+            while dt < dt_end:
+                slots.append({
+                    'healthprof': healthprof,
+                    'speciality': specialty,
+                    'institution': institution,
+                    'appointment_date': dt,
+                    'appointment_date_end': dt + timedelta(minutes=minutes),
+                    'state': 'free',
+                    })
+                dt += timedelta(minutes=minutes)
+        return slots
+
+    @classmethod
+    def create_free_slots(cls, slots):
+        # Bulk creation of free appointment slots.
+        # Free slots have no patient, sequence nor calendar event, so they
+        # are inserted directly in chunks, skipping the slots that overlap
+        # the existing appointments of the health professional.
+        # Return the number of created and skipped slots
+        pool = Pool()
+        ModelAccess = pool.get('ir.model.access')
+        cursor = Transaction().cursor
+        table = cls.__table__()
+
+        ModelAccess.check(cls.__name__, 'create')
+
+        by_healthprof = {}
+        for slot in slots:
+            by_healthprof.setdefault(slot['healthprof'], []).append(slot)
+
+        created = skipped = 0
+        for healthprof, hp_slots in by_healthprof.items():
+            hp_slots.sort(key=lambda x: x['appointment_date'])
+            busy = cls._get_busy_periods(healthprof,
+                hp_slots[0]['appointment_date'],
+                max(x['appointment_date_end'] for x in hp_slots))
+            starts = [x[0] for x in busy]
+
+            values = []
+            for slot in hp_slots:
+                start = slot['appointment_date']
+                end = slot['appointment_date_end']
+                # The busy periods are sorted and do not overlap, so only
+                # the last one starting before the end of the slot can
+                # overlap it
+                index = bisect_left(starts, end)
+                if index and busy[index - 1][1] > start:
+                    skipped += 1
+                    continue
+                values.append([Transaction().user, Now(), healthprof,
+                        slot.get('speciality'), slot.get('institution'),
+                        start, end, 'free', cls.default_urgency(),
+                        cls.default_appointment_type()])
+
+            for i in range(0, len(values), cursor.IN_MAX):
+                cursor.execute(*table.insert(
+                        columns=[table.create_uid, table.create_date,
+                            table.healthprof, table.speciality,
+                            table.institution, table.appointment_date,
+                            table.appointment_date_end, table.state,
+                            table.urgency, table.appointment_type],
+                        values=values[i:i + cursor.IN_MAX]))
+            created += len(values)
+        return created, skipped
+
+    @classmethod
+    def _get_busy_periods(cls, healthprof, date_start, date_end):
+        # Periods, sorted by start, taken by the not cancelled appointments
+        # of the health professional between the dates.
+        # Appointments without end are considered a single point in time
+        cursor = Transaction().cursor
+        table = cls.__table__()
+
+        cursor.execute(*table.select(table.appointment_date,
+                table.appointment_date_end,
+                where=(table.healthprof == healthprof)
+                & (table.appointment_date < date_end)
+                & ((table.appointment_date_end > date_start)
+                    | ((table.appointment_date_end == None)
+                        & (table.appointment_date >= date_start)))
+                & ~table.state.in_(['user_cancelled', 'center_cancelled']),
+                order_by=table.appointment_date.asc))
+        periods = []
+        for start, end in cursor.fetchall():
+            end = end or start + timedelta(microseconds=1)
+            # Merge the overlapping periods so they remain sorted by end
+            if periods and start <= periods[-1][1]:
+                periods[-1] = (periods[-1][0], max(periods[-1][1], end))
+            else:
+                periods.append((start, end))
+        return periods
@@ -18,14 +18,15 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 ##############################################################################
-from datetime import timedelta, datetime, time
+from datetime import datetime, time
 from trytond.model import ModelView, fields
 from trytond.wizard import Wizard, StateView, StateAction, StateTransition, \
     Button
 from trytond.pyson import PYSONEncoder
 from trytond.pool import Pool
 
-__all__ = ['CreateAppointmentStart', 'CreateAppointment']
+__all__ = ['CreateAppointmentStart', 'CreateAppointmentResult',
+    'CreateAppointment']
 
 
 class CreateAppointmentStart(ModelView):
@@ -61,6 +62,17 @@ class CreateAppointmentStart(ModelView):
             return specialty
 
 
+class CreateAppointmentResult(ModelView):
+    'Create Appointments Result'
+    __name__ = 'gnuhealth.calendar.create.appointment.result'
+
+    created = fields.Integer('Created', readonly=True,
+        help='Number of free appointments created')
+    skipped = fields.Integer('Skipped', readonly=True,
+        help='Number of appointments not created because they overlap'
+        ' existing appointments of the health professional')
+
+
 class CreateAppointment(Wizard):
     'Create Appointment'
     __name__ = 'gnuhealth.calendar.create.appointment'
@@ -71,41 +83,35 @@ class CreateAppointment(Wizard):
             Button('Create', 'create_', 'tryton-ok', default=True),
             ])
     create_ = StateTransition()
+    result = StateView('gnuhealth.calendar.create.appointment.result',
+        'health_calendar.create_appointment_result_view_form', [
+            Button('Close', 'end', 'tryton-close'),
+            Button('Open', 'open_', 'tryton-ok', default=True),
+            ])
     open_ = StateAction('health.action_gnuhealth_appointment_view')
 
     def transition_create_(self):
         Appointment = Pool().get('gnuhealth.appointment')
 
-        appointments = []
-        # Iterate over days
-        day_count = (self.start.date_end - self.start.date_start).days + 1
-        for single_date in (self.start.date_start + timedelta(n)
-            for n in range(day_count)):
-            if ((single_date.weekday() == 0 and self.start.monday)
-            or (single_date.weekday() == 1 and self.start.tuesday)
-            or (single_date.weekday() == 2 and self.start.wednesday)
-            or (single_date.weekday() == 3 and self.start.thursday)
-            or (single_date.weekday() == 4 and self.start.friday)
-            or (single_date.weekday() == 5 and self.start.saturday)
-            or (single_date.weekday() == 6 and self.start.sunday)):
-                # Iterate over time
-                dt = datetime.combine(single_date, self.start.time_start)
-                dt_end = datetime.combine(single_date, self.start.time_end)
-                while dt < dt_end:
-                    appointment = {
-                        'healthprof': self.start.healthprof.id,
-                        'speciality': self.start.specialty.id,
-                        'institution': self.start.institution.id,
-                        'appointment_date': dt,
-                        'appointment_date_end': dt +
-                            timedelta(minutes=self.start.appointment_minutes),
-                        'state': 'free',
-                        }
-                    appointments.append(appointment)
-                    dt += timedelta(minutes=self.start.appointment_minutes)
-        if appointments:
-            Appointment.create(appointments)
-        return 'open_'
+        weekdays = [weekday for weekday, day in enumerate([
+                    self.start.monday, self.start.tuesday,
+                    self.start.wednesday, self.start.thursday,
+                    self.start.friday, self.start.saturday,
+                    self.start.sunday]) if day]
+        slots = Appointment.generate_slots(self.start.healthprof.id,
+            self.start.specialty.id, self.start.institution.id,
+            self.start.date_start, self.start.date_end,
+            self.start.time_start, self.start.time_end,
+            self.start.appointment_minutes, weekdays)
+        self.result.created, self.result.skipped = \
+            Appointment.create_free_slots(slots)
+        return 'result'
+
+    def default_result(self, fields):
+        return {
+            'created': self.result.created,
+            'skipped': self.result.skipped,
+            }
 
     def do_open_(self, action):
         action['pyson_domain'] = [
@@ -21,10 +21,12 @@
 #
 ##############################################################################
 import datetime
+from sql.aggregate import Count
 from trytond.model import ModelView, ModelSQL, fields
 from trytond.pyson import Eval, Not, Bool
 from trytond.pool import Pool
 from trytond.transaction import Transaction
+from trytond.tools import reduce_ids
 
 
 __all__ = ['PatientPregnancy', 'PrenatalEvaluation', 'PuerperiumMonitor',
@@ -89,22 +91,35 @@ class PatientPregnancy(ModelSQL, ModelView):
         cls._error_messages.update({
             'patient_already_pregnant': 'Our records indicate that the patient'
                 ' is already pregnant !'})
+        # Partial unique index, safe under concurrent writes
+        cls._sql_constraints += [
+            ('name_current_pregnancy_uniq',
+                'EXCLUDE (name WITH =) WHERE (current_pregnancy)',
+                cls._error_messages['patient_already_pregnant']),
+            ]
 
     @classmethod
     def validate(cls, pregnancies):
         super(PatientPregnancy, cls).validate(pregnancies)
-        for pregnancy in pregnancies:
-            pregnancy.check_patient_current_pregnancy()
+        cls.check_patient_current_pregnancy(pregnancies)
 
-    def check_patient_current_pregnancy(self):
-        ''' Check for only one current pregnancy in the patient '''
+    @classmethod
+    def check_patient_current_pregnancy(cls, pregnancies):
+        ''' Check for only one current pregnancy in the patients
+        (one query for all the records, also without the index) '''
         cursor = Transaction().cursor
-        cursor.execute("SELECT count(name) "
-            "FROM " + self._table + "  \
-            WHERE (name = %s AND current_pregnancy)",
-            (str(self.name.id),))
-        if cursor.fetchone()[0] > 1:
-            self.raise_user_error('patient_already_pregnant')
+        table = cls.__table__()
+        names = list(set(p.name.id for p in pregnancies
+                if p.current_pregnancy))
+        for i in range(0, len(names), cursor.IN_MAX):
+            sub_names = names[i:i + cursor.IN_MAX]
+            cursor.execute(*table.select(table.name,
+                    where=reduce_ids(table.name, sub_names)
+                    & table.current_pregnancy,
+                    group_by=table.name, having=Count(table.id) > 1,
+                    limit=1))
+            if cursor.fetchone():
+                cls.raise_user_error('patient_already_pregnant')
 
     @staticmethod
     def default_current_pregnancy():
@@ -31,8 +31,13 @@ def register():
 		InpatientIcu,
 		Glasgow,
 		ApacheII,
+		Sofa,
 		MechanicalVentilation,
         ChestDrainageAssessment,
         ECG,
 		PatientRounding,
+        IcuUtilization,
         module='health_icu', type_='model')
+    Pool.register(
+        UpdateIcuScores,
+        module='health_icu', type_='wizard')
@@ -21,15 +21,128 @@
 #
 ##############################################################################
 from trytond.model import ModelView, ModelSQL, fields
+from trytond.wizard import Wizard, StateTransition
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
+from sql import Cast, Column
+from sql.aggregate import Avg, Count, Max, Min, Sum
+from sql.conditionals import Case, Coalesce, Greatest, Least
+from sql.functions import Function, Extract
 from trytond.transaction import Transaction
+from trytond.pool import Pool
 from trytond.pyson import Eval, Not, Bool, Equal
+from trytond.tools import reduce_ids
+from trytond.modules.health.health import DateTrunc
+
+from . import scoring
+from .scoring import APACHE2_FIELDS, GLASGOW_FIELDS, SOFA_FIELDS
 
 
 __all__ = ['InpatientRegistration', 'InpatientIcu', 'Glasgow', 'ApacheII',
-            'MechanicalVentilation', 'ChestDrainageAssessment', 'ECG',
-            'PatientRounding']
+            'Sofa', 'MechanicalVentilation', 'ChestDrainageAssessment',
+            'ECG', 'PatientRounding', 'UpdateIcuScores', 'IcuUtilization']
+
+
+class GenerateSeries(Function):
+    __slots__ = ()
+    _function = 'GENERATE_SERIES'
+
+
+def get_durations(Model, records, duration):
+    # Return the durations (hours) of records, computed in SQL by
+    # duration(table, now) by chunks of ids
+    cursor = Transaction().cursor
+    table = Model.__table__()
+    now = datetime.now()
+    ids = [r.id for r in records]
+    result = dict((i, None) for i in ids)
+    for i in range(0, len(ids), cursor.IN_MAX):
+        sub_ids = ids[i:i + cursor.IN_MAX]
+        cursor.execute(*table.select(table.id, duration(table, now),
+                where=reduce_ids(table.id, sub_ids)))
+        result.update(cursor.fetchall())
+    return result
+
+
+def search_durations(Model, clause, duration):
+    table = Model.__table__()
+    _, operator, value = clause
+    Operator = fields.SQL_OPERATORS[operator]
+    query = table.select(table.id,
+        where=Operator(duration(table, datetime.now()), value))
+    return [('id', 'in', query)]
+
+
+class IcuScoreMixin(object):
+    # Score stored in _score_field, computed by the function of the
+    # scoring engine named _score_function from the _score_inputs fields.
+    # The score is recomputed in bulk on create and write, and
+    # update_scores back-fills the historical records.
+    _score_field = None
+    _score_function = None
+    _score_inputs = []
+    _score_chunk = 10000
+
+    @classmethod
+    def compute_scores(cls, columns):
+        # Return the list of scores of the columns of _score_inputs
+        return getattr(scoring, cls._score_function)(columns)
+
+    def compute_score(self):
+        return self.compute_scores(dict((f, [getattr(self, f)])
+                for f in self._score_inputs))[0]
+
+    @classmethod
+    def create(cls, vlist):
+        records = super(IcuScoreMixin, cls).create(vlist)
+        cls.update_scores(records)
+        return records
+
+    @classmethod
+    def write(cls, records, values):
+        super(IcuScoreMixin, cls).write(records, values)
+        if set(cls._score_inputs + [cls._score_field]).intersection(values):
+            cls.update_scores(records)
+
+    @classmethod
+    def update_scores(cls, records=None):
+        # Recompute the scores of records (all the records when None)
+        # The inputs are read by chunks of ids and only the changed
+        # scores are written, with one UPDATE by chunk and score value.
+        # Return the number of updated records.
+        cursor = Transaction().cursor
+        table = cls.__table__()
+        score = Column(table, cls._score_field)
+        columns = [table.id, score] + [Column(table, f)
+            for f in cls._score_inputs]
+
+        if records is None:
+            cursor.execute(*table.select(table.id, order_by=table.id))
+            ids = [x for x, in cursor.fetchall()]
+        else:
+            ids = sorted(set(r.id for r in records))
+
+        updated = 0
+        for i in range(0, len(ids), cls._score_chunk):
+            sub_ids = ids[i:i + cls._score_chunk]
+            cursor.execute(*table.select(*columns,
+                    where=reduce_ids(table.id, sub_ids)))
+            rows = cursor.fetchall()
+            if not rows:
+                continue
+            values = list(zip(*rows))
+            scores = cls.compute_scores(dict(zip(cls._score_inputs,
+                        values[2:])))
+
+            to_write = {}
+            for id_, old, new in zip(values[0], values[1], scores):
+                if old != new:
+                    to_write.setdefault(new, []).append(id_)
+            for value, score_ids in to_write.items():
+                cursor.execute(*table.update([score], [value],
+                        where=reduce_ids(table.id, score_ids)))
+                updated += len(score_ids)
+        return updated
 
 
 class InpatientRegistration(ModelSQL, ModelView):
@@ -47,16 +160,11 @@ class InpatientIcu(ModelSQL, ModelView):
 
     def icu_duration(self, name):
 
-        now = datetime.now()
-        admission = datetime.strptime(str(self.icu_admission_date),
-            '%Y-%m-%d %H:%M:%S')
-
         if self.discharged_from_icu:
-            discharge = datetime.strptime(str(self.icu_discharge_date),
-                '%Y-%m-%d %H:%M:%S')
-            delta = relativedelta(discharge, admission)
+            delta = relativedelta(self.icu_discharge_date,
+                self.icu_admission_date)
         else:
-            delta = relativedelta(now, admission)
+            delta = relativedelta(datetime.now(), self.icu_admission_date)
         years_months_days = str(delta.years) + 'y ' \
                 + str(delta.months) + 'm ' \
                 + str(delta.days) + 'd'
@@ -77,6 +185,10 @@ class InpatientIcu(ModelSQL, ModelView):
             },
         depends=['discharged_from_icu'])
     icu_stay = fields.Function(fields.Char('Duration'), 'icu_duration')
+    icu_hours = fields.Function(fields.Float('Hours', digits=(16, 1),
+            help='Length of stay at ICU in hours, until now when the'
+            ' patient is still admitted'),
+        'get_icu_hours', searcher='search_icu_hours')
 
     mv_history = fields.One2Many('gnuhealth.icu.ventilation',
         'name', "Mechanical Ventilation History")
@@ -87,22 +199,52 @@ class InpatientIcu(ModelSQL, ModelView):
         cls._error_messages.update({
             'patient_already_at_icu': 'Our records indicate that the patient'
                 ' is already admitted at ICU'})
+        # Partial unique index, safe under concurrent admissions
+        cls._sql_constraints += [
+            ('name_admitted_uniq', 'EXCLUDE (name WITH =) WHERE (admitted)',
+                cls._error_messages['patient_already_at_icu']),
+            ]
 
     @classmethod
     def validate(cls, inpatients):
         super(InpatientIcu, cls).validate(inpatients)
-        for inpatient in inpatients:
-            inpatient.check_patient_admitted_at_icu()
+        cls.check_patient_admitted_at_icu(inpatients)
+
+    @staticmethod
+    def icu_hours_column(table, now):
+        # Length of stay in hours of the rows of table
+        end = Case((table.discharged_from_icu, table.icu_discharge_date),
+            else_=now)
+        return Extract('EPOCH', end - table.icu_admission_date) / 3600
+
+    @classmethod
+    def get_icu_hours(cls, icus, name):
+        return get_durations(cls, icus, cls.icu_hours_column)
 
-    def check_patient_admitted_at_icu(self):
-        # Verify that the patient is not at ICU already
+    @classmethod
+    def search_icu_hours(cls, name, clause):
+        return search_durations(cls, clause, cls.icu_hours_column)
+
+    @classmethod
+    def order_icu_hours(cls, tables):
+        table, _ = tables[None]
+        return [cls.icu_hours_column(table, datetime.now())]
+
+    @classmethod
+    def check_patient_admitted_at_icu(cls, inpatients):
+        # Verify that the patients are not at ICU already
+        # (one query for all the records, also without the index)
         cursor = Transaction().cursor
-        cursor.execute("SELECT count(name) "
-            "FROM " + self._table + "  \
-            WHERE (name = %s AND admitted)",
-            (str(self.name.id),))
-        if cursor.fetchone()[0] > 1:
-            self.raise_user_error('patient_already_at_icu')
+        table = cls.__table__()
+        names = list(set(i.name.id for i in inpatients if i.admitted))
+        for i in range(0, len(names), cursor.IN_MAX):
+            sub_names = names[i:i + cursor.IN_MAX]
+            cursor.execute(*table.select(table.name,
+                    where=reduce_ids(table.name, sub_names) & table.admitted,
+                    group_by=table.name, having=Count(table.id) > 1,
+                    limit=1))
+            if cursor.fetchone():
+                cls.raise_user_error('patient_already_at_icu')
 
     @staticmethod
     def default_admitted():
@@ -117,9 +259,12 @@ class InpatientIcu(ModelSQL, ModelView):
         return res
 
 
-class Glasgow(ModelSQL, ModelView):
+class Glasgow(IcuScoreMixin, ModelSQL, ModelView):
     'Glasgow Coma Scale'
     __name__ = 'gnuhealth.icu.glasgow'
+    _score_field = 'glasgow'
+    _score_function = 'glasgow_scores'
+    _score_inputs = GLASGOW_FIELDS
 
     name = fields.Many2One('gnuhealth.inpatient.registration',
         'Registration Code', required=True)
@@ -176,8 +321,7 @@ class Glasgow(ModelSQL, ModelView):
         return datetime.now()
 
     def on_change_with_glasgow(self):
-        return int(self.glasgow_motor) + int(self.glasgow_eyes) + \
-            int(self.glasgow_verbal)
+        return self.compute_score()
 
     # Return the Glasgow Score with each component
     def get_rec_name(self, name):
@@ -187,9 +331,12 @@ class Glasgow(ModelSQL, ModelView):
         return res
 
 
-class ApacheII(ModelSQL, ModelView):
+class ApacheII(IcuScoreMixin, ModelSQL, ModelView):
     'Apache II scoring'
     __name__ = 'gnuhealth.icu.apache2'
+    _score_field = 'apache_score'
+    _score_function = 'apache2_scores'
+    _score_inputs = APACHE2_FIELDS + ['paco2']
 
     name = fields.Many2One('gnuhealth.inpatient.registration',
         'Registration Code', required=True)
@@ -231,7 +378,7 @@ class ApacheII(ModelSQL, ModelView):
         ['age', 'temperature', 'mean_ap', 'heart_rate', 'respiratory_rate',
         'fio2', 'pao2', 'aado2', 'ph', 'serum_sodium', 'serum_potassium',
         'serum_creatinine', 'arf', 'wbc', 'hematocrit', 'gcs',
-        'chronic_condition', 'hospital_admission_type'])
+        'chronic_condition', 'hospital_admission_type', 'paco2'])
 
     #Default FiO2 PaO2 and PaCO2 so we do the A-a gradient
     #calculation with non-null values
@@ -242,171 +389,63 @@ class ApacheII(ModelSQL, ModelView):
         if (self.fio2 and self.paco2 and self.pao2):
             return (713 * self.fio2) - (self.paco2 / 0.8) - self.pao2
 
+    @classmethod
+    def compute_scores(cls, columns):
+        # The A-a gradient of the records created without the form
+        # is computed as in on_change_with_aado2
+        if 'aado2' in columns:
+            columns = columns.copy()
+            columns['aado2'] = [
+                a if a is not None or not (f and c and p)
+                else (713 * f) - (c / 0.8) - p
+                for a, f, c, p in zip(columns['aado2'], columns['fio2'],
+                    columns['paco2'], columns['pao2'])]
+        return super(ApacheII, cls).compute_scores(columns)
+
     def on_change_with_apache_score(self):
-    # Calculate the APACHE SCORE from the variables in the
-
-        total = 0
-        # Age
-        if (self.age):
-            if (self.age > 44 and self.age < 55):
-                total = total + 2
-            elif (self.age > 54 and self.age < 65):
-                total = total + 3
-            elif (self.age > 64 and self.age < 75):
-                total = total + 5
-            elif (self.age > 74):
-                total = total + 6
-
-        # Temperature
-        if (self.temperature):
-            if ((self.temperature >= 38.5 and self.temperature < 39) or
-                (self.temperature >= 34 and self.temperature < 36)):
-                    total = total + 1
-            elif (self.temperature >= 32 and self.temperature < 34):
-                total = total + 2
-            elif ((self.temperature >= 30 and self.temperature < 32) or
-                (self.temperature >= 39 and self.temperature < 41)):
-                total = total + 3
-            elif (self.temperature >= 41 or self.temperature < 30):
-                total = total + 4
-
-        # Mean Arterial Pressure (MAP)
-        if (self.mean_ap):
-            if ((self.mean_ap >= 110 and self.mean_ap < 130) or
-                (self.mean_ap >= 50 and self.mean_ap < 70)):
-                    total = total + 2
-            elif (self.mean_ap >= 130 and self.mean_ap < 160):
-                total = total + 3
-            elif (self.mean_ap >= 160 or self.mean_ap < 50):
-                total = total + 4
-
-        # Heart Rate
-        if (self.heart_rate):
-            if ((self.heart_rate >= 55 and self.heart_rate < 70) or
-                (self.heart_rate >= 110 and self.heart_rate < 140)):
-                    total = total + 2
-            elif ((self.heart_rate >= 40 and self.heart_rate < 55) or
-                (self.heart_rate >= 140 and self.heart_rate < 180)):
-                    total = total + 3
-            elif (self.heart_rate >= 180 or self.heart_rate < 40):
-                total = total + 4
-
-        # Respiratory Rate
-        if (self.respiratory_rate):
-            if ((self.respiratory_rate >= 10 and self.respiratory_rate < 12) or
-                (self.respiratory_rate >= 25 and self.respiratory_rate < 35)):
-                    total = total + 1
-            elif (self.respiratory_rate >= 6 and self.respiratory_rate < 10):
-                    total = total + 2
-            elif (self.respiratory_rate >= 35 and self.respiratory_rate < 50):
-                    total = total + 3
-            elif (self.respiratory_rate >= 50 or self.respiratory_rate < 6):
-                total = total + 4
-
-        # FIO2
-        if (self.fio2):
-            # If Fi02 is greater than 0.5, we measure the AaDO2 gradient
-            # Otherwise, we take into account the Pa02 value
-
-            if (self.fio2 >= 0.5):
-                if (self.aado2 >= 200 and self.aado2 < 350):
-                    total = total + 2
-
-                elif (self.aado2 >= 350 and self.aado2 < 500):
-                    total = total + 3
-
-                elif (self.aado2 >= 500):
-                    total = total + 4
+        # Calculate the APACHE SCORE from the variables in the form
+        return self.compute_score()
 
-            else:
-                if (self.pao2 >= 61 and self.pao2 < 71):
-                    total = total + 1
-
-                elif (self.pao2 >= 55 and self.pao2 < 61):
-                    total = total + 3
-
-                elif (self.pao2 < 55):
-                    total = total + 4
-
-        # Arterial pH
-        if (self.ph):
-            if (self.ph >= 7.5 and self.ph < 7.6):
-                    total = total + 1
-            elif (self.ph >= 7.25 and self.ph < 7.33):
-                    total = total + 2
-            elif ((self.ph >= 7.15 and self.ph < 7.25) or
-                (self.ph >= 7.6 and self.ph < 7.7)):
-                    total = total + 3
-            elif (self.ph >= 7.7 or self.ph < 7.15):
-                total = total + 4
-
-        # Serum Sodium
-        if (self.serum_sodium):
-            if (self.serum_sodium >= 150 and self.serum_sodium < 155):
-                    total = total + 1
-            elif ((self.serum_sodium >= 155 and self.serum_sodium < 160) or
-                (self.serum_sodium >= 120 and self.serum_sodium < 130)):
-                    total = total + 2
-            elif ((self.serum_sodium >= 160 and self.serum_sodium < 180) or
-                (self.serum_sodium >= 111 and self.serum_sodium < 120)):
-                    total = total + 3
-            elif (self.serum_sodium >= 180 or self.serum_sodium < 111):
-                total = total + 4
-
-        # Serum Potassium
-        if (self.serum_potassium):
-            if ((self.serum_potassium >= 3 and self.serum_potassium < 3.5) or
-                (self.serum_potassium >= 5.5 and self.serum_potassium < 6)):
-                    total = total + 1
-            elif (self.serum_potassium >= 2.5 and self.serum_potassium < 3):
-                total = total + 2
-            elif (self.serum_potassium >= 6 and self.serum_potassium < 7):
-                total = total + 3
-            elif (self.serum_potassium >= 7 or self.serum_potassium < 2.5):
-                total = total + 4
-
-        # Serum Creatinine
-        if (self.serum_creatinine):
-            arf_factor = 1
-            if (self.arf):
-            # We multiply by 2 the score if there is concomitant ARF
-                arf_factor = 2
-            if ((self.serum_creatinine < 0.6) or
-                (self.serum_creatinine >= 1.5 and self.serum_creatinine < 2)):
-                    total = total + 2 * arf_factor
-            elif (self.serum_creatinine >= 2 and self.serum_creatinine < 3.5):
-                total = total + 3 * arf_factor
-            elif (self.serum_creatinine >= 3.5):
-                total = total + 4 * arf_factor
-
-        # Hematocrit
-        if (self.hematocrit):
-            if (self.hematocrit >= 46 and self.hematocrit < 50):
-                total = total + 1
-            elif ((self.hematocrit >= 50 and self.hematocrit < 60) or
-                (self.hematocrit >= 20 and self.hematocrit < 30)):
-                    total = total + 2
-            elif (self.hematocrit >= 60 or self.hematocrit < 20):
-                total = total + 4
-
-        # WBC ( x 1000 )
-        if (self.wbc):
-            if (self.wbc >= 15 and self.wbc < 20):
-                total = total + 1
-            elif ((self.wbc >= 20 and self.wbc < 40) or
-                (self.wbc >= 1 and self.wbc < 3)):
-                    total = total + 2
-            elif (self.wbc >= 40 or self.wbc < 1):
-                total = total + 4
-
-        # Immnunocompromised or severe organ failure
-        if (self.chronic_condition):
-            if (self.hospital_admission_type == 'me'):
-                total = total + 5
-            else:
-                total = total + 2
 
-        return total
+class Sofa(IcuScoreMixin, ModelSQL, ModelView):
+    'SOFA scoring'
+    __name__ = 'gnuhealth.icu.sofa'
+    _score_field = 'sofa_score'
+    _score_function = 'sofa_scores'
+    _score_inputs = SOFA_FIELDS
+
+    name = fields.Many2One('gnuhealth.inpatient.registration',
+        'Registration Code', required=True)
+    score_date = fields.DateTime('Date', help="Date of the score",
+        required=True)
+
+    pao2 = fields.Integer('PaO2')
+    fio2 = fields.Float('FiO2')
+    mechanical_ventilation = fields.Boolean('Respiratory support',
+        help='Mechanical ventilation or other respiratory support')
+    platelets = fields.Integer('Platelets', help='Platelets x 1000 / mm3')
+    bilirubin = fields.Float('Bilirubin', help='Bilirubin in mg/dl')
+    mean_ap = fields.Integer('MAP', help='Mean Arterial Pressure')
+    vasopressors = fields.Selection([
+        (None, ''),
+        ('low', 'Dopamine <= 5 or dobutamine (any dose)'),
+        ('medium', 'Dopamine > 5 or epinephrine / norepinephrine <= 0.1'),
+        ('high', 'Dopamine > 15 or epinephrine / norepinephrine > 0.1'),
+        ], 'Vasopressors', help='Doses in mcg/kg/min', sort=False)
+    gcs = fields.Integer('GSC', help='Last Glasgow Coma Scale')
+    serum_creatinine = fields.Float('Creatinine',
+        help='Creatinine in mg/dl')
+    urine_output = fields.Integer('Urine output',
+        help='Urine output in ml / day')
+
+    sofa_score = fields.Integer('Score', on_change_with=list(SOFA_FIELDS))
+
+    @staticmethod
+    def default_score_date():
+        return datetime.now()
+
+    def on_change_with_sofa_score(self):
+        return self.compute_score()
 
 
 class MechanicalVentilation(ModelSQL, ModelView):
@@ -416,17 +455,10 @@ class MechanicalVentilation(ModelSQL, ModelView):
     def mv_duration(self, name):
         # Calculate the Mechanical Ventilation time
         now = datetime.now()
-        mv_init = now
-        mv_finnish = now
-
-        if self.mv_start:
-            mv_init = datetime.strptime(str(self.mv_start),
-                '%Y-%m-%d %H:%M:%S')
+        mv_init = self.mv_start or now
 
         if self.mv_end:
-            mv_finnish = datetime.strptime(str(self.mv_end),
-                '%Y-%m-%d %H:%M:%S')
-            delta = relativedelta(mv_finnish, mv_init)
+            delta = relativedelta(self.mv_end, mv_init)
         else:
             delta = relativedelta(now, mv_init)
 
@@ -463,6 +495,10 @@ class MechanicalVentilation(ModelSQL, ModelView):
             },
         depends=['current_mv'])
     mv_period = fields.Function(fields.Char('Duration'), 'mv_duration')
+    mv_hours = fields.Function(fields.Float('Hours', digits=(16, 1),
+            help='Mechanical Ventilation time in hours, until now when'
+            ' it is not finished'),
+        'get_mv_hours', searcher='search_mv_hours')
     current_mv = fields.Boolean('Current')
     remarks = fields.Char('Remarks')
 
@@ -472,22 +508,53 @@ class MechanicalVentilation(ModelSQL, ModelView):
         cls._error_messages.update({
             'patient_already_on_mv': 'Our records indicate that the patient'
                 ' is already on Mechanical Ventilation !'})
+        # Partial unique index, safe under concurrent writes
+        cls._sql_constraints += [
+            ('name_current_mv_uniq',
+                'EXCLUDE (name WITH =) WHERE (current_mv)',
+                cls._error_messages['patient_already_on_mv']),
+            ]
 
     @classmethod
     def validate(cls, inpatients):
         super(MechanicalVentilation, cls).validate(inpatients)
-        for inpatient in inpatients:
-            inpatient.check_patient_current_mv()
+        cls.check_patient_current_mv(inpatients)
+
+    @staticmethod
+    def mv_hours_column(table, now):
+        # Mechanical Ventilation time in hours of the rows of table
+        return Extract('EPOCH', Coalesce(table.mv_end, now)
+            - Coalesce(table.mv_start, now)) / 3600
+
+    @classmethod
+    def get_mv_hours(cls, ventilations, name):
+        return get_durations(cls, ventilations, cls.mv_hours_column)
+
+    @classmethod
+    def search_mv_hours(cls, name, clause):
+        return search_durations(cls, clause, cls.mv_hours_column)
+
+    @classmethod
+    def order_mv_hours(cls, tables):
+        table, _ = tables[None]
+        return [cls.mv_hours_column(table, datetime.now())]
 
-    def check_patient_current_mv(self):
+    @classmethod
+    def check_patient_current_mv(cls, ventilations):
         # Check for only one current mechanical ventilation on patient
+        # (one query for all the records, also without the index)
         cursor = Transaction().cursor
-        cursor.execute("SELECT count(name) "
-            "FROM " + self._table + "  \
-            WHERE (name = %s AND current_mv)",
-            (str(self.name.id),))
-        if cursor.fetchone()[0] > 1:
-            self.raise_user_error('patient_already_on_mv')
+        table = cls.__table__()
+        names = list(set(v.name.id for v in ventilations if v.current_mv))
+        for i in range(0, len(names), cursor.IN_MAX):
+            sub_names = names[i:i + cursor.IN_MAX]
+            cursor.execute(*table.select(table.name,
+                    where=reduce_ids(table.name, sub_names)
+                    & table.current_mv,
+                    group_by=table.name, having=Count(table.id) > 1,
+                    limit=1))
+            if cursor.fetchone():
+                cls.raise_user_error('patient_already_on_mv')
 
     @staticmethod
     def default_current_mv():
@@ -753,3 +820,162 @@ class PatientRounding(ModelSQL, ModelView):
     @staticmethod
     def default_pupil_dilation():
         return 'normal'
+
+
+class IcuUtilization(ModelSQL, ModelView):
+    'ICU Utilization'
+    __name__ = 'gnuhealth.icu.utilization'
+
+    month = fields.Date('Month')
+    admissions = fields.Integer('Admissions',
+        help='ICU admissions of the month')
+    discharges = fields.Integer('Discharges',
+        help='ICU discharges of the month')
+    patient_days = fields.Float('Patient Days', digits=(16, 1),
+        help='Days spent at ICU during the month by all the patients')
+    mean_los = fields.Float('Mean LOS', digits=(16, 1),
+        help='Mean length of stay in days of the patients discharged'
+        ' during the month')
+    median_los = fields.Function(fields.Float('Median LOS', digits=(16, 1),
+            help='Median length of stay in days of the patients'
+            ' discharged during the month'),
+        'get_median_los')
+    ventilator_days = fields.Float('Ventilator Days', digits=(16, 1),
+        help='Days of Mechanical Ventilation during the month')
+
+    @classmethod
+    def __setup__(cls):
+        super(IcuUtilization, cls).__setup__()
+        cls._order.insert(0, ('month', 'DESC'))
+
+    @staticmethod
+    def months_query(now):
+        # The months from the first ICU admission to the current one.
+        # They are generated by the database so that the months without
+        # any admission or discharge are still reported.
+        icu = Pool().get('gnuhealth.inpatient.icu').__table__()
+
+        first = Coalesce(Min(icu.icu_admission_date), now)
+        series = icu.select(GenerateSeries(DateTrunc('month', first),
+                DateTrunc('month', now), '1 month').as_('month'))
+        return series.select(
+            Cast(Extract('YEAR', series.month) * 100
+                + Extract('MONTH', series.month), 'INTEGER').as_('id'),
+            Cast(series.month, 'DATE').as_('month'),
+            Cast(series.month + '1 month', 'DATE').as_('month_end'))
+
+    @staticmethod
+    def overlap_days(start, end, months):
+        # Days of the period [start, end[ during the month
+        return Extract('EPOCH', Least(end, months.month_end)
+            - Greatest(start, months.month)) / 86400
+
+    @classmethod
+    def table_query(cls):
+        pool = Pool()
+        InpatientIcu = pool.get('gnuhealth.inpatient.icu')
+        MechanicalVentilation = pool.get('gnuhealth.icu.ventilation')
+        icu = InpatientIcu.__table__()
+        ventilation = MechanicalVentilation.__table__()
+        now = datetime.now()
+
+        months = cls.months_query(now)
+        icu_end = Case((icu.discharged_from_icu, icu.icu_discharge_date),
+            else_=now)
+        discharged = (icu.discharged_from_icu
+            & (icu.icu_discharge_date >= months.month)
+            & (icu.icu_discharge_date < months.month_end))
+        stays = months.join(icu, 'LEFT',
+            condition=(icu.icu_admission_date < months.month_end)
+            & (icu_end > months.month)).select(
+            months.id, months.month,
+            Max(icu.create_uid).as_('create_uid'),
+            Max(icu.create_date).as_('create_date'),
+            Max(icu.write_uid).as_('write_uid'),
+            Max(icu.write_date).as_('write_date'),
+            Sum(Case((icu.icu_admission_date >= months.month, 1),
+                    else_=0)).as_('admissions'),
+            Sum(Case((discharged, 1), else_=0)).as_('discharges'),
+            # The months without any stay are joined to NULL columns
+            Sum(Case((icu.id != None, cls.overlap_days(
+                            icu.icu_admission_date, icu_end, months)),
+                    else_=0)).as_('patient_days'),
+            Avg(Case((discharged,
+                        InpatientIcu.icu_hours_column(icu, now) / 24))
+                ).as_('mean_los'),
+            group_by=[months.id, months.month])
+
+        months = cls.months_query(now)
+        mv_start = Coalesce(ventilation.mv_start, now)
+        mv_end = Coalesce(ventilation.mv_end, now)
+        ventilations = months.join(ventilation, 'LEFT',
+            condition=(mv_start < months.month_end)
+            & (mv_end > months.month)).select(
+            months.id,
+            Sum(Case((ventilation.id != None,
+                        cls.overlap_days(mv_start, mv_end, months)),
+                    else_=0)).as_('ventilator_days'),
+            group_by=[months.id])
+
+        return stays.join(ventilations,
+            condition=stays.id == ventilations.id).select(
+            stays.id,
+            stays.create_uid,
+            stays.create_date,
+            stays.write_uid,
+            stays.write_date,
+            stays.month,
+            stays.admissions,
+            stays.discharges,
+            stays.patient_days,
+            stays.mean_los,
+            ventilations.ventilator_days)
+
+    @classmethod
+    def get_median_los(cls, lines, name):
+        # The lengths of stay of all the months are read at once
+        pool = Pool()
+        InpatientIcu = pool.get('gnuhealth.inpatient.icu')
+        cursor = Transaction().cursor
+        icu = InpatientIcu.__table__()
+
+        result = dict((l.id, None) for l in lines)
+        if not lines:
+            return result
+        start = min(l.month for l in lines)
+        end = max(l.month for l in lines) + relativedelta(months=1)
+        cursor.execute(*icu.select(icu.icu_discharge_date,
+                InpatientIcu.icu_hours_column(icu, datetime.now()) / 24,
+                where=icu.discharged_from_icu
+                & (icu.icu_discharge_date >= start)
+                & (icu.icu_discharge_date < end)))
+        stays = {}
+        for discharge, days in cursor.fetchall():
+            stays.setdefault((discharge.year, discharge.month),
+                []).append(days)
+
+        for line in lines:
+            days = sorted(stays.get((line.month.year, line.month.month), []))
+            if not days:
+                continue
+            middle = len(days) // 2
+            if len(days) % 2:
+                result[line.id] = days[middle]
+            else:
+                result[line.id] = (days[middle - 1] + days[middle]) / 2
+        return result
+
+
+class UpdateIcuScores(Wizard):
+    'Update ICU Scores'
+    __name__ = 'gnuhealth.icu.scores.update'
+
+    start_state = 'update'
+    update = StateTransition()
+
+    def transition_update(self):
+        pool = Pool()
+        for model in ('gnuhealth.icu.glasgow', 'gnuhealth.icu.apache2',
+                'gnuhealth.icu.sofa'):
+            pool.get(model).update_scores()
+        return 'end'
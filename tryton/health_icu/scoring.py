@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    GNU Health: The Free Health and Hospital Information System
+#    Copyright (C) 2008-2014 Luis Falcon <lfalcon@gnusolidario.org>
+#    Copyright (C) 2011-2014 GNU Solidario <health@gnusolidario.org>
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+# Scoring engine of the ICU scales (APACHE II, Glasgow Coma Scale, SOFA)
+#
+# The thresholds of each variable are data : a Thresholds table holds the
+# ordered lower bounds of the ranges and the points of each range.
+# The scores are evaluated by columns (one list of values per variable,
+# all the lists of the same length) so a whole ICU population is scored
+# with a few passes over the lists, and a single record is only a
+# population of one.
+
+from bisect import bisect_right
+from operator import add
+
+__all__ = ['Thresholds', 'APACHE2_THRESHOLDS', 'APACHE2_FIELDS',
+    'GLASGOW_FIELDS', 'SOFA_THRESHOLDS', 'SOFA_FIELDS',
+    'apache2_scores', 'apache2_score', 'glasgow_scores', 'glasgow_score',
+    'sofa_scores', 'sofa_score']
+
+
+class Thresholds(object):
+    'Points of a variable by range of values'
+
+    def __init__(self, bounds, points):
+        # bounds are the ascending lower bounds of the ranges (included)
+        # points has one more item, the points below the first bound
+        assert len(points) == len(bounds) + 1
+        assert list(bounds) == sorted(bounds)
+        self.bounds = tuple(bounds)
+        self.points = tuple(points)
+
+    def score(self, value):
+        if value is None:
+            return 0
+        return self.points[bisect_right(self.bounds, value)]
+
+    def score_column(self, values, skip_zero=False):
+        # Missing values (None) don't add points, nor zeros with skip_zero
+        # The measures of a population repeat a lot (integers or a few
+        # decimals) so each distinct value is only scored once
+        bounds, points = self.bounds, self.points
+        scores = dict((v, points[bisect_right(bounds, v)])
+            for v in set(values) if v is not None)
+        scores[None] = 0
+        if skip_zero:
+            scores[0] = 0
+        return list(map(scores.__getitem__, values))
+
+
+def _add(totals, points):
+    return list(map(add, totals, points))
+
+
+def _length(columns, fields):
+    lengths = set(len(columns[f]) for f in fields if f in columns)
+    assert len(lengths) <= 1, 'columns of different lengths'
+    return lengths.pop() if lengths else 0
+
+
+# APACHE II
+# The age is in years, the temperature in Celsius, MAP in mmHg,
+# PaO2 and A-a DO2 in mmHg, the creatinine in mg/dl, WBC x 1000
+
+APACHE2_THRESHOLDS = {
+    'age': Thresholds([45, 55, 65, 75], [0, 2, 3, 5, 6]),
+    'temperature': Thresholds([30, 32, 34, 36, 38.5, 39, 41],
+        [4, 3, 2, 1, 0, 1, 3, 4]),
+    'mean_ap': Thresholds([50, 70, 110, 130, 160], [4, 2, 0, 2, 3, 4]),
+    'heart_rate': Thresholds([40, 55, 70, 110, 140, 180],
+        [4, 3, 2, 0, 2, 3, 4]),
+    'respiratory_rate': Thresholds([6, 10, 12, 25, 35, 50],
+        [4, 2, 1, 0, 1, 3, 4]),
+    # Oxygenation : A-a DO2 when FiO2 >= 0.5, PaO2 otherwise
+    'aado2': Thresholds([200, 350, 500], [0, 2, 3, 4]),
+    'pao2': Thresholds([55, 61, 71], [4, 3, 1, 0]),
+    'ph': Thresholds([7.15, 7.25, 7.33, 7.5, 7.6, 7.7],
+        [4, 3, 2, 0, 1, 3, 4]),
+    'serum_sodium': Thresholds([111, 120, 130, 150, 155, 160, 180],
+        [4, 3, 2, 0, 1, 2, 3, 4]),
+    'serum_potassium': Thresholds([2.5, 3, 3.5, 5.5, 6, 7],
+        [4, 2, 1, 0, 1, 3, 4]),
+    # Doubled on acute renal failure
+    'serum_creatinine': Thresholds([0.6, 1.5, 2, 3.5], [2, 0, 2, 3, 4]),
+    'hematocrit': Thresholds([20, 30, 46, 50, 60], [4, 2, 0, 1, 2, 4]),
+    'wbc': Thresholds([1, 3, 15, 20, 40], [4, 2, 0, 1, 2, 4]),
+    }
+
+# The variables scored directly from their thresholds
+_APACHE2_DIRECT = ['age', 'temperature', 'mean_ap', 'heart_rate',
+    'respiratory_rate', 'ph', 'serum_sodium', 'serum_potassium',
+    'hematocrit', 'wbc']
+
+APACHE2_FIELDS = _APACHE2_DIRECT + ['fio2', 'pao2', 'aado2',
+    'serum_creatinine', 'arf', 'chronic_condition',
+    'hospital_admission_type']
+
+# Points of the chronic health evaluation by hospital admission type
+APACHE2_CHRONIC_POINTS = {'me': 5}
+APACHE2_CHRONIC_DEFAULT = 2
+
+
+def apache2_scores(columns):
+    # Return the list of APACHE II scores of the rows given by columns,
+    # a dictionary of lists of values keyed by APACHE2_FIELDS.
+    # As in the form, a variable that is not set (or zero) adds no point.
+    size = _length(columns, APACHE2_FIELDS)
+    none = [None] * size
+
+    totals = [0] * size
+    for name in _APACHE2_DIRECT:
+        totals = _add(totals, APACHE2_THRESHOLDS[name].score_column(
+                columns.get(name, none), skip_zero=True))
+
+    # Only FiO2 must be set, a zero PaO2 scores as a low PaO2
+    aado2 = APACHE2_THRESHOLDS['aado2'].score_column(
+        columns.get('aado2', none))
+    pao2 = APACHE2_THRESHOLDS['pao2'].score_column(columns.get('pao2', none))
+    totals = _add(totals, [(a if f >= 0.5 else p) if f else 0
+            for f, a, p in zip(columns.get('fio2', none), aado2, pao2)])
+
+    creatinine = APACHE2_THRESHOLDS['serum_creatinine'].score_column(
+        columns.get('serum_creatinine', none), skip_zero=True)
+    totals = _add(totals, [c * 2 if arf else c
+            for c, arf in zip(creatinine, columns.get('arf', none))])
+
+    totals = _add(totals, [
+            APACHE2_CHRONIC_POINTS.get(t, APACHE2_CHRONIC_DEFAULT)
+            if c else 0
+            for c, t in zip(columns.get('chronic_condition', none),
+                columns.get('hospital_admission_type', none))])
+    return totals
+
+
+def apache2_score(values):
+    # APACHE II score of one row given as a dictionary
+    return apache2_scores(dict((k, [v]) for k, v in values.items()))[0]
+
+
+# Glasgow Coma Scale
+# The components are stored as the selection keys '1' to '6'
+
+GLASGOW_FIELDS = ['glasgow_eyes', 'glasgow_verbal', 'glasgow_motor']
+
+
+def glasgow_scores(columns):
+    size = _length(columns, GLASGOW_FIELDS)
+    totals = [0] * size
+    for name in GLASGOW_FIELDS:
+        values = columns.get(name, [None] * size)
+        points = dict((v, int(v)) for v in set(values) if v)
+        points[None] = 0
+        totals = _add(totals, list(map(points.__getitem__, values)))
+    return totals
+
+
+def glasgow_score(values):
+    return glasgow_scores(dict((k, [v]) for k, v in values.items()))[0]
+
+
+# SOFA : Sequential Organ Failure Assessment
+# PaO2 / FiO2 in mmHg, platelets x 1000 / mm3, bilirubin and creatinine
+# in mg/dl, MAP in mmHg, urine output in ml / day
+
+SOFA_THRESHOLDS = {
+    'pao2_fio2': Thresholds([100, 200, 300, 400], [4, 3, 2, 1, 0]),
+    'platelets': Thresholds([20, 50, 100, 150], [4, 3, 2, 1, 0]),
+    'bilirubin': Thresholds([1.2, 2, 6, 12], [0, 1, 2, 3, 4]),
+    'mean_ap': Thresholds([70], [1, 0]),
+    'gcs': Thresholds([6, 10, 13, 15], [4, 3, 2, 1, 0]),
+    'serum_creatinine': Thresholds([1.2, 2, 3.5, 5], [0, 1, 2, 3, 4]),
+    'urine_output': Thresholds([200, 500], [4, 3, 0]),
+    }
+
+# Cardiovascular points of the vasopressors (doses in mcg/kg/min)
+SOFA_VASOPRESSOR_POINTS = {
+    'low': 2,       # dopamine <= 5 or dobutamine (any dose)
+    'medium': 3,    # dopamine > 5 or epinephrine / norepinephrine <= 0.1
+    'high': 4,      # dopamine > 15 or epinephrine / norepinephrine > 0.1
+    }
+
+# Without respiratory support the respiration points are at most 2
+SOFA_RESPIRATION_UNSUPPORTED_MAX = 2
+
+SOFA_FIELDS = ['pao2', 'fio2', 'mechanical_ventilation', 'platelets',
+    'bilirubin', 'mean_ap', 'vasopressors', 'gcs', 'serum_creatinine',
+    'urine_output']
+
+
+def sofa_scores(columns):
+    # Return the list of SOFA scores of the rows given by columns.
+    # Each organ system adds the points of its worst variable,
+    # a variable that is not set adds no point.
+    size = _length(columns, SOFA_FIELDS)
+    none = [None] * size
+
+    def column(name):
+        return columns.get(name, none)
+
+    # Respiration
+    ratios = [p / f if p is not None and f else None
+        for p, f in zip(column('pao2'), column('fio2'))]
+    respiration = SOFA_THRESHOLDS['pao2_fio2'].score_column(ratios)
+    totals = [r if mv else min(r, SOFA_RESPIRATION_UNSUPPORTED_MAX)
+        for r, mv in zip(respiration, column('mechanical_ventilation'))]
+
+    # Coagulation and liver
+    for name in ('platelets', 'bilirubin'):
+        totals = _add(totals,
+            SOFA_THRESHOLDS[name].score_column(column(name)))
+
+    # Cardiovascular
+    totals = _add(totals, [max(m, SOFA_VASOPRESSOR_POINTS.get(v, 0))
+            for m, v in zip(
+                SOFA_THRESHOLDS['mean_ap'].score_column(column('mean_ap')),
+                column('vasopressors'))])
+
+    # Central nervous system
+    totals = _add(totals, SOFA_THRESHOLDS['gcs'].score_column(column('gcs')))
+
+    # Renal
+    totals = _add(totals, [max(c, u) for c, u in zip(
+                SOFA_THRESHOLDS['serum_creatinine'].score_column(
+                    column('serum_creatinine')),
+                SOFA_THRESHOLDS['urine_output'].score_column(
+                    column('urine_output')))])
+    return totals
+
+
+def sofa_score(values):
+    return sofa_scores(dict((k, [v]) for k, v in values.items()))[0]
@@ -7,8 +7,12 @@ if os.path.isdir(DIR):
     sys.path.insert(0, os.path.dirname(DIR))
 
 import unittest
+from datetime import date
 import trytond.tests.test_tryton
 from trytond.tests.test_tryton import test_view, test_depends
+from trytond.tests.test_tryton import POOL, DB_NAME, USER, CONTEXT
+from trytond.transaction import Transaction
+from trytond.config import CONFIG
 
 
 class HealthIcuTestCase(unittest.TestCase):
@@ -31,6 +35,45 @@ class HealthIcuTestCase(unittest.TestCase):
         '''
         test_depends()
 
+    def test0007compute_scores(self):
+        '''
+        Test the scores computed by the ICU score models.
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            Glasgow = POOL.get('gnuhealth.icu.glasgow')
+            Sofa = POOL.get('gnuhealth.icu.sofa')
+
+            self.assertEqual(Glasgow.compute_scores({
+                        'glasgow_eyes': ['4', '1'],
+                        'glasgow_verbal': ['5', None],
+                        'glasgow_motor': ['6', '1'],
+                        }), [15, 2])
+            self.assertEqual(Sofa.compute_scores({
+                        'platelets': [200, None],
+                        }), [0, 0])
+
+    @unittest.skipIf(CONFIG['db_type'] != 'postgresql',
+        'The ICU utilization uses PostgreSQL functions')
+    def test0010utilization(self):
+        '''
+        Test the ICU utilization report.
+        '''
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            Utilization = POOL.get('gnuhealth.icu.utilization')
+
+            # Without ICU stays only the current month is reported
+            lines = Utilization.search([])
+            self.assertEqual(len(lines), 1)
+            line, = lines
+            self.assertEqual(line.month, date.today().replace(day=1))
+            self.assertEqual(line.admissions, 0)
+            self.assertEqual(line.patient_days, 0)
+            self.assertEqual(line.ventilator_days, 0)
+            self.assertEqual(line.median_los, None)
+
+            transaction.cursor.rollback()
+
 def suite():
     suite = trytond.tests.test_tryton.suite()
     suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
@@ -34,10 +34,13 @@ def register():
         ImagingTest,
         ImagingTestRequest,
         ImagingTestResult,
+        GenerateResultsBatchStart,
+        GenerateResultsBatchResult,
         RequestImagingTest,
         RequestPatientImagingTestStart,
         module='health_imaging', type_='model')
     Pool.register(
         WizardGenerateResult,
+        GenerateResultsBatch,
         RequestPatientImagingTest,
         module='health_imaging', type_='wizard')
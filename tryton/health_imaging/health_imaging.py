@@ -24,6 +24,7 @@ from trytond.model import Workflow, ModelView, ModelSingleton, ModelSQL, fields
 from trytond.pyson import Eval
 from trytond.transaction import Transaction
 from trytond.pool import Pool
+from trytond.config import CONFIG
 
 
 __all__ = [
@@ -89,6 +90,9 @@ class ImagingTestRequest(Workflow, ModelSQL, ModelView):
     request = fields.Char('Request', readonly=True)
     urgent = fields.Boolean('Urgent')
 
+    # Rows by statement of the multi-row inserts of create_results
+    _insert_chunk = 1000
+
     @classmethod
     def __setup__(cls):
         super(ImagingTestRequest, cls).__setup__()
@@ -117,31 +121,19 @@ class ImagingTestRequest(Workflow, ModelSQL, ModelView):
 
     @staticmethod
     def default_doctor():
-        cursor = Transaction().cursor
-        User = Pool().get('res.user')
-        user = User(Transaction().user)
-        login_user_id = int(user.id)
-        cursor.execute('SELECT id FROM party_party WHERE is_healthprof=True AND \
-            internal_user = %s LIMIT 1', (login_user_id,))
-        partner_id = cursor.fetchone()
-        if partner_id:
-            cursor = Transaction().cursor
-            cursor.execute('SELECT id FROM gnuhealth_healthprofessional WHERE \
-                name = %s LIMIT 1', (partner_id[0],))
-            doctor_id = cursor.fetchone()
-            return int(doctor_id[0])
+        HealthProf = Pool().get('gnuhealth.healthprofessional')
+        return HealthProf.get_health_professional()
 
     @classmethod
     def create(cls, vlist):
-        Sequence = Pool().get('ir.sequence')
         Config = Pool().get('gnuhealth.sequences')
 
         vlist = [x.copy() for x in vlist]
-        for values in vlist:
-            if not values.get('request'):
-                config = Config(1)
-                values['request'] = Sequence.get_id(
-                    config.imaging_request_sequence.id)
+        to_number = [x for x in vlist if not x.get('request')]
+        codes = Config.get_sequence_codes('imaging_request_sequence',
+            len(to_number))
+        for values, code in zip(to_number, codes):
+            values['request'] = code
 
         return super(ImagingTestRequest, cls).create(vlist)
 
@@ -170,6 +162,59 @@ class ImagingTestRequest(Workflow, ModelSQL, ModelView):
     def done(cls, requests):
         pass
 
+    @classmethod
+    def create_results(cls, requests, date=None):
+        '''Create the results of the requests that are not done, numbered
+        from the imaging sequence and inserted with multi-row inserts, then
+        set the requests done through their workflow (the draft requests
+        are requested first).
+        Return the list of the created result ids'''
+        pool = Pool()
+        Config = pool.get('gnuhealth.sequences')
+        Result = pool.get('gnuhealth.imaging.test.result')
+        ModelAccess = pool.get('ir.model.access')
+        cursor = Transaction().cursor
+        result = Result.__table__()
+        user = Transaction().user
+        now = datetime.now()
+
+        requests = [r for r in requests if r.state != 'done']
+        if not requests:
+            return []
+        ModelAccess.check(Result.__name__, 'create')
+        codes = Config.get_sequence_codes('imaging_sequence', len(requests))
+
+        values = [[user, now, code, r.patient.id, date or now, r.date,
+                r.requested_test.id, r.id, r.doctor.id]
+            for code, r in zip(codes, requests)]
+        columns = [result.create_uid, result.create_date, result.number,
+            result.patient, result.date, result.request_date,
+            result.requested_test, result.request, result.doctor]
+        # PostgreSQL returns the ids of the inserted rows
+        returning = CONFIG['db_type'] == 'postgresql'
+        ids = []
+        for i in range(0, len(values), cls._insert_chunk):
+            insert = result.insert(columns, values[i:i + cls._insert_chunk])
+            if returning:
+                insert.returning = [result.id]
+            cursor.execute(*insert)
+            if returning:
+                ids.extend(r[0] for r in cursor.fetchall())
+
+        if not returning:
+            # The numbers are unique, they give back the ids of the results
+            for i in range(0, len(codes), cursor.IN_MAX):
+                cursor.execute(*result.select(result.id,
+                        where=result.number.in_(codes[i:i + cursor.IN_MAX])))
+                ids.extend(r[0] for r in cursor.fetchall())
+
+        drafts = [r for r in requests if r.state == 'draft']
+        if drafts:
+            cls.requested(drafts)
+        # Read again the states changed by requested
+        cls.done(cls.browse([r.id for r in requests]))
+        return ids
+
 
 class ImagingTestResult(ModelSQL, ModelView):
     'Imaging Test Result'
@@ -189,16 +234,22 @@ class ImagingTestResult(ModelSQL, ModelView):
     comment = fields.Text('Comment')
     images = fields.One2Many('ir.attachment', 'resource', 'Images')
 
+    @classmethod
+    def __setup__(cls):
+        super(ImagingTestResult, cls).__setup__()
+        cls._sql_constraints += [
+            ('number_uniq', 'UNIQUE(number)',
+                'The result number must be unique'),
+            ]
+
     @classmethod
     def create(cls, vlist):
-        Sequence = Pool().get('ir.sequence')
         Config = Pool().get('gnuhealth.sequences')
 
         vlist = [x.copy() for x in vlist]
-        for values in vlist:
-            if not values.get('name'):
-                config = Config(1)
-                values['number'] = Sequence.get_id(
-                    config.imaging_sequence.id)
+        to_number = [x for x in vlist if not x.get('number')]
+        codes = Config.get_sequence_codes('imaging_sequence', len(to_number))
+        for values, code in zip(to_number, codes):
+            values['number'] = code
 
         return super(ImagingTestResult, cls).create(vlist)
@@ -7,8 +7,12 @@ if os.path.isdir(DIR):
     sys.path.insert(0, os.path.dirname(DIR))
 
 import unittest
+from datetime import date, datetime
+from decimal import Decimal
 import trytond.tests.test_tryton
 from trytond.tests.test_tryton import test_view, test_depends
+from trytond.tests.test_tryton import POOL, DB_NAME, USER, CONTEXT
+from trytond.transaction import Transaction
 
 
 class HealthImagingTestCase(unittest.TestCase):
@@ -31,6 +35,90 @@ class HealthImagingTestCase(unittest.TestCase):
         '''
         test_depends()
 
+    def test0010create_results(self):
+        '''
+        Test the creation of the results of the requests.
+        '''
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            ModelData = POOL.get('ir.model.data')
+            Uom = POOL.get('product.uom')
+            Template = POOL.get('product.template')
+            Party = POOL.get('party.party')
+            Patient = POOL.get('gnuhealth.patient')
+            HealthProf = POOL.get('gnuhealth.healthprofessional')
+            TestType = POOL.get('gnuhealth.imaging.test.type')
+            Test = POOL.get('gnuhealth.imaging.test')
+            Request = POOL.get('gnuhealth.imaging.test.request')
+            Result = POOL.get('gnuhealth.imaging.test.result')
+
+            unit = Uom(ModelData.get_id('product', 'uom_unit'))
+            template, = Template.create([{
+                        'name': 'Chest X-Ray',
+                        'type': 'service',
+                        'list_price': Decimal('20'),
+                        'cost_price': Decimal('10'),
+                        'default_uom': unit.id,
+                        'products': [('create', [{}])],
+                        }])
+            test_type, = TestType.create([{
+                        'name': 'X-Ray',
+                        'code': 'XR',
+                        }])
+            test, = Test.create([{
+                        'name': 'Chest X-Ray',
+                        'code': 'CXR',
+                        'test_type': test_type.id,
+                        'product': template.products[0].id,
+                        }])
+            patient_party, doctor_party = Party.create([{
+                        'name': 'Patient',
+                        'is_person': True,
+                        'is_patient': True,
+                        'sex': 'f',
+                        'activation_date': date.today(),
+                        }, {
+                        'name': 'Doctor',
+                        'is_person': True,
+                        'is_healthprof': True,
+                        'internal_user': USER,
+                        'sex': 'm',
+                        'activation_date': date.today(),
+                        }])
+            patient, = Patient.create([{
+                        'name': patient_party.id,
+                        'identification_code': 'PAC001',
+                        }])
+            doctor, = HealthProf.create([{'name': doctor_party.id}])
+
+            requests = Request.create([{
+                        'patient': patient.id,
+                        'requested_test': test.id,
+                        'doctor': doctor.id,
+                        } for i in range(3)])
+            Request.requested(requests[:1])
+            done_ids = Request.create_results(requests[:1])
+            self.assertEqual(len(done_ids), 1)
+
+            # The done request is skipped, the draft ones are requested
+            # then done
+            result_ids = Request.create_results(Request.browse(
+                    [r.id for r in requests]),
+                date=datetime(2014, 1, 1, 10, 0))
+            self.assertEqual(len(result_ids), 2)
+            results = Result.browse(result_ids)
+            self.assertEqual(sorted(r.request.id for r in results),
+                sorted(r.id for r in requests[1:]))
+            self.assertEqual(len(set(r.number for r in results)), 2)
+            self.assertTrue(all(r.date == datetime(2014, 1, 1, 10, 0)
+                    and r.patient == patient and r.doctor == doctor
+                    for r in results))
+            self.assertEqual([r.state
+                    for r in Request.browse([r.id for r in requests])],
+                ['done', 'done', 'done'])
+
+            transaction.cursor.rollback()
+
 
 def suite():
     suite = trytond.tests.test_tryton.suite()
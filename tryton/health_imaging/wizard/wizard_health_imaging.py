@@ -20,6 +20,7 @@
 #
 ##############################################################################
 from datetime import datetime
+import time
 from trytond.model import ModelView, fields
 from trytond.wizard import Wizard, StateAction, StateTransition, StateView, \
     Button
@@ -27,8 +28,10 @@ from trytond.transaction import Transaction
 from trytond.pyson import PYSONEncoder
 from trytond.pool import Pool
 
-__all__ = ['WizardGenerateResult', 'RequestImagingTest',
-    'RequestPatientImagingTestStart', 'RequestPatientImagingTest']
+__all__ = ['WizardGenerateResult', 'GenerateResultsBatchStart',
+    'GenerateResultsBatchResult', 'GenerateResultsBatch',
+    'RequestImagingTest', 'RequestPatientImagingTestStart',
+    'RequestPatientImagingTest']
 
 
 class WizardGenerateResult(Wizard):
@@ -42,26 +45,88 @@ class WizardGenerateResult(Wizard):
         Request = pool.get('gnuhealth.imaging.test.request')
         Result = pool.get('gnuhealth.imaging.test.result')
 
-        request_data = []
         requests = Request.browse(Transaction().context.get('active_ids'))
-        for request in requests:
-            request_data.append({
-                'patient': request.patient.id,
-                'date': datetime.now(),
-                'request_date': request.date,
-                'requested_test': request.requested_test,
-                'request': request.id,
-                'doctor': request.doctor})
-        results = Result.create(request_data)
+        result_ids = Request.create_results(requests)
 
+        # The results of the requests already done are shown with the new
+        results = Result.search([('request', 'in', [r.id for r in requests])])
         action['pyson_domain'] = PYSONEncoder().encode(
-            [('id', 'in', [r.id for r in results])])
-
-        Request.requested(requests)
-        Request.done(requests)
+            [('id', 'in', list(set(result_ids) | set(r.id for r in results)))])
         return action, {}
 
 
+class GenerateResultsBatchStart(ModelView):
+    'Generate Imaging Results Batch Start'
+    __name__ = 'gnuhealth.imaging.test.result.batch.start'
+
+    date = fields.DateTime('Date', required=True,
+        help='Date of the results')
+    requests = fields.Integer('Requests', readonly=True,
+        help='Selected requests not done yet')
+
+    @staticmethod
+    def default_date():
+        return datetime.now()
+
+    @staticmethod
+    def default_requests():
+        Request = Pool().get('gnuhealth.imaging.test.request')
+        return Request.search_count([
+                ('id', 'in', Transaction().context.get('active_ids') or []),
+                ('state', '!=', 'done'),
+                ])
+
+
+class GenerateResultsBatchResult(ModelView):
+    'Generate Imaging Results Batch Result'
+    __name__ = 'gnuhealth.imaging.test.result.batch.result'
+
+    created = fields.Integer('Created Results', readonly=True)
+    skipped = fields.Integer('Skipped Requests', readonly=True,
+        help='Selected requests already done')
+    duration = fields.Float('Seconds', digits=(16, 2), readonly=True)
+    throughput = fields.Float('Requests per Second', digits=(16, 1),
+        readonly=True)
+
+
+class GenerateResultsBatch(Wizard):
+    'Generate Imaging Results Batch'
+    __name__ = 'gnuhealth.imaging.test.result.batch'
+
+    start = StateView('gnuhealth.imaging.test.result.batch.start',
+        'health_imaging.view_imaging_result_batch_start', [
+            Button('Cancel', 'end', 'tryton-cancel'),
+            Button('Generate Results', 'generate', 'tryton-ok', True),
+            ])
+    generate = StateTransition()
+    result = StateView('gnuhealth.imaging.test.result.batch.result',
+        'health_imaging.view_imaging_result_batch_result', [
+            Button('Close', 'end', 'tryton-close', True),
+            ])
+
+    def transition_generate(self):
+        Request = Pool().get('gnuhealth.imaging.test.request')
+
+        requests = Request.browse(Transaction().context.get('active_ids'))
+        start = time.time()
+        result_ids = Request.create_results(requests, date=self.start.date)
+        duration = time.time() - start
+
+        self.result.created = len(result_ids)
+        self.result.skipped = len(requests) - len(result_ids)
+        self.result.duration = duration
+        self.result.throughput = len(result_ids) / max(duration, 1e-6)
+        return 'result'
+
+    def default_result(self, fields):
+        return {
+            'created': self.result.created,
+            'skipped': self.result.skipped,
+            'duration': self.result.duration,
+            'throughput': self.result.throughput,
+            }
+
+
 class RequestImagingTest(ModelView):
     'Request - Test'
     __name__ = 'gnuhealth.request-imaging-test'
@@ -95,19 +160,8 @@ class RequestPatientImagingTestStart(ModelView):
 
     @staticmethod
     def default_doctor():
-        cursor = Transaction().cursor
-        User = Pool().get('res.user')
-        user = User(Transaction().user)
-        login_user_id = int(user.id)
-        cursor.execute('SELECT id FROM party_party WHERE is_healthprof=True AND'
-            ' internal_user = %s LIMIT 1', (login_user_id,))
-        partner_id = cursor.fetchone()
-        if partner_id:
-            cursor = Transaction().cursor
-            cursor.execute('SELECT id FROM gnuhealth_healthprofessional WHERE '
-                'name = %s LIMIT 1', (partner_id[0],))
-            doctor_id = cursor.fetchone()
-            return int(doctor_id[0])
+        HealthProf = Pool().get('gnuhealth.healthprofessional')
+        return HealthProf.get_health_professional()
 
 
 class RequestPatientImagingTest(Wizard):
@@ -32,6 +32,8 @@ def register():
         DietTherapeutic,
         DietBelief,
         InpatientRegistration,
+        HospitalBed,
+        InpatientCensus,
         BedTransfer,
         Appointment,
         PatientData,
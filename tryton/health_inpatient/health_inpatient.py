@@ -20,15 +20,23 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 ##############################################################################
+from collections import defaultdict
 from datetime import datetime
+from sql import Literal
+from sql.aggregate import Avg, Count, Max, Sum
+from sql.conditionals import Case
+from sql.functions import Extract, Now
 from trytond.model import ModelView, ModelSingleton, ModelSQL, fields
 from trytond.transaction import Transaction
 from trytond.pool import Pool
 from trytond.pyson import Eval, Not, Bool, And, Equal
+from trytond.tools import reduce_ids
+from trytond.config import CONFIG
 
 
 __all__ = ['InpatientSequences', 'DietTherapeutic', 'DietBelief',
-    'InpatientRegistration', 'BedTransfer', 'Appointment', 'PatientData',
+    'InpatientRegistration', 'HospitalBed', 'InpatientCensus', 'BedTransfer',
+    'Appointment', 'PatientData',
     'InpatientMedication', 'InpatientMedicationAdminTimes',
     'InpatientMedicationLog', 'InpatientDiet']
 
@@ -109,7 +117,7 @@ class InpatientRegistration(ModelSQL, ModelView):
             'required': Not(Bool(Eval('name'))),
             'readonly': Bool(Eval('name')),
             },
-        depends=['name'])
+        depends=['name'], select=True)
     nursing_plan = fields.Text('Nursing Plan')
     medications = fields.One2Many('gnuhealth.inpatient.medication', 'name',
         'Medications')
@@ -145,6 +153,13 @@ class InpatientRegistration(ModelSQL, ModelView):
         states={'invisible': Not(Equal(Eval('state'), 'done'))},
         help="Health Professional that discharged the patient")
 
+    # Period of the registration as a range, the upper bound is never
+    # before the lower one
+    _bed_period = ('tsrange(hospitalization_date, '
+        'GREATEST(hospitalization_date, discharge_date))')
+    # The registrations that keep their bed
+    _bed_states = ('confirmed', 'hospitalized')
+
     @classmethod
     def __setup__(cls):
         super(InpatientRegistration, cls).__setup__()
@@ -171,39 +186,102 @@ class InpatientRegistration(ModelSQL, ModelView):
                     },
                 })
 
-    ## Method to check for availability and make the hospital bed reservation
+    @classmethod
+    def __register__(cls, module_name):
+        cursor = Transaction().cursor
+
+        super(InpatientRegistration, cls).__register__(module_name)
+
+        if CONFIG['db_type'] == 'postgresql':
+            # Range index of the reserved and occupied periods of the beds
+            index_name = cls._table + '_bed_period_index'
+            cursor.execute('SELECT 1 FROM pg_indexes WHERE indexname = %s',
+                (index_name,))
+            if not cursor.fetchone():
+                cursor.execute('CREATE INDEX "' + index_name + '" '
+                    'ON "' + cls._table + '" '
+                    'USING gist (' + cls._bed_period + ') '
+                    'WHERE state IN %s', (cls._bed_states,))
+
+            # Index of the hospitalized patients, for the patient status
+            index_name = cls._table + '_hospitalized_index'
+            cursor.execute('SELECT 1 FROM pg_indexes WHERE indexname = %s',
+                (index_name,))
+            if not cursor.fetchone():
+                cursor.execute('CREATE INDEX "' + index_name + '" '
+                    'ON "' + cls._table + '" (patient) '
+                    'WHERE state = \'hospitalized\'')
+
+    @classmethod
+    def get_busy_beds(cls, periods):
+        '''Return the registrations that keep a bed during the periods.
+        periods is a list of (bed id or None for all beds, start, end) and
+        the result a list of (registration id, bed id, period index)'''
+        cursor = Transaction().cursor
+
+        result = []
+        for i in range(0, len(periods), cursor.IN_MAX):
+            sub_periods = periods[i:i + cursor.IN_MAX]
+            values = ', '.join(['(%s, %s, %s, %s)'] * len(sub_periods))
+            args = []
+            for index, (bed, start, end) in enumerate(sub_periods, i):
+                args.extend([index, bed, start, end])
+            # The period expression is the one of the index
+            cursor.execute('SELECT r.id, r.bed, p.num '
+                'FROM "' + cls._table + '" AS r, '
+                    '(VALUES ' + values + ') '
+                    'AS p (num, bed, start_date, end_date) '
+                'WHERE r.state IN %s '
+                    'AND (p.bed IS NULL OR r.bed = p.bed::integer) '
+                    'AND ' + cls._bed_period + ' '
+                    '&& tsrange(p.start_date::timestamp, '
+                        'p.end_date::timestamp)',
+                tuple(args) + (cls._bed_states,))
+            result.extend(cursor.fetchall())
+        return result
 
     @classmethod
     @ModelView.button
     def confirmed(cls, registrations):
-        registration_id = registrations[0]
+        # Check and make the bed reservation of all the registrations with
+        # a single query for the conflicts
         Bed = Pool().get('gnuhealth.hospital.bed')
-        cursor = Transaction().cursor
-        bed_id = registration_id.bed.id
-        cursor.execute("SELECT COUNT(*) \
-            FROM gnuhealth_inpatient_registration \
-            WHERE (hospitalization_date::timestamp,discharge_date::timestamp) \
-                OVERLAPS (timestamp %s, timestamp %s) \
-              AND (state = %s or state = %s) \
-              AND bed = CAST(%s AS INTEGER) ",
-            (registration_id.hospitalization_date,
-            registration_id.discharge_date,
-            'confirmed', 'hospitalized', str(bed_id)))
-        res = cursor.fetchone()
-        if (registration_id.discharge_date.date() <
-            registration_id.hospitalization_date.date()):
-            cls.raise_user_error("The Discharge date must later than the \
-                Admission")
-        if res[0] > 0:
+
+        registrations = [r for r in registrations
+            if r.state in ('free', 'cancelled')]
+        for registration in registrations:
+            if (registration.discharge_date.date() <
+                    registration.hospitalization_date.date()):
+                cls.raise_user_error("The Discharge date must later than "
+                    "the Admission")
+
+        # Conflicts within the registrations to confirm
+        by_bed = defaultdict(list)
+        for registration in registrations:
+            by_bed[registration.bed.id].append(registration)
+        for bed_registrations in by_bed.itervalues():
+            bed_registrations.sort(key=lambda r: r.hospitalization_date)
+            for previous, next_ in zip(bed_registrations,
+                    bed_registrations[1:]):
+                if next_.hospitalization_date < previous.discharge_date:
+                    cls.raise_user_error('bed_is_not_available')
+
+        # Conflicts with the registrations already confirmed
+        if cls.get_busy_beds([(r.bed.id, r.hospitalization_date,
+                        r.discharge_date) for r in registrations]):
             cls.raise_user_error('bed_is_not_available')
-        else:
+
+        if registrations:
             cls.write(registrations, {'state': 'confirmed'})
-            Bed.write([registration_id.bed], {'state': 'reserved'})
+            Bed.write([r.bed for r in registrations], {'state': 'reserved'})
+
+    # The bed states are kept in line with the registrations for the
+    # census, for all the registrations at once. Only the registrations
+    # in the source state of the transition change, with their beds.
 
     @classmethod
     @ModelView.button
     def discharge(cls, registrations):
-        registration_id = registrations[0]
         Bed = Pool().get('gnuhealth.hospital.bed')
 
         signing_hp = Pool().get('gnuhealth.healthprofessional').get_health_professional()
@@ -211,44 +289,47 @@ class InpatientRegistration(ModelSQL, ModelView):
             cls.raise_user_error(
                 "No health professional associated to this user !")
 
-        cls.write(registrations, {'state': 'done',
-            'discharged_by': signing_hp})
-
-        Bed.write([registration_id.bed], {'state': 'free'})
+        registrations = [r for r in registrations
+            if r.state == 'hospitalized']
+        if registrations:
+            cls.write(registrations, {'state': 'done',
+                'discharged_by': signing_hp})
+            Bed.write([r.bed for r in registrations], {'state': 'free'})
 
     @classmethod
     @ModelView.button
     def cancel(cls, registrations):
-        registration_id = registrations[0]
         Bed = Pool().get('gnuhealth.hospital.bed')
 
-        cls.write(registrations, {'state': 'cancelled'})
-        Bed.write([registration_id.bed], {'state': 'free'})
+        registrations = [r for r in registrations if r.state == 'confirmed']
+        if registrations:
+            cls.write(registrations, {'state': 'cancelled'})
+            Bed.write([r.bed for r in registrations], {'state': 'free'})
 
     @classmethod
     @ModelView.button
     def admission(cls, registrations):
-        registration_id = registrations[0]
         Bed = Pool().get('gnuhealth.hospital.bed')
 
-        if (registration_id.hospitalization_date.date() !=
-            datetime.today().date()):
-            cls.raise_user_error("The Admission date must be today")
-        else:
+        registrations = [r for r in registrations if r.state == 'confirmed']
+        for registration in registrations:
+            if (registration.hospitalization_date.date() !=
+                    datetime.today().date()):
+                cls.raise_user_error("The Admission date must be today")
+        if registrations:
             cls.write(registrations, {'state': 'hospitalized'})
-            Bed.write([registration_id.bed], {'state': 'occupied'})
+            Bed.write([r.bed for r in registrations], {'state': 'occupied'})
 
     @classmethod
     def create(cls, vlist):
-        Sequence = Pool().get('ir.sequence')
         Config = Pool().get('gnuhealth.sequences')
 
         vlist = [x.copy() for x in vlist]
-        for values in vlist:
-            if not values.get('name'):
-                config = Config(1)
-                values['name'] = Sequence.get_id(
-                    config.inpatient_registration_sequence.id)
+        to_number = [x for x in vlist if not x.get('name')]
+        codes = Config.get_sequence_codes('inpatient_registration_sequence',
+            len(to_number))
+        for values, code in zip(to_number, codes):
+            values['name'] = code
         return super(InpatientRegistration, cls).create(vlist)
 
     @classmethod
@@ -275,15 +356,125 @@ class InpatientRegistration(ModelSQL, ModelView):
 
     @classmethod
     def search_rec_name(cls, name, clause):
-        field = None
         # Search by Registration Code ID or Patient
-        for field in ('name', 'patient'):
-            registrations = cls.search([(field,) + tuple(clause[1:])], limit=1)
-            if registrations:
-                break
-        if registrations:
-            return [(field,) + tuple(clause[1:])]
-        return [(cls._rec_name,) + tuple(clause[1:])]
+        if clause[1].startswith('!') or clause[1].startswith('not '):
+            bool_op = 'AND'
+        else:
+            bool_op = 'OR'
+        return [bool_op,
+            ('name',) + tuple(clause[1:]),
+            ('patient',) + tuple(clause[1:]),
+            ]
+
+
+class HospitalBed(ModelSQL, ModelView):
+    'Add the availability search to the hospital beds'
+    __name__ = 'gnuhealth.hospital.bed'
+
+    @classmethod
+    def search_free(cls, start, end, ward=None, unit=None, building=None):
+        '''Return the beds without reservation nor hospitalization between
+        start and end, in the ward, unit or building if given'''
+        Registration = Pool().get('gnuhealth.inpatient.registration')
+
+        domain = [('state', '!=', 'na')]
+        if ward:
+            domain.append(('ward', '=', ward))
+        if unit:
+            domain.append(('ward.unit', '=', unit))
+        if building:
+            domain.append(('ward.building', '=', building))
+        beds = cls.search(domain)
+        busy = set(bed for _, bed, _ in
+            Registration.get_busy_beds([(None, start, end)]))
+        return [b for b in beds if b.id not in busy]
+
+
+class InpatientCensus(ModelSQL, ModelView):
+    'Inpatient Census'
+    __name__ = 'gnuhealth.inpatient.census'
+
+    ward = fields.Many2One('gnuhealth.hospital.ward', 'Ward')
+    unit = fields.Many2One('gnuhealth.hospital.unit', 'Unit')
+    building = fields.Many2One('gnuhealth.hospital.building', 'Building')
+    beds = fields.Integer('Beds')
+    free = fields.Integer('Free')
+    reserved = fields.Integer('Reserved')
+    occupied = fields.Integer('Occupied')
+    not_available = fields.Integer('Not available')
+    occupancy = fields.Float('Occupancy (%)', digits=(3, 1))
+    patients = fields.Integer('Hospitalized',
+        help='Number of hospitalized patients')
+    average_stay = fields.Float('Average Stay', digits=(16, 1),
+        help='Average length of stay in days of the hospitalized patients')
+    longest_stay = fields.Float('Longest Stay', digits=(16, 1),
+        help='Longest length of stay in days of the hospitalized patients')
+
+    @classmethod
+    def __setup__(cls):
+        super(InpatientCensus, cls).__setup__()
+        cls._order.insert(0, ('building', 'ASC'))
+        cls._order.insert(1, ('unit', 'ASC'))
+
+    @staticmethod
+    def table_query():
+        # Current state of the beds and stay of the hospitalized patients
+        # per ward, from the beds and the registrations
+        pool = Pool()
+        bed = pool.get('gnuhealth.hospital.bed').__table__()
+        stay_bed = pool.get('gnuhealth.hospital.bed').__table__()
+        ward = pool.get('gnuhealth.hospital.ward').__table__()
+        registration = pool.get(
+            'gnuhealth.inpatient.registration').__table__()
+
+        def count(state):
+            return Sum(Case((bed.state == state, 1), else_=0))
+
+        beds = bed.join(ward, condition=ward.id == bed.ward).select(
+            ward.id.as_('ward'),
+            Max(ward.create_uid).as_('create_uid'),
+            Max(ward.create_date).as_('create_date'),
+            Max(ward.write_uid).as_('write_uid'),
+            Max(ward.write_date).as_('write_date'),
+            ward.unit,
+            ward.building,
+            Count(bed.id).as_('beds'),
+            count('free').as_('free'),
+            count('reserved').as_('reserved'),
+            count('occupied').as_('occupied'),
+            count('na').as_('not_available'),
+            group_by=[ward.id, ward.unit, ward.building])
+
+        days = Extract('EPOCH',
+            Now() - registration.hospitalization_date) / 86400
+        stays = registration.join(stay_bed,
+            condition=stay_bed.id == registration.bed).select(
+            stay_bed.ward,
+            Count(registration.id).as_('patients'),
+            Avg(days).as_('average_stay'),
+            Max(days).as_('longest_stay'),
+            where=registration.state == 'hospitalized',
+            group_by=stay_bed.ward)
+
+        join = beds.join(stays, 'LEFT', condition=stays.ward == beds.ward)
+        return join.select(
+            beds.ward.as_('id'),
+            beds.create_uid,
+            beds.create_date,
+            beds.write_uid,
+            beds.write_date,
+            beds.ward,
+            beds.unit,
+            beds.building,
+            beds.beds,
+            beds.free,
+            beds.reserved,
+            beds.occupied,
+            beds.not_available,
+            (Literal(100.0) * beds.occupied / beds.beds).as_('occupancy'),
+            stays.patients,
+            stays.average_stay,
+            stays.longest_stay)
 
 
 class BedTransfer(ModelSQL, ModelView):
@@ -314,30 +505,62 @@ class PatientData(ModelSQL, ModelView):
     __name__ = 'gnuhealth.patient'
 
     patient_status = fields.Function(fields.Char('Hospitalization Status', help="Patient current Hospitalization Status"),
-        'get_patient_status')
+        'get_patient_status', searcher='search_patient_status')
 
-    def get_patient_status(self, name):
+    @staticmethod
+    def _get_hospitalized(patient_ids):
+        # Ids of the patients with a hospitalized registration, among
+        # patient_ids
         cursor = Transaction().cursor
+        registration = Pool().get(
+            'gnuhealth.inpatient.registration').__table__()
+
+        hospitalized = set()
+        for i in range(0, len(patient_ids), cursor.IN_MAX):
+            sub_ids = patient_ids[i:i + cursor.IN_MAX]
+            cursor.execute(*registration.select(registration.patient,
+                    where=(registration.state == 'hospitalized')
+                    & reduce_ids(registration.patient, sub_ids),
+                    group_by=registration.patient))
+            hospitalized.update(p for p, in cursor.fetchall())
+        return hospitalized
 
-        def get_hospitalization_status(patient_dbid):
-            cursor.execute('SELECT state '
-                'FROM gnuhealth_inpatient_registration '
-                'WHERE patient = %s '
-                  'AND state = \'hospitalized\' ', (str(patient_dbid),))
-            try:
-                patient_status = str(cursor.fetchone()[0])
-            except:
-                patient_status = 'outpatient'
-            return patient_status
-
-        result = ''
-
-        # Get the patient (DB) id to be used in the search on the medical
-        # inpatient registration table lookup
-        patient_dbid = self.id
-        if patient_dbid:
-            result = get_hospitalization_status(patient_dbid)
-        return result
+    @classmethod
+    def get_patient_status(cls, patients, name):
+        hospitalized = cls._get_hospitalized([p.id for p in patients])
+        return dict((p.id, 'hospitalized' if p.id in hospitalized
+                else 'outpatient') for p in patients)
+
+    @classmethod
+    def search_patient_status(cls, name, clause):
+        _, operator, value = clause
+        statuses = set(['hospitalized', 'outpatient'])
+        if operator == '=':
+            statuses &= set([value])
+        elif operator == '!=':
+            statuses -= set([value])
+        elif operator == 'in':
+            statuses &= set(value)
+        elif operator == 'not in':
+            statuses -= set(value)
+        else:
+            cls.raise_user_error('Unsupported operator "%s" on the'
+                ' hospitalization status' % operator)
+
+        if len(statuses) == 2:
+            return []
+        elif not statuses:
+            return [('id', '=', None)]
+        # The sub-query uses the partial index of the hospitalized
+        # registrations, the patient is never NULL in the NOT IN
+        registration = Pool().get(
+            'gnuhealth.inpatient.registration').__table__()
+        hospitalized = registration.select(registration.patient,
+            where=(registration.state == 'hospitalized')
+            & (registration.patient != None))
+        if 'hospitalized' in statuses:
+            return [('id', 'in', hospitalized)]
+        return [('id', 'not in', hospitalized)]
 
 
 class InpatientMedication (ModelSQL, ModelView):
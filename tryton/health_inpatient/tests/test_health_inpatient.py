@@ -7,8 +7,11 @@ if os.path.isdir(DIR):
     sys.path.insert(0, os.path.dirname(DIR))
 
 import unittest
+from datetime import date
 import trytond.tests.test_tryton
 from trytond.tests.test_tryton import test_view, test_depends
+from trytond.tests.test_tryton import POOL, DB_NAME, USER, CONTEXT
+from trytond.transaction import Transaction
 
 
 class HealthInpatientTestCase(unittest.TestCase):
@@ -31,6 +34,40 @@ class HealthInpatientTestCase(unittest.TestCase):
         '''
         test_depends()
 
+    def test0010patient_status(self):
+        '''
+        Test the search on the hospitalization status.
+        '''
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            Party = POOL.get('party.party')
+            Patient = POOL.get('gnuhealth.patient')
+
+            party, = Party.create([{
+                        'name': 'Patient',
+                        'is_person': True,
+                        'is_patient': True,
+                        'sex': 'f',
+                        'activation_date': date.today(),
+                        }])
+            patient, = Patient.create([{
+                        'name': party.id,
+                        'identification_code': 'PAC001',
+                        }])
+
+            self.assertEqual(patient.patient_status, 'outpatient')
+            for clause, found in [
+                    (('patient_status', '=', 'outpatient'), True),
+                    (('patient_status', '!=', 'hospitalized'), True),
+                    (('patient_status', '=', 'hospitalized'), False),
+                    (('patient_status', 'in', ['hospitalized']), False),
+                    ]:
+                self.assertEqual(
+                    Patient.search([('id', '=', patient.id), clause]),
+                    [patient] if found else [])
+
+            transaction.cursor.rollback()
+
 def suite():
     suite = trytond.tests.test_tryton.suite()
     suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
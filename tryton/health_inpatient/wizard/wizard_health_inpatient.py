@@ -79,8 +79,11 @@ class CreateBedTransfer(Wizard):
         if (destination_bed.state == 'free'):
             # Free the current bed
             bed.write([current_bed], {'state': 'free'})
-            # Set as occupied the new bed
-            bed.write([destination_bed], {'state': 'occupied'})
+            # The new bed takes the state of the current one
+            if registration.state == 'hospitalized':
+                bed.write([destination_bed], {'state': 'occupied'})
+            else:
+                bed.write([destination_bed], {'state': 'reserved'})
             # Update the hospitalization record
             hospitalization_info = {}
 
@@ -36,13 +36,20 @@ def register():
         GnuHealthLabTestUnits,
         GnuHealthTestCritearea,
         GnuHealthPatientLabTest,
+        LabCumulativeResult,
+        LabAbnormalResult,
+        LabAbnormalSummary,
         CreateLabTestOrderInit,
+        CreateLabTestOrderResult,
         RequestTest,
         RequestPatientLabTestStart,
+        ImportLabResultsStart,
+        ImportLabResultsResult,
         module='health_lab', type_='model')
     Pool.register(
         CreateLabTestOrder,
         RequestPatientLabTest,
+        ImportLabResults,
         module='health_lab', type_='wizard')
     Pool.register(
         LabTestReport,
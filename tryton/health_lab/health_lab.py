@@ -21,14 +21,38 @@
 #
 ##############################################################################
 from datetime import datetime
+from sql import Expression
+from sql.aggregate import Count, Min
+from sql.conditionals import Case, Coalesce
+from sql.functions import Abs
 from trytond.model import ModelView, ModelSingleton, ModelSQL, fields
 from trytond.transaction import Transaction
 from trytond.pool import Pool
+from trytond.tools import reduce_ids
+from trytond import backend
+from trytond.config import CONFIG
 
 
 __all__ = ['GnuHealthSequences', 'PatientData', 'TestType', 'Lab',
     'GnuHealthLabTestUnits', 'GnuHealthTestCritearea',
-    'GnuHealthPatientLabTest']
+    'GnuHealthPatientLabTest', 'LabCumulativeResult', 'LabAbnormalResult',
+    'LabAbnormalSummary']
+
+
+class SubQuery(Expression):
+    # A sub-query returning a single value, used as an expression
+    __slots__ = ('query',)
+
+    def __init__(self, query):
+        super(SubQuery, self).__init__()
+        self.query = query
+
+    def __str__(self):
+        return '(%s)' % self.query
+
+    @property
+    def params(self):
+        return self.query.params
 
 
 class GnuHealthSequences(ModelSingleton, ModelSQL, ModelView):
@@ -97,6 +121,10 @@ class Lab(ModelSQL, ModelView):
     date_requested = fields.DateTime('Date requested', required=True,
         select=True)
     date_analysis = fields.DateTime('Date of the Analysis', select=True)
+    urgent = fields.Boolean('Urgent', select=True)
+
+    # Rows by statement of the multi-row inserts of create_orders
+    _insert_chunk = 1000
 
     @classmethod
     def __setup__(cls):
@@ -113,19 +141,99 @@ class Lab(ModelSQL, ModelView):
     def default_analysis():
         return datetime.now()
 
+    @staticmethod
+    def default_urgent():
+        return False
+
     @classmethod
     def create(cls, vlist):
-        Sequence = Pool().get('ir.sequence')
         Config = Pool().get('gnuhealth.sequences')
 
         vlist = [x.copy() for x in vlist]
-        for values in vlist:
-            if not values.get('name'):
-                config = Config(1)
-                values['name'] = Sequence.get_id(
-                    config.lab_sequence.id)
+        to_number = [x for x in vlist if not x.get('name')]
+        codes = Config.get_sequence_codes('lab_sequence', len(to_number))
+        for values, code in zip(to_number, codes):
+            values['name'] = code
+
+        labs = super(Lab, cls).create(vlist)
+        Critearea = Pool().get('gnuhealth.lab.test.critearea')
+        Critearea.sync_lab_data([l.id for l in labs])
+        return labs
 
-        return super(Lab, cls).create(vlist)
+    @classmethod
+    def write(cls, labs, values):
+        Critearea = Pool().get('gnuhealth.lab.test.critearea')
+
+        super(Lab, cls).write(labs, values)
+        synced = set(['patient', 'date_requested', 'date_analysis',
+                'critearea'])
+        if synced.intersection(values):
+            Critearea.sync_lab_data([l.id for l in labs])
+
+    @classmethod
+    def create_orders(cls, orders):
+        '''Create the lab tests of orders, a list of dictionaries with the
+        test, patient, requestor, date_requested and urgent, with the
+        analytes of
+        their test type. The rows are inserted with multi-row inserts, once
+        the access rights and the required fields are checked.
+        Return the list of the created ids, in the order of orders'''
+        pool = Pool()
+        Config = pool.get('gnuhealth.sequences')
+        Critearea = pool.get('gnuhealth.lab.test.critearea')
+        ModelAccess = pool.get('ir.model.access')
+        cursor = Transaction().cursor
+        table = cls.__table__()
+        critearea = Critearea.__table__()
+        user = Transaction().user
+        now = datetime.now()
+
+        if not orders:
+            return []
+        ModelAccess.check(cls.__name__, 'create')
+        ModelAccess.check(Critearea.__name__, 'create')
+        for order in orders:
+            for field_name in ('test', 'patient'):
+                if not order.get(field_name):
+                    cls.raise_user_error('required_field',
+                        error_args=cls._get_error_args(field_name))
+        templates = Critearea.get_templates(set(o['test'] for o in orders))
+        codes = Config.get_sequence_codes('lab_sequence', len(orders))
+
+        values = [[user, now, code, o['test'], o['patient'],
+                o.get('requestor'), o.get('date_requested') or now,
+                bool(o.get('urgent'))]
+            for code, o in zip(codes, orders)]
+        for i in range(0, len(values), cls._insert_chunk):
+            cursor.execute(*table.insert([table.create_uid,
+                        table.create_date, table.name, table.test,
+                        table.patient, table.requestor,
+                        table.date_requested, table.urgent],
+                    values[i:i + cls._insert_chunk]))
+
+        # The codes are unique, they give back the ids of the new tests
+        ids = {}
+        for i in range(0, len(codes), cursor.IN_MAX):
+            cursor.execute(*table.select(table.name, table.id,
+                    where=table.name.in_(codes[i:i + cursor.IN_MAX])))
+            ids.update(cursor.fetchall())
+        lab_ids = [ids[code] for code in codes]
+
+        values = []
+        for lab_id, order in zip(lab_ids, orders):
+            for template in templates.get(order['test'], []):
+                values.append([user, now, lab_id, order['patient'],
+                        order.get('date_requested') or now] + template)
+        for i in range(0, len(values), cls._insert_chunk):
+            cursor.execute(*critearea.insert([critearea.create_uid,
+                        critearea.create_date, critearea.gnuhealth_lab_id,
+                        critearea.patient, critearea.date,
+                        critearea.name, critearea.sequence,
+                        critearea.lower_limit, critearea.upper_limit,
+                        critearea.normal_range, critearea.units,
+                        critearea.excluded],
+                    values[i:i + cls._insert_chunk]))
+        return lab_ids
 
 
 class GnuHealthLabTestUnits(ModelSQL, ModelView):
@@ -172,12 +280,98 @@ class GnuHealthTestCritearea(ModelSQL, ModelView):
     gnuhealth_lab_id = fields.Many2One('gnuhealth.lab', 'Test Cases',
         select=True)
     sequence = fields.Integer('Sequence')
+    # Copies of the lab test patient and date, for the cumulative results
+    patient = fields.Many2One('gnuhealth.patient', 'Patient', readonly=True)
+    date = fields.DateTime('Date', readonly=True,
+        help='Date of the analysis, or of the request when not analyzed')
+
+    # Results by UPDATE statement of post_results
+    _update_chunk = 500
+    # Predicate of the abnormal results index, the where clause of
+    # the worklist must imply it for the index to be used
+    _abnormal_condition = ('(excluded = false OR excluded IS NULL) '
+        'AND (result < lower_limit OR result > upper_limit)')
+
+    @classmethod
+    def abnormal_where(cls, table):
+        'Return the condition of the results out of the reference range'
+        return (((table.excluded == False) | (table.excluded == None))
+            & ((table.result < table.lower_limit)
+                | (table.result > table.upper_limit)))
 
     @classmethod
     def __setup__(cls):
         super(GnuHealthTestCritearea, cls).__setup__()
         cls._order.insert(0, ('sequence', 'ASC'))
 
+    @classmethod
+    def __register__(cls, module_name):
+        TableHandler = backend.get('TableHandler')
+        cursor = Transaction().cursor
+
+        table = TableHandler(cursor, cls, module_name)
+        fill_lab_data = not table.column_exist('patient')
+
+        super(GnuHealthTestCritearea, cls).__register__(module_name)
+
+        table = TableHandler(cursor, cls, module_name)
+        # Results of a patient by analyte and date
+        table.index_action(['patient', 'name', 'date'], 'add')
+        if fill_lab_data:
+            cls.sync_lab_data()
+
+        if CONFIG['db_type'] == 'postgresql':
+            # Index of the results out of the reference range, by date,
+            # for the abnormal results worklist
+            index_name = cls._table + '_abnormal_index'
+            cursor.execute('SELECT 1 FROM pg_indexes WHERE indexname = %s',
+                (index_name,))
+            if not cursor.fetchone():
+                cursor.execute('CREATE INDEX "' + index_name + '" '
+                    'ON "' + cls._table + '" (date, id) '
+                    'WHERE ' + cls._abnormal_condition)
+
+    @classmethod
+    def create(cls, vlist):
+        records = super(GnuHealthTestCritearea, cls).create(vlist)
+        cls.sync_lab_data(list(set(r.gnuhealth_lab_id.id for r in records
+                    if r.gnuhealth_lab_id)))
+        return records
+
+    @classmethod
+    def write(cls, records, values):
+        super(GnuHealthTestCritearea, cls).write(records, values)
+        if 'gnuhealth_lab_id' in values:
+            lab_ids = set(r.gnuhealth_lab_id.id for r in records
+                if r.gnuhealth_lab_id)
+            if lab_ids:
+                cls.sync_lab_data(list(lab_ids))
+
+    @classmethod
+    def sync_lab_data(cls, lab_ids=None):
+        'Copy the patient and the date of the lab tests (all when None)'
+        pool = Pool()
+        Lab = pool.get('gnuhealth.lab')
+        cursor = Transaction().cursor
+        table = cls.__table__()
+        lab = Lab.__table__()
+
+        columns = [table.patient, table.date]
+        values = [
+            lab.select(lab.patient,
+                where=lab.id == table.gnuhealth_lab_id),
+            lab.select(Coalesce(lab.date_analysis, lab.date_requested),
+                where=lab.id == table.gnuhealth_lab_id),
+            ]
+        if lab_ids is None:
+            cursor.execute(*table.update(columns, values,
+                    where=table.gnuhealth_lab_id != None))
+            return
+        for i in range(0, len(lab_ids), cursor.IN_MAX):
+            cursor.execute(*table.update(columns, values,
+                    where=reduce_ids(table.gnuhealth_lab_id,
+                        lab_ids[i:i + cursor.IN_MAX])))
+
     @staticmethod
     def default_sequence():
         return 1
@@ -191,6 +385,104 @@ class GnuHealthTestCritearea(ModelSQL, ModelView):
             return True
         return False
 
+    @classmethod
+    def get_templates(cls, test_type_ids):
+        '''Return the analytes of the test types, read in one query, as
+        a dictionary of test type id: list of [name, sequence,
+        lower_limit, upper_limit, normal_range, units, excluded]'''
+        cursor = Transaction().cursor
+        table = cls.__table__()
+
+        test_type_ids = list(test_type_ids)
+        templates = {}
+        for i in range(0, len(test_type_ids), cursor.IN_MAX):
+            sub_ids = test_type_ids[i:i + cursor.IN_MAX]
+            cursor.execute(*table.select(table.test_type_id, table.name,
+                    table.sequence, table.lower_limit, table.upper_limit,
+                    table.normal_range, table.units,
+                    where=reduce_ids(table.test_type_id, sub_ids),
+                    order_by=[table.sequence, table.id]))
+            for row in cursor.fetchall():
+                templates.setdefault(row[0], []).append(
+                    list(row[1:]) + [False])
+        return templates
+
+    @classmethod
+    def post_results(cls, results):
+        '''Store the analyzer results (lab_results.Result) in the analytes
+        of the lab tests, with one UPDATE by chunk of results, and
+        recompute their warning.
+        Return the list of the rejected results, with their error'''
+        pool = Pool()
+        Lab = pool.get('gnuhealth.lab')
+        TestType = pool.get('gnuhealth.lab.test_type')
+        cursor = Transaction().cursor
+        table = cls.__table__()
+        lab = Lab.__table__()
+        test_type = TestType.__table__()
+
+        rejected = [r for r in results if r.error]
+        results = [r for r in results if not r.error]
+
+        # Analytes of the lab tests, by (lab, test type code, analyte) and
+        # by (lab, analyte) for the results without the test code
+        codes = list(set(r.lab for r in results))
+        by_test, by_lab = {}, {}
+        for i in range(0, len(codes), cursor.IN_MAX):
+            cursor.execute(*table.join(lab,
+                    condition=table.gnuhealth_lab_id == lab.id
+                    ).join(test_type,
+                    condition=lab.test == test_type.id
+                    ).select(table.id, lab.name, test_type.code, table.name,
+                    where=lab.name.in_(codes[i:i + cursor.IN_MAX])))
+            for id_, code, test, analyte in cursor.fetchall():
+                analyte = analyte.strip().lower()
+                by_test[(code, test, analyte)] = id_
+                by_lab.setdefault((code, analyte), set()).add(id_)
+
+        values = {}
+        for result in results:
+            candidates = []
+            for analyte in result.analytes:
+                analyte = analyte.strip().lower()
+                if result.test:
+                    candidates.append(
+                        by_test.get((result.lab, result.test, analyte)))
+                else:
+                    ids = by_lab.get((result.lab, analyte), set())
+                    if len(ids) == 1:
+                        candidates.extend(ids)
+            candidates = [c for c in candidates if c]
+            if not candidates:
+                rejected.append(result._replace(error='Unknown analyte'))
+                continue
+            values[candidates[0]] = result.value
+
+        ids = list(values)
+        for i in range(0, len(ids), cls._update_chunk):
+            sub_ids = ids[i:i + cls._update_chunk]
+            cursor.execute(*table.update([table.result, table.result_text],
+                    [Case(*[(table.id == id_, values[id_][0])
+                                for id_ in sub_ids], else_=table.result),
+                        Case(*[(table.id == id_, values[id_][1])
+                                for id_ in sub_ids],
+                            else_=table.result_text)],
+                    where=reduce_ids(table.id, sub_ids)))
+        cls.update_warnings(ids)
+        return rejected
+
+    @classmethod
+    def update_warnings(cls, ids):
+        'Set the warning of the analytes with a result out of the limits'
+        cursor = Transaction().cursor
+        table = cls.__table__()
+
+        warning = Coalesce((table.result < table.lower_limit)
+            | (table.result > table.upper_limit), False)
+        for i in range(0, len(ids), cursor.IN_MAX):
+            cursor.execute(*table.update([table.warning], [warning],
+                    where=reduce_ids(table.id, ids[i:i + cursor.IN_MAX])))
+
     @classmethod
     def check_xml_record(cls, records, values):
         return True
@@ -233,31 +525,19 @@ class GnuHealthPatientLabTest(ModelSQL, ModelView):
 
     @staticmethod
     def default_doctor_id():
-        User = Pool().get('res.user')
-        user = User(Transaction().user)
-        uid = int(user.id)
-
-        parties = Pool().get('party.party').search([
-                ('internal_user', '=', uid)])
-        if parties:
-            doctors = Pool().get('gnuhealth.healthprofessional').search([
-                    ('name', '=', parties[0].id)])
-            if doctors:
-                return doctors[0].id
-        else:
-            return False
+        HealthProf = Pool().get('gnuhealth.healthprofessional')
+        return HealthProf.get_health_professional()
 
     @classmethod
     def create(cls, vlist):
-        Sequence = Pool().get('ir.sequence')
         Config = Pool().get('gnuhealth.sequences')
 
         vlist = [x.copy() for x in vlist]
-        for values in vlist:
-            if not values.get('request'):
-                config = Config(1)
-                values['request'] = Sequence.get_id(
-                    config.lab_request_sequence.id)
+        to_number = [x for x in vlist if not x.get('request')]
+        codes = Config.get_sequence_codes('lab_request_sequence',
+            len(to_number))
+        for values, code in zip(to_number, codes):
+            values['request'] = code
 
         return super(GnuHealthPatientLabTest, cls).create(vlist)
 
@@ -270,3 +550,269 @@ class GnuHealthPatientLabTest(ModelSQL, ModelView):
         default['date'] = cls.default_date()
         return super(GnuHealthPatientLabTest, cls).copy(tests,
             default=default)
+
+
+class LabCumulativeResult(ModelSQL, ModelView):
+    'Cumulative Lab Results'
+    __name__ = 'gnuhealth.lab.cumulative'
+
+    patient = fields.Many2One('gnuhealth.patient', 'Patient', readonly=True)
+    analyte = fields.Char('Analyte', readonly=True)
+    date = fields.DateTime('Date', readonly=True)
+    lab = fields.Many2One('gnuhealth.lab', 'Lab Test', readonly=True)
+    test = fields.Many2One('gnuhealth.lab.test_type', 'Test type',
+        readonly=True)
+    result = fields.Float('Value', readonly=True)
+    result_text = fields.Char('Result - Text', readonly=True)
+    units = fields.Many2One('gnuhealth.lab.test.units', 'Units',
+        readonly=True)
+    lower_limit = fields.Float('Lower Limit', readonly=True)
+    upper_limit = fields.Float('Upper Limit', readonly=True)
+    warning = fields.Boolean('Warn', readonly=True)
+    previous_result = fields.Float('Previous Value', readonly=True,
+        help='Previous value of the analyte for the patient')
+    delta = fields.Float('Delta', readonly=True,
+        help='Change since the previous value')
+    trend = fields.Selection([
+        (None, ''),
+        ('up', 'Increase'),
+        ('down', 'Decrease'),
+        ('stable', 'Stable'),
+        ], 'Trend', readonly=True, sort=False)
+    delta_check = fields.Boolean('Delta Check', readonly=True,
+        help='The change since the previous value is larger than the'
+        ' delta check threshold')
+
+    # Relative change of the delta check, it can be set in the context
+    # as delta_threshold, changes below it are stable
+    _delta_threshold = 0.2
+
+    @classmethod
+    def __setup__(cls):
+        super(LabCumulativeResult, cls).__setup__()
+        cls._order.insert(0, ('analyte', 'ASC'))
+        cls._order.insert(1, ('date', 'DESC'))
+
+    @classmethod
+    def table_query(cls):
+        pool = Pool()
+        Critearea = pool.get('gnuhealth.lab.test.critearea')
+        Lab = pool.get('gnuhealth.lab')
+        critearea = Critearea.__table__()
+        previous = Critearea.__table__()
+        lab = Lab.__table__()
+        threshold = Transaction().context.get('delta_threshold',
+            cls._delta_threshold)
+
+        # Last numeric value before the result, found on the index of
+        # the analytes by patient, name and date
+        previous_result = SubQuery(previous.select(previous.result,
+                where=(previous.patient == critearea.patient)
+                & (previous.name == critearea.name)
+                & (previous.date < critearea.date)
+                & (previous.result != None),
+                order_by=[previous.date.desc], limit=1))
+
+        results = critearea.join(lab,
+            condition=critearea.gnuhealth_lab_id == lab.id).select(
+            critearea.id,
+            critearea.create_uid,
+            critearea.create_date,
+            critearea.write_uid,
+            critearea.write_date,
+            critearea.patient,
+            critearea.name.as_('analyte'),
+            critearea.date,
+            lab.id.as_('lab'),
+            lab.test,
+            critearea.result,
+            critearea.result_text,
+            critearea.units,
+            critearea.lower_limit,
+            critearea.upper_limit,
+            critearea.warning,
+            previous_result.as_('previous_result'),
+            where=(critearea.patient != None)
+            & ((critearea.result != None) | (critearea.result_text != None)))
+
+        # The delta and the trend of the previous value, computed once
+        delta = results.result - results.previous_result
+        change = Abs(delta) > Abs(results.previous_result) * threshold
+        return results.select(
+            results.id,
+            results.create_uid,
+            results.create_date,
+            results.write_uid,
+            results.write_date,
+            results.patient,
+            results.analyte,
+            results.date,
+            results.lab,
+            results.test,
+            results.result,
+            results.result_text,
+            results.units,
+            results.lower_limit,
+            results.upper_limit,
+            results.warning,
+            results.previous_result,
+            delta.as_('delta'),
+            Case((change & (delta > 0), 'up'),
+                (change & (delta < 0), 'down'),
+                (delta != None, 'stable')).as_('trend'),
+            Case((change, True), else_=False).as_('delta_check'))
+
+    @classmethod
+    def pivot(cls, patient_id, start=None, end=None):
+        '''Return the results of the patient per analyte over time, read
+        in one query, as the list of the dates and the list of
+        (analyte, units, values), values having one result per date'''
+        domain = [('patient', '=', patient_id)]
+        if start:
+            domain.append(('date', '>=', start))
+        if end:
+            domain.append(('date', '<=', end))
+        results = cls.search_read(domain,
+            order=[('analyte', 'ASC'), ('date', 'ASC')],
+            fields_names=['analyte', 'date', 'result', 'result_text',
+                'units.rec_name'])
+        results.sort(key=lambda r: (r['analyte'], r['date']))
+
+        dates = sorted(set(r['date'] for r in results))
+        index = dict((d, i) for i, d in enumerate(dates))
+        rows = []
+        for result in results:
+            if not rows or rows[-1][0] != result['analyte']:
+                rows.append((result['analyte'],
+                        result.get('units.rec_name'), [None] * len(dates)))
+            value = result['result']
+            if value is None:
+                value = result['result_text']
+            rows[-1][2][index[result['date']]] = value
+        return dates, rows
+
+
+class LabAbnormalResult(ModelSQL, ModelView):
+    'Abnormal Lab Results'
+    __name__ = 'gnuhealth.lab.abnormal'
+
+    lab = fields.Many2One('gnuhealth.lab', 'Lab Test', readonly=True)
+    patient = fields.Many2One('gnuhealth.patient', 'Patient', readonly=True)
+    test = fields.Many2One('gnuhealth.lab.test_type', 'Test type',
+        readonly=True)
+    analyte = fields.Char('Analyte', readonly=True)
+    date = fields.DateTime('Date', readonly=True)
+    result = fields.Float('Value', readonly=True)
+    units = fields.Many2One('gnuhealth.lab.test.units', 'Units',
+        readonly=True)
+    lower_limit = fields.Float('Lower Limit', readonly=True)
+    upper_limit = fields.Float('Upper Limit', readonly=True)
+    flag = fields.Selection([
+        ('low', 'Low'),
+        ('high', 'High'),
+        ], 'Flag', readonly=True)
+    requestor = fields.Many2One('gnuhealth.healthprofessional', 'Physician',
+        readonly=True)
+    urgent = fields.Boolean('Urgent', readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(LabAbnormalResult, cls).__setup__()
+        # The order of the abnormal results index
+        cls._order.insert(0, ('date', 'DESC'))
+        cls._order.insert(1, ('id', 'DESC'))
+
+    @classmethod
+    def table_query(cls):
+        pool = Pool()
+        Critearea = pool.get('gnuhealth.lab.test.critearea')
+        Lab = pool.get('gnuhealth.lab')
+        critearea = Critearea.__table__()
+        lab = Lab.__table__()
+
+        return critearea.join(lab,
+            condition=critearea.gnuhealth_lab_id == lab.id).select(
+            critearea.id,
+            critearea.create_uid,
+            critearea.create_date,
+            critearea.write_uid,
+            critearea.write_date,
+            lab.id.as_('lab'),
+            critearea.patient,
+            lab.test,
+            critearea.name.as_('analyte'),
+            critearea.date,
+            critearea.result,
+            critearea.units,
+            critearea.lower_limit,
+            critearea.upper_limit,
+            Case((critearea.result < critearea.lower_limit, 'low'),
+                else_='high').as_('flag'),
+            lab.requestor,
+            lab.urgent,
+            where=Critearea.abnormal_where(critearea))
+
+    @classmethod
+    def page(cls, domain, last=None, limit=100):
+        '''Return the abnormal results of domain following the last one
+        (keyset pagination on the date and the id, the order of the
+        index, instead of an offset that reads all the previous rows)'''
+        domain = list(domain)
+        if last:
+            domain.append(['OR',
+                    ('date', '<', last.date),
+                    [('date', '=', last.date), ('id', '<', last.id)],
+                    ])
+        return cls.search(domain, limit=limit,
+            order=[('date', 'DESC'), ('id', 'DESC')])
+
+
+class LabAbnormalSummary(ModelSQL, ModelView):
+    'Abnormal Lab Results by Physician'
+    __name__ = 'gnuhealth.lab.abnormal.summary'
+
+    requestor = fields.Many2One('gnuhealth.healthprofessional', 'Physician',
+        readonly=True)
+    urgent = fields.Boolean('Urgent', readonly=True)
+    results = fields.Integer('Abnormal Results', readonly=True)
+    first_date = fields.DateTime('Oldest Result', readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(LabAbnormalSummary, cls).__setup__()
+        cls._order.insert(0, ('urgent', 'DESC'))
+        cls._order.insert(1, ('results', 'DESC'))
+
+    @classmethod
+    def table_query(cls):
+        # The results can be limited to a period with start_date and
+        # end_date in the context
+        pool = Pool()
+        Critearea = pool.get('gnuhealth.lab.test.critearea')
+        Lab = pool.get('gnuhealth.lab')
+        critearea = Critearea.__table__()
+        lab = Lab.__table__()
+        context = Transaction().context
+
+        where = Critearea.abnormal_where(critearea)
+        if context.get('start_date'):
+            where &= critearea.date >= context['start_date']
+        if context.get('end_date'):
+            where &= critearea.date <= context['end_date']
+
+        # One row by physician (none for 0) and urgency
+        requestor = Coalesce(lab.requestor, 0)
+        urgent = Coalesce(lab.urgent, False)
+        return critearea.join(lab,
+            condition=critearea.gnuhealth_lab_id == lab.id).select(
+            (requestor * 2 + Case((urgent, 1), else_=0)).as_('id'),
+            Min(critearea.create_uid).as_('create_uid'),
+            Min(critearea.create_date).as_('create_date'),
+            Min(critearea.write_uid).as_('write_uid'),
+            Min(critearea.write_date).as_('write_date'),
+            lab.requestor,
+            urgent.as_('urgent'),
+            Count(critearea.id).as_('results'),
+            Min(critearea.date).as_('first_date'),
+            where=where,
+            group_by=[lab.requestor, urgent])
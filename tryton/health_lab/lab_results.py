@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    GNU Health: The Free Health and Hospital Information System
+#    Copyright (C) 2008-2014 Luis Falcon <lfalcon@gnusolidario.org>
+#    Copyright (C) 2011-2014 GNU Solidario <health@gnusolidario.org>
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+# Readers of the result files exported by the lab analyzers.
+#
+# Two formats are supported, the format is detected from the first line :
+#
+# - HL7 v2 ORU messages : the lab test ID is the filler order number of
+#   OBR-3 (or the placer order number of OBR-2), the test type code is
+#   the first component of OBR-4, the analyte is the text (or the code)
+#   of OBX-3 and the value is OBX-5.
+#
+# - Delimited files (comma, semicolon, tab or pipe) with a header line
+#   naming the columns lab, test, analyte and result. The test column is
+#   optional.
+#
+# The files are read as streams, line by line, and each result is
+# returned as a Result. The lines that can not be read are returned as
+# a Result with the error set.
+
+import csv
+import io
+import os
+from collections import namedtuple
+
+__all__ = ['Result', 'read_results', 'spool_files', 'batches']
+
+# analytes is a list of names to look for, error is None when the
+# line is valid
+Result = namedtuple('Result', ['line', 'lab', 'test', 'analytes', 'value',
+        'error'])
+
+DELIMITED_COLUMNS = ('lab', 'test', 'analyte', 'result')
+
+
+def _decode(value):
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', 'replace')
+    return value.strip()
+
+
+def _parse_value(value, numeric=True):
+    # Return the numeric result and the text result of value
+    value = value.strip()
+    if numeric:
+        try:
+            return float(value), None
+        except ValueError:
+            pass
+    return None, value or None
+
+
+def read_delimited(path):
+    with open(path, 'rb') as fileobj:
+        sample = fileobj.read(4096)
+        fileobj.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(_decode(sample).splitlines()[0],
+                delimiters=',;\t|')
+        except (csv.Error, IndexError):
+            dialect = csv.excel
+        reader = csv.reader(fileobj, dialect)
+        header = [_decode(h).lower() for h in next(reader, [])]
+        missing = [c for c in DELIMITED_COLUMNS
+            if c not in header and c != 'test']
+        if missing:
+            yield Result(1, None, None, [], (None, None),
+                'Missing columns: %s' % ', '.join(missing))
+            return
+        index = dict((c, header.index(c)) for c in DELIMITED_COLUMNS
+            if c in header)
+        for number, row in enumerate(reader, 2):
+            if not any(row):
+                continue
+            try:
+                values = dict((c, _decode(row[i]))
+                    for c, i in index.items())
+            except IndexError:
+                yield Result(number, None, None, [], (None, None),
+                    'Missing values')
+                continue
+            yield Result(number, values['lab'], values.get('test'),
+                [values['analyte']], _parse_value(values['result']), None)
+
+
+def _segments(path):
+    # The HL7 segments are separated by carriage returns, the universal
+    # newlines also accept the files converted to other line endings
+    with io.open(path, 'r', encoding='utf-8', errors='replace',
+            newline=None) as fileobj:
+        for number, line in enumerate(fileobj, 1):
+            line = line.strip()
+            if line:
+                yield number, line
+
+
+def read_hl7(path):
+    field_separator, component_separator = '|', '^'
+    lab = test = None
+    for number, segment in _segments(path):
+        if segment.startswith('MSH'):
+            field_separator = segment[3]
+            component_separator = segment[4]
+            lab = test = None
+            continue
+        fields = segment.split(field_separator)
+
+        def component(index, position=0):
+            if len(fields) <= index:
+                return None
+            components = fields[index].split(component_separator)
+            if len(components) <= position:
+                return None
+            return components[position].strip() or None
+
+        if fields[0] == 'OBR':
+            lab = component(3) or component(2)
+            test = component(4)
+        elif fields[0] == 'OBX':
+            if not lab:
+                yield Result(number, None, None, [], (None, None),
+                    'OBX segment without order')
+                continue
+            analytes = [a for a in (component(3, 1), component(3, 0)) if a]
+            value = fields[5].split('~')[0] if len(fields) > 5 else ''
+            numeric = component(2) in (None, 'NM', 'SN')
+            yield Result(number, lab, test, analytes,
+                _parse_value(value, numeric), None)
+
+
+def read_results(path):
+    'Return an iterator over the results of the analyzer file path'
+    with io.open(path, 'r', encoding='utf-8', errors='replace') as fileobj:
+        first = fileobj.readline().lstrip()
+    if first.startswith('MSH'):
+        return read_hl7(path)
+    return read_delimited(path)
+
+
+def spool_files(directory):
+    'Return the files waiting in the spool directory, oldest first'
+    paths = [os.path.join(directory, name) for name in os.listdir(directory)
+        if not name.startswith('.')]
+    paths = [p for p in paths if os.path.isfile(p)]
+    paths.sort(key=lambda p: (os.path.getmtime(p), p))
+    return paths
+
+
+def batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -7,8 +7,15 @@ if os.path.isdir(DIR):
     sys.path.insert(0, os.path.dirname(DIR))
 
 import unittest
+import tempfile
+from datetime import date, datetime
+from decimal import Decimal
 import trytond.tests.test_tryton
 from trytond.tests.test_tryton import test_view, test_depends
+from trytond.tests.test_tryton import POOL, DB_NAME, USER, CONTEXT
+from trytond.transaction import Transaction
+from trytond.exceptions import UserError
+from trytond.modules.health_lab.lab_results import read_results, Result
 
 
 class HealthLabTestCase(unittest.TestCase):
@@ -31,6 +38,294 @@ class HealthLabTestCase(unittest.TestCase):
         '''
         test_depends()
 
+    def test0010cumulative(self):
+        '''
+        Test the cumulative results and their trend.
+        '''
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            ModelData = POOL.get('ir.model.data')
+            Uom = POOL.get('product.uom')
+            Template = POOL.get('product.template')
+            Party = POOL.get('party.party')
+            Patient = POOL.get('gnuhealth.patient')
+            TestType = POOL.get('gnuhealth.lab.test_type')
+            Lab = POOL.get('gnuhealth.lab')
+            Cumulative = POOL.get('gnuhealth.lab.cumulative')
+
+            unit = Uom(ModelData.get_id('product', 'uom_unit'))
+            template, = Template.create([{
+                        'name': 'Creatinine',
+                        'type': 'service',
+                        'list_price': Decimal('10'),
+                        'cost_price': Decimal('5'),
+                        'default_uom': unit.id,
+                        'products': [('create', [{}])],
+                        }])
+            test_type, = TestType.create([{
+                        'name': 'Creatinine',
+                        'code': 'CREA',
+                        'product_id': template.products[0].id,
+                        }])
+            party, = Party.create([{
+                        'name': 'Patient',
+                        'is_person': True,
+                        'is_patient': True,
+                        'sex': 'f',
+                        'activation_date': date.today(),
+                        }])
+            patient, = Patient.create([{
+                        'name': party.id,
+                        'identification_code': 'PAC001',
+                        }])
+
+            for year, value in ((2012, 1.0), (2013, 1.1), (2014, 2.0)):
+                Lab.create([{
+                            'test': test_type.id,
+                            'patient': patient.id,
+                            'date_requested': datetime(year, 1, 1),
+                            'date_analysis': datetime(year, 1, 2),
+                            'critearea': [('create', [{
+                                            'name': 'Creatinine',
+                                            'result': value,
+                                            'lower_limit': 0.6,
+                                            'upper_limit': 1.2,
+                                            }])],
+                            }])
+
+            results = Cumulative.search([('patient', '=', patient.id)])
+            self.assertEqual([(r.date.year, r.previous_result, r.trend)
+                    for r in results], [
+                    (2014, 1.1, 'up'),
+                    (2013, 1.0, 'stable'),
+                    (2012, None, None),
+                    ])
+            self.assertEqual([r.delta_check for r in results],
+                [True, False, False])
+
+            dates, rows = Cumulative.pivot(patient.id)
+            self.assertEqual(len(dates), 3)
+            self.assertEqual(rows, [('Creatinine', None, [1.0, 1.1, 2.0])])
+
+            transaction.cursor.rollback()
+
+    def test0020orders(self):
+        '''
+        Test the creation of lab tests from orders.
+        '''
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            ModelData = POOL.get('ir.model.data')
+            Uom = POOL.get('product.uom')
+            Template = POOL.get('product.template')
+            Party = POOL.get('party.party')
+            Patient = POOL.get('gnuhealth.patient')
+            TestType = POOL.get('gnuhealth.lab.test_type')
+            Lab = POOL.get('gnuhealth.lab')
+
+            unit = Uom(ModelData.get_id('product', 'uom_unit'))
+            template, = Template.create([{
+                        'name': 'Glucose',
+                        'type': 'service',
+                        'list_price': Decimal('10'),
+                        'cost_price': Decimal('5'),
+                        'default_uom': unit.id,
+                        'products': [('create', [{}])],
+                        }])
+            test_type, = TestType.create([{
+                        'name': 'Glucose',
+                        'code': 'GLU',
+                        'product_id': template.products[0].id,
+                        'critearea': [('create', [{
+                                        'name': 'Glucose',
+                                        'lower_limit': 70,
+                                        'upper_limit': 100,
+                                        }])],
+                        }])
+            party, = Party.create([{
+                        'name': 'Patient',
+                        'is_person': True,
+                        'is_patient': True,
+                        'sex': 'm',
+                        'activation_date': date.today(),
+                        }])
+            patient, = Patient.create([{
+                        'name': party.id,
+                        'identification_code': 'PAC001',
+                        }])
+
+            lab_ids = Lab.create_orders([{
+                        'test': test_type.id,
+                        'patient': patient.id,
+                        'urgent': True,
+                        }] * 2)
+            self.assertEqual(len(set(lab_ids)), 2)
+            for lab in Lab.browse(lab_ids):
+                self.assertTrue(lab.urgent)
+                self.assertEqual([(c.name, c.patient, c.lower_limit)
+                        for c in lab.critearea],
+                    [('Glucose', patient, 70)])
+
+            self.assertRaises(UserError, Lab.create_orders, [{
+                        'test': test_type.id,
+                        }])
+
+            transaction.cursor.rollback()
+
+    def write_results(self, content):
+        fd, path = tempfile.mkstemp()
+        os.write(fd, content)
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test0030read_results(self):
+        '''
+        Test the readers of the analyzer files.
+        '''
+        path = self.write_results('\r'.join([
+                    'MSH|^~\\&|ANALYZER|LAB|GNUHEALTH|HOSP|20140106120000'
+                    '||ORU^R01|1|P|2.5',
+                    'PID|1||PAC001',
+                    'OBR|1|LAB001|LAB002|CREA^Creatinine',
+                    'OBX|1|NM|2160-0^Creatinine||2.0|mg/dL|0.6-1.2|H',
+                    'OBX|2|ST|HIV^HIV test||positive~negative',
+                    'MSH|^~\\&|ANALYZER|LAB|GNUHEALTH|HOSP|20140106120000'
+                    '||ORU^R01|2|P|2.5',
+                    'OBX|1|NM|GLU^Glucose||90',
+                    ]))
+        self.assertEqual(list(read_results(path)), [
+                Result(4, 'LAB002', 'CREA', ['Creatinine', '2160-0'],
+                    (2.0, None), None),
+                Result(5, 'LAB002', 'CREA', ['HIV test', 'HIV'],
+                    (None, 'positive'), None),
+                Result(7, None, None, [], (None, None),
+                    'OBX segment without order'),
+                ])
+
+        # The separator is detected from the header
+        path = self.write_results('Lab;Analyte;Result\n'
+            'LAB001;Creatinine;1.5\n'
+            'LAB001;Urea\n'
+            '\n'
+            'LAB001;HIV;negative\n')
+        self.assertEqual(list(read_results(path)), [
+                Result(2, 'LAB001', None, ['Creatinine'], (1.5, None), None),
+                Result(3, None, None, [], (None, None), 'Missing values'),
+                Result(5, 'LAB001', None, ['HIV'], (None, 'negative'), None),
+                ])
+
+        path = self.write_results('lab\ttest\tanalyte\tresult\n'
+            'LAB001\tCREA\tCreatinine\t1.1\n')
+        self.assertEqual(list(read_results(path)), [
+                Result(2, 'LAB001', 'CREA', ['Creatinine'], (1.1, None),
+                    None),
+                ])
+
+        path = self.write_results('lab,value\nLAB001,1\n')
+        self.assertEqual(list(read_results(path)), [
+                Result(1, None, None, [], (None, None),
+                    'Missing columns: analyte, result'),
+                ])
+
+    def test0040post_results(self):
+        '''
+        Test the posting of the analyzer results.
+        '''
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            ModelData = POOL.get('ir.model.data')
+            Uom = POOL.get('product.uom')
+            Template = POOL.get('product.template')
+            Party = POOL.get('party.party')
+            Patient = POOL.get('gnuhealth.patient')
+            TestType = POOL.get('gnuhealth.lab.test_type')
+            Lab = POOL.get('gnuhealth.lab')
+            Critearea = POOL.get('gnuhealth.lab.test.critearea')
+
+            unit = Uom(ModelData.get_id('product', 'uom_unit'))
+            template, = Template.create([{
+                        'name': 'Renal Panel',
+                        'type': 'service',
+                        'list_price': Decimal('10'),
+                        'cost_price': Decimal('5'),
+                        'default_uom': unit.id,
+                        'products': [('create', [{}])],
+                        }])
+            test_type, = TestType.create([{
+                        'name': 'Renal Panel',
+                        'code': 'RENAL',
+                        'product_id': template.products[0].id,
+                        }])
+            party, = Party.create([{
+                        'name': 'Patient',
+                        'is_person': True,
+                        'is_patient': True,
+                        'sex': 'f',
+                        'activation_date': date.today(),
+                        }])
+            patient, = Patient.create([{
+                        'name': party.id,
+                        'identification_code': 'PAC001',
+                        }])
+            lab, = Lab.create([{
+                        'name': 'LAB001',
+                        'test': test_type.id,
+                        'patient': patient.id,
+                        'critearea': [('create', [{
+                                        'name': 'Creatinine',
+                                        'sequence': 1,
+                                        'lower_limit': 0.6,
+                                        'upper_limit': 1.2,
+                                        }, {
+                                        'name': 'Sodium',
+                                        'sequence': 2,
+                                        'result': 150,
+                                        'lower_limit': 135,
+                                        'upper_limit': 145,
+                                        'warning': True,
+                                        }, {
+                                        'name': 'Urea',
+                                        'sequence': 3,
+                                        }, {
+                                        'name': 'Urea',
+                                        'sequence': 4,
+                                        }, {
+                                        'name': 'HIV',
+                                        'sequence': 5,
+                                        }])],
+                        }])
+
+            # Urea is ambiguous without the test code and LAB002 unknown
+            rejected = Critearea.post_results([
+                    Result(1, 'LAB001', 'RENAL', ['Creatinine'], (2.0, None),
+                        None),
+                    Result(2, 'LAB001', None, ['NA', 'Sodium '],
+                        (140.0, None), None),
+                    Result(3, 'LAB001', None, ['Urea'], (30.0, None), None),
+                    Result(4, 'LAB001', 'RENAL', ['hiv'], (None, 'negative'),
+                        None),
+                    Result(5, 'LAB002', 'RENAL', ['Creatinine'], (1.0, None),
+                        None),
+                    Result(6, None, None, [], (None, None), 'Missing values'),
+                    ])
+            self.assertEqual(sorted((r.line, r.error) for r in rejected), [
+                    (3, 'Unknown analyte'),
+                    (5, 'Unknown analyte'),
+                    (6, 'Missing values'),
+                    ])
+            lab = Lab(lab.id)
+            self.assertEqual([(c.name, c.result, c.result_text, c.warning)
+                    for c in lab.critearea], [
+                    ('Creatinine', 2.0, None, True),
+                    ('Sodium', 140.0, None, False),
+                    ('Urea', None, None, False),
+                    ('Urea', None, None, False),
+                    ('HIV', None, 'negative', False),
+                    ])
+
+            transaction.cursor.rollback()
+
 def suite():
     suite = trytond.tests.test_tryton.suite()
     suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
@@ -22,3 +22,4 @@
 ##############################################################################
 
 from wizard_create_lab_test import *
+from wizard_import_lab_results import *
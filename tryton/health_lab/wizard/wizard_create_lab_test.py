@@ -27,8 +27,9 @@ from trytond.transaction import Transaction
 from trytond.pool import Pool
 
 
-__all__ = ['CreateLabTestOrderInit', 'CreateLabTestOrder', 'RequestTest',
-    'RequestPatientLabTestStart', 'RequestPatientLabTest']
+__all__ = ['CreateLabTestOrderInit', 'CreateLabTestOrderResult',
+    'CreateLabTestOrder', 'RequestTest', 'RequestPatientLabTestStart',
+    'RequestPatientLabTest']
 
 
 class CreateLabTestOrderInit(ModelView):
@@ -36,6 +37,14 @@ class CreateLabTestOrderInit(ModelView):
     __name__ = 'gnuhealth.lab.test.create.init'
 
 
+class CreateLabTestOrderResult(ModelView):
+    'Create Test Report Result'
+    __name__ = 'gnuhealth.lab.test.create.result'
+
+    ordered = fields.Integer('Ordered Tests', readonly=True)
+    skipped = fields.Text('Skipped Tests', readonly=True)
+
+
 class CreateLabTestOrder(Wizard):
     'Create Lab Test Report'
     __name__ = 'gnuhealth.lab.test.create'
@@ -47,46 +56,59 @@ class CreateLabTestOrder(Wizard):
             ])
 
     create_lab_test = StateTransition()
+    result = StateView('gnuhealth.lab.test.create.result',
+        'health_lab.view_lab_make_test_result', [
+            Button('Close', 'end', 'tryton-close', True),
+            ])
+
+    @classmethod
+    def __setup__(cls):
+        super(CreateLabTestOrder, cls).__setup__()
+        cls._error_messages.update({
+                'already_ordered': 'The Lab test order is already created.',
+                })
 
     def transition_create_lab_test(self):
         TestRequest = Pool().get('gnuhealth.patient.lab.test')
         Lab = Pool().get('gnuhealth.lab')
 
-        tests_report_data = []
-
+        # The requests already ordered are reported, the others are
+        # ordered together
         tests = TestRequest.browse(Transaction().context.get('active_ids'))
-
+        to_order = []
+        orders = []
+        skipped = []
         for lab_test_order in tests:
-
-            test_cases = []
-            test_report_data = {}
-
             if lab_test_order.state == 'ordered':
-                raise Exception('The Lab test order is already created.')
-
-            test_report_data['test'] = lab_test_order.name.id
-            test_report_data['patient'] = lab_test_order.patient_id.id
-            if lab_test_order.doctor_id:
-                test_report_data['requestor'] = lab_test_order.doctor_id.id
-            test_report_data['date_requested'] = lab_test_order.date
-
-            for critearea in lab_test_order.name.critearea:
-                test_cases.append(('create', [{
-                        'name': critearea.name,
-                        'sequence': critearea.sequence,
-                        'lower_limit': critearea.lower_limit,
-                        'upper_limit': critearea.upper_limit,
-                        'normal_range': critearea.normal_range,
-                        'units': critearea.units and critearea.units.id,
-                    }]))
-            test_report_data['critearea'] = test_cases
-
-            tests_report_data.append(test_report_data)
-
-        Lab.create(tests_report_data)
-        TestRequest.write(tests, {'state': 'ordered'})
-
-        return 'end'
+                skipped.append('%s - %s (%s): %s' % (lab_test_order.request,
+                        lab_test_order.name.rec_name,
+                        lab_test_order.patient_id.rec_name,
+                        self.raise_user_error('already_ordered',
+                            raise_exception=False)))
+                continue
+            to_order.append(lab_test_order)
+            orders.append({
+                    'test': lab_test_order.name.id,
+                    'patient': lab_test_order.patient_id.id,
+                    'requestor': (lab_test_order.doctor_id
+                        and lab_test_order.doctor_id.id),
+                    'date_requested': lab_test_order.date,
+                    'urgent': lab_test_order.urgent,
+                    })
+
+        if orders:
+            Lab.create_orders(orders)
+            TestRequest.write(to_order, {'state': 'ordered'})
+
+        self.result.ordered = len(orders)
+        self.result.skipped = '\n'.join(skipped)
+        return 'result'
+
+    def default_result(self, fields):
+        return {
+            'ordered': self.result.ordered,
+            'skipped': self.result.skipped,
+            }
 
 
 class RequestTest(ModelView):
@@ -122,19 +144,8 @@ class RequestPatientLabTestStart(ModelView):
 
     @staticmethod
     def default_doctor():
-        cursor = Transaction().cursor
-        User = Pool().get('res.user')
-        user = User(Transaction().user)
-        login_user_id = int(user.id)
-        cursor.execute('SELECT id FROM party_party WHERE is_healthprof=True AND \
-            internal_user = %s LIMIT 1', (login_user_id,))
-        partner_id = cursor.fetchone()
-        if partner_id:
-            cursor = Transaction().cursor
-            cursor.execute('SELECT id FROM gnuhealth_healthprofessional WHERE \
-                name = %s LIMIT 1', (partner_id[0],))
-            doctor_id = cursor.fetchone()
-            return int(doctor_id[0])
+        HealthProf = Pool().get('gnuhealth.healthprofessional')
+        return HealthProf.get_health_professional()
 
 
 class RequestPatientLabTest(Wizard):
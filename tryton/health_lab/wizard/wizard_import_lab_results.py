@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    GNU Health: The Free Health and Hospital Information System
+#    Copyright (C) 2008-2014 Luis Falcon <lfalcon@gnusolidario.org>
+#    Copyright (C) 2011-2014 GNU Solidario <health@gnusolidario.org>
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+import csv
+import os
+import time
+from trytond.model import ModelView, fields
+from trytond.wizard import Wizard, StateTransition, StateView, Button
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+from trytond.config import CONFIG
+
+from ..lab_results import Result, read_results, spool_files, batches
+
+
+__all__ = ['ImportLabResultsStart', 'ImportLabResultsResult',
+    'ImportLabResults']
+
+
+class ImportLabResultsStart(ModelView):
+    'Import Lab Results Start'
+    __name__ = 'gnuhealth.lab.result.import.start'
+
+    directory = fields.Char('Spool Directory', readonly=True,
+        help='Directory where the analyzers export their results'
+        ' (HL7 ORU or delimited files), set by the lab_results_spool'
+        ' option of the server configuration')
+
+
+class ImportLabResultsResult(ModelView):
+    'Import Lab Results Result'
+    __name__ = 'gnuhealth.lab.result.import.result'
+
+    files = fields.Integer('Files', readonly=True)
+    posted = fields.Integer('Posted Results', readonly=True)
+    rejected = fields.Text('Rejected Results', readonly=True)
+
+
+class ImportLabResults(Wizard):
+    'Import Lab Results'
+    __name__ = 'gnuhealth.lab.result.import'
+
+    start = StateView('gnuhealth.lab.result.import.start',
+        'health_lab.view_lab_result_import_start', [
+            Button('Cancel', 'end', 'tryton-cancel'),
+            Button('Import', 'import_results', 'tryton-ok', True),
+            ])
+    import_results = StateTransition()
+    result = StateView('gnuhealth.lab.result.import.result',
+        'health_lab.view_lab_result_import_result', [
+            Button('Close', 'end', 'tryton-close', True),
+            ])
+
+    # Results posted together
+    _batch_size = 1000
+    # Rejected results shown in the result view, all of them are written
+    # next to the processed file
+    _rejected_shown = 100
+
+    @classmethod
+    def __setup__(cls):
+        super(ImportLabResults, cls).__setup__()
+        cls._error_messages.update({
+                'no_spool_directory': 'The lab_results_spool option of the'
+                ' server configuration does not name a directory.',
+                'not_lab_admin': 'Only the Health lab Administration group'
+                ' can import lab results.',
+                })
+
+    @staticmethod
+    def spool_directory():
+        'Return the spool directory of the server configuration'
+        return CONFIG.get('lab_results_spool')
+
+    def check_access(self):
+        pool = Pool()
+        ModelData = pool.get('ir.model.data')
+        User = pool.get('res.user')
+
+        if Transaction().user == 0:
+            return
+        group_id = ModelData.get_id('health_lab', 'group_health_lab_admin')
+        if group_id not in User.get_groups():
+            self.raise_user_error('not_lab_admin')
+
+    @classmethod
+    def import_directory(cls, directory):
+        '''Post the results of the analyzer files waiting in directory.
+        The results of each file are committed before the file is moved to
+        the "done" subdirectory, with the rejected lines in a ".rejected"
+        file, the unreadable files are rolled back and moved to the "error"
+        subdirectory.
+        Return the number of files, the number of posted results and the
+        list of rejected results as (file name, Result)'''
+        Critearea = Pool().get('gnuhealth.lab.test.critearea')
+        cursor = Transaction().cursor
+
+        files, posted, rejected = 0, 0, []
+        for path in spool_files(directory):
+            file_posted, file_rejected = 0, []
+            try:
+                for batch in batches(read_results(path), cls._batch_size):
+                    batch_rejected = Critearea.post_results(batch)
+                    file_posted += len(batch) - len(batch_rejected)
+                    file_rejected.extend(batch_rejected)
+            except (EnvironmentError, csv.Error) as exception:
+                cursor.rollback()
+                cls._move(path, 'error')
+                rejected.append((os.path.basename(path), str(exception)))
+                continue
+            # A file is moved only once its results are committed, so it is
+            # imported again if the transaction fails
+            cursor.commit()
+            files += 1
+            posted += file_posted
+            done = cls._move(path, 'done')
+            if file_rejected:
+                with open(done + '.rejected', 'w') as fileobj:
+                    for result in file_rejected:
+                        fileobj.write(cls._format_rejected(result) + '\n')
+            rejected.extend((os.path.basename(path), r)
+                for r in file_rejected)
+        return files, posted, rejected
+
+    @staticmethod
+    def _format_rejected(result):
+        if not isinstance(result, Result):
+            return result
+        return '%s: %s %s %s: %s' % (result.line, result.lab or '',
+            result.test or '', '/'.join(result.analytes), result.error)
+
+    @staticmethod
+    def _move(path, subdirectory):
+        directory = os.path.join(os.path.dirname(path), subdirectory)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        target = os.path.join(directory, os.path.basename(path))
+        if os.path.exists(target):
+            target += '.' + time.strftime('%Y%m%d%H%M%S')
+        os.rename(path, target)
+        return target
+
+    def default_start(self, fields):
+        return {
+            'directory': self.spool_directory(),
+            }
+
+    def transition_import_results(self):
+        self.check_access()
+        directory = self.spool_directory()
+        if not directory or not os.path.isdir(directory):
+            self.raise_user_error('no_spool_directory')
+        files, posted, rejected = self.import_directory(directory)
+
+        self.result.files = files
+        self.result.posted = posted
+        lines = ['%s:%s' % (name, self._format_rejected(result))
+            for name, result in rejected[:self._rejected_shown]]
+        if len(rejected) > self._rejected_shown:
+            lines.append('...')
+        self.result.rejected = '\n'.join(lines)
+        return 'result'
+
+    def default_result(self, fields):
+        return {
+            'files': self.result.files,
+            'posted': self.result.posted,
+            'rejected': self.result.rejected,
+            }
@@ -25,14 +25,21 @@ from .health_reporting import *
 
 def register():
     Pool.register(
+        EvaluationsDaily,
+        PatientEvaluation,
         TopDiseases,
         OpenTopDiseasesStart,
         OpenEvaluationsStart,
         EvaluationsDoctor,
         EvaluationsSpecialty,
         EvaluationsSector,
+        EpidemiologySeries,
+        EpidemiologySeriesLine,
+        OpenEpidemiologySeriesStart,
         module='health_reporting', type_='model')
     Pool.register(
         OpenTopDiseases,
         OpenEvaluations,
+        RebuildEvaluationsDaily,
+        OpenEpidemiologySeries,
         module='health_reporting', type_='wizard')
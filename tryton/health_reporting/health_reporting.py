@@ -22,19 +22,263 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 ##############################################################################
-from sql import Literal, Join
-from sql.aggregate import Max, Count
+from collections import deque, Counter
+from datetime import date, datetime, timedelta
+from dateutil.relativedelta import relativedelta
+import csv
+import json
+import StringIO
+from sql import Literal, Join, Cast
+from sql.aggregate import Max, Count, Sum
+from sql.conditionals import Case
+from sql.functions import Now, Age, Extract
 from trytond.model import ModelView, ModelSQL, fields
 from trytond.wizard import Wizard, StateView, StateAction, StateTransition, \
     Button
 from trytond.pyson import PYSONEncoder
-from trytond.pool import Pool
+from trytond.pool import Pool, PoolMeta
 from trytond.transaction import Transaction
+from trytond.tools import reduce_ids
+from trytond import backend
+from trytond.config import CONFIG
+from trytond.modules.health.health import DateTrunc
 
 
-__all__ = ['TopDiseases', 'OpenTopDiseasesStart', 'OpenTopDiseases',
+__all__ = ['EvaluationsDaily', 'PatientEvaluation', 'RebuildEvaluationsDaily',
+    'TopDiseases', 'OpenTopDiseasesStart', 'OpenTopDiseases',
     'OpenEvaluationsStart', 'OpenEvaluations', 'EvaluationsDoctor',
-    'EvaluationsSpecialty', 'EvaluationsSector']
+    'EvaluationsSpecialty', 'EvaluationsSector', 'EpidemiologySeries',
+    'EpidemiologySeriesLine', 'OpenEpidemiologySeriesStart',
+    'OpenEpidemiologySeries']
+__metaclass__ = PoolMeta
+
+
+class EvaluationsDaily(ModelSQL):
+    'Daily Evaluations'
+    __name__ = 'gnuhealth.evaluations.daily'
+
+    # Number of evaluations per day, diagnosis, doctor, specialty and
+    # operational sector of the patient, read by the reports below.
+    # The counts of the evaluations are updated when they change.
+    date = fields.Date('Date', required=True, select=True)
+    diagnosis = fields.Many2One('gnuhealth.pathology', 'Diagnosis')
+    doctor = fields.Many2One('gnuhealth.healthprofessional', 'Doctor')
+    specialty = fields.Many2One('gnuhealth.specialty', 'Specialty')
+    sector = fields.Many2One('gnuhealth.operational_sector', 'Sector')
+    evaluations = fields.Integer('Evaluations', required=True)
+
+    @classmethod
+    def __register__(cls, module_name):
+        TableHandler = backend.get('TableHandler')
+        cursor = Transaction().cursor
+        created = not TableHandler.table_exist(cursor, cls._table)
+
+        super(EvaluationsDaily, cls).__register__(module_name)
+
+        if CONFIG['db_type'] == 'postgresql':
+            # One row per key, the NULL keys included, so the concurrent
+            # updates of a key can not create it twice
+            index_name = cls._table + '_key_index'
+            cursor.execute('SELECT 1 FROM pg_indexes WHERE indexname = %s',
+                (index_name,))
+            if not cursor.fetchone():
+                cursor.execute('CREATE UNIQUE INDEX "' + index_name + '" '
+                    'ON "' + cls._table + '" (date, '
+                    'COALESCE(diagnosis, 0), COALESCE(doctor, 0), '
+                    'COALESCE(specialty, 0), COALESCE(sector, 0))')
+
+        if created:
+            cls.rebuild()
+
+    @staticmethod
+    def _rollup_join():
+        # The evaluations with the operational sector of their patient
+        pool = Pool()
+        evaluation = pool.get('gnuhealth.patient.evaluation').__table__()
+        patient = pool.get('gnuhealth.patient').__table__()
+        party = pool.get('party.party').__table__()
+        du = pool.get('gnuhealth.du').__table__()
+
+        join = evaluation.join(patient, 'LEFT',
+            condition=patient.id == evaluation.patient
+            ).join(party, 'LEFT', condition=party.id == patient.name
+            ).join(du, 'LEFT', condition=du.id == party.du)
+        return join, evaluation, du
+
+    @classmethod
+    def _rollup_query(cls, where):
+        join, evaluation, du = cls._rollup_join()
+        day = DateTrunc('day', evaluation.evaluation_start)
+        return join.select(
+            Literal(Transaction().user),
+            Now(),
+            day,
+            evaluation.diagnosis,
+            evaluation.healthprof,
+            evaluation.specialty,
+            du.operational_sector,
+            Count(Literal(1)),
+            where=where,
+            group_by=[day, evaluation.diagnosis, evaluation.healthprof,
+                evaluation.specialty, du.operational_sector])
+
+    @classmethod
+    def _rollup_insert(cls, where):
+        table = cls.__table__()
+        return table.insert(
+            columns=[table.create_uid, table.create_date, table.date,
+                table.diagnosis, table.doctor, table.specialty,
+                table.sector, table.evaluations],
+            values=cls._rollup_query(where))
+
+    @classmethod
+    def get_keys(cls, evaluation_ids):
+        '''Return the number of evaluations of evaluation_ids per key of
+        the daily rows: (date, diagnosis, doctor, specialty, sector)'''
+        cursor = Transaction().cursor
+        join, evaluation, du = cls._rollup_join()
+
+        keys = Counter()
+        for i in range(0, len(evaluation_ids), cursor.IN_MAX):
+            sub_ids = evaluation_ids[i:i + cursor.IN_MAX]
+            cursor.execute(*join.select(evaluation.evaluation_start,
+                    evaluation.diagnosis, evaluation.healthprof,
+                    evaluation.specialty, du.operational_sector,
+                    where=reduce_ids(evaluation.id, sub_ids)))
+            for start, diagnosis, doctor, specialty, sector in (
+                    cursor.fetchall()):
+                keys[(start.date(), diagnosis, doctor, specialty,
+                        sector)] += 1
+        return keys
+
+    @classmethod
+    def update_counts(cls, counts):
+        '''Add the number of evaluations of counts, a Counter by key, to
+        the daily rows. Only the rows of these keys are locked, so the
+        evaluations of other days, doctors, ... are saved concurrently.
+        On PostgreSQL the existing rows are locked with FOR UPDATE and the
+        unique index of the keys makes the concurrent creation of the same
+        new key fail instead of counting it twice'''
+        cursor = Transaction().cursor
+        table = cls.__table__()
+        user = Transaction().user
+        now = datetime.now()
+        columns = [table.date, table.diagnosis, table.doctor,
+            table.specialty, table.sector]
+
+        # The keys are sorted so the rows are always locked in the same
+        # order
+        decreased = []
+        for key, number in sorted(counts.iteritems()):
+            if not number:
+                continue
+            where = Literal(True)
+            for column, value in zip(columns, key):
+                where &= column == value
+            query, args = table.select(table.id, where=where)
+            if CONFIG['db_type'] == 'postgresql':
+                query += ' FOR UPDATE'
+            cursor.execute(query, args)
+            row = cursor.fetchone()
+            if row:
+                cursor.execute(*table.update(
+                        [table.evaluations, table.write_uid,
+                            table.write_date],
+                        [table.evaluations + number, user, now],
+                        where=table.id == row[0]))
+                if number < 0:
+                    decreased.append(row[0])
+            elif number > 0:
+                cursor.execute(*table.insert(
+                        [table.create_uid, table.create_date] + columns
+                        + [table.evaluations],
+                        [[user, now] + list(key) + [number]]))
+        for i in range(0, len(decreased), cursor.IN_MAX):
+            cursor.execute(*table.delete(
+                    where=reduce_ids(table.id, decreased[i:i + cursor.IN_MAX])
+                    & (table.evaluations <= 0)))
+
+    @classmethod
+    def rebuild(cls):
+        'Compute again the evaluations of all the days'
+        cursor = Transaction().cursor
+        table = cls.__table__()
+
+        cursor.execute(*table.delete())
+        cursor.execute(*cls._rollup_insert(Literal(True)))
+
+    @classmethod
+    def report_where(cls, table):
+        # Date range of the report, from the context
+        where = Literal(True)
+        if Transaction().context.get('start_date'):
+            where &= table.date >= Transaction().context['start_date']
+        if Transaction().context.get('end_date'):
+            where &= table.date <= Transaction().context['end_date']
+        return where
+
+
+class PatientEvaluation:
+    __name__ = 'gnuhealth.patient.evaluation'
+
+    _evaluations_daily_fields = set(['evaluation_start', 'diagnosis',
+            'healthprof', 'specialty', 'patient'])
+
+    @classmethod
+    def __register__(cls, module_name):
+        TableHandler = backend.get('TableHandler')
+        cursor = Transaction().cursor
+
+        super(PatientEvaluation, cls).__register__(module_name)
+
+        table = TableHandler(cursor, cls, module_name)
+        table.index_action('evaluation_start', 'add')
+
+    @classmethod
+    def create(cls, vlist):
+        EvaluationsDaily = Pool().get('gnuhealth.evaluations.daily')
+
+        evaluations = super(PatientEvaluation, cls).create(vlist)
+        EvaluationsDaily.update_counts(
+            EvaluationsDaily.get_keys([e.id for e in evaluations]))
+        return evaluations
+
+    @classmethod
+    def write(cls, evaluations, values):
+        EvaluationsDaily = Pool().get('gnuhealth.evaluations.daily')
+
+        if not cls._evaluations_daily_fields.intersection(values):
+            return super(PatientEvaluation, cls).write(evaluations, values)
+
+        ids = [e.id for e in evaluations]
+        previous = EvaluationsDaily.get_keys(ids)
+        super(PatientEvaluation, cls).write(evaluations, values)
+        counts = EvaluationsDaily.get_keys(ids)
+        counts.subtract(previous)
+        EvaluationsDaily.update_counts(counts)
+
+    @classmethod
+    def delete(cls, evaluations):
+        EvaluationsDaily = Pool().get('gnuhealth.evaluations.daily')
+
+        counts = Counter()
+        counts.subtract(EvaluationsDaily.get_keys([e.id for e in evaluations]))
+        super(PatientEvaluation, cls).delete(evaluations)
+        EvaluationsDaily.update_counts(counts)
+
+
+class RebuildEvaluationsDaily(Wizard):
+    'Rebuild Evaluations Statistics'
+    __name__ = 'gnuhealth.evaluations.daily.rebuild'
+
+    start_state = 'rebuild'
+    rebuild = StateTransition()
+
+    def transition_rebuild(self):
+        EvaluationsDaily = Pool().get('gnuhealth.evaluations.daily')
+
+        EvaluationsDaily.rebuild()
+        return 'end'
 
 
 class TopDiseases(ModelSQL, ModelView):
@@ -52,36 +296,33 @@ class TopDiseases(ModelSQL, ModelView):
     @staticmethod
     def table_query():
         pool = Pool()
-        Evaluation = pool.get('gnuhealth.patient.evaluation')
-        evaluation = Evaluation.__table__()
-        source = evaluation
-        where = evaluation.diagnosis != None
-        if Transaction().context.get('start_date'):
-            where &= evaluation.evaluation_start >= \
-                Transaction().context['start_date']
-        if Transaction().context.get('end_date'):
-            where &= evaluation.evaluation_start <= \
-                Transaction().context['end_date']
+        EvaluationsDaily = pool.get('gnuhealth.evaluations.daily')
+        daily = EvaluationsDaily.__table__()
+        source = daily
+        where = daily.diagnosis != None
+        where &= EvaluationsDaily.report_where(daily)
         if Transaction().context.get('group'):
             DiseaseGroupMembers = pool.get('gnuhealth.disease_group.members')
             diseasegroupmembers = DiseaseGroupMembers.__table__()
-            join = Join(evaluation, diseasegroupmembers)
-            join.condition = join.right.name == evaluation.diagnosis
+            join = Join(daily, diseasegroupmembers)
+            join.condition = join.right.name == daily.diagnosis
             where &= join.right.disease_group == Transaction().context['group']
             source = join
 
+        cases = Sum(daily.evaluations)
         select = source.select(
-            evaluation.diagnosis.as_('id'),
-            Max(evaluation.create_uid).as_('create_uid'),
-            Max(evaluation.create_date).as_('create_date'),
-            Max(evaluation.write_uid).as_('write_uid'),
-            Max(evaluation.write_date).as_('write_date'),
-            evaluation.diagnosis.as_('disease'),
-            Count(evaluation.diagnosis).as_('cases'),
+            daily.diagnosis.as_('id'),
+            Max(daily.create_uid).as_('create_uid'),
+            Max(daily.create_date).as_('create_date'),
+            Max(daily.write_uid).as_('write_uid'),
+            Max(daily.write_date).as_('write_date'),
+            daily.diagnosis.as_('disease'),
+            cases.as_('cases'),
             where=where,
-            group_by=evaluation.diagnosis)
+            group_by=daily.diagnosis)
 
         if Transaction().context.get('number_records'):
+            select.order_by = cases.desc
             select.limit = Transaction().context['number_records']
 
         return select
@@ -195,27 +436,22 @@ class EvaluationsDoctor(ModelSQL, ModelView):
 
     @staticmethod
     def table_query():
-        pool = Pool()
-        Evaluation = pool.get('gnuhealth.patient.evaluation')
-        evaluation = Evaluation.__table__()
-        where = Literal(True)
-        if Transaction().context.get('start_date'):
-            where &= evaluation.evaluation_start >= \
-                Transaction().context['start_date']
-        if Transaction().context.get('end_date'):
-            where &= evaluation.evaluation_start <= \
-                Transaction().context['end_date']
-
-        return evaluation.select(
-            evaluation.doctor.as_('id'),
-            Max(evaluation.create_uid).as_('create_uid'),
-            Max(evaluation.create_date).as_('create_date'),
-            Max(evaluation.write_uid).as_('write_uid'),
-            Max(evaluation.write_date).as_('write_date'),
-            evaluation.doctor,
-            Count(evaluation.diagnosis).as_('evaluations'),
+        EvaluationsDaily = Pool().get('gnuhealth.evaluations.daily')
+        daily = EvaluationsDaily.__table__()
+        where = EvaluationsDaily.report_where(daily)
+
+        # Only the evaluations with a diagnosis are counted
+        return daily.select(
+            daily.doctor.as_('id'),
+            Max(daily.create_uid).as_('create_uid'),
+            Max(daily.create_date).as_('create_date'),
+            Max(daily.write_uid).as_('write_uid'),
+            Max(daily.write_date).as_('write_date'),
+            daily.doctor,
+            Sum(Case((daily.diagnosis != None, daily.evaluations),
+                    else_=0)).as_('evaluations'),
             where=where,
-            group_by=evaluation.doctor)
+            group_by=daily.doctor)
 
 
 class EvaluationsSpecialty(ModelSQL, ModelView):
@@ -227,27 +463,21 @@ class EvaluationsSpecialty(ModelSQL, ModelView):
 
     @staticmethod
     def table_query():
-        pool = Pool()
-        Evaluation = pool.get('gnuhealth.patient.evaluation')
-        evaluation = Evaluation.__table__()
-        where = evaluation.specialty != None
-        if Transaction().context.get('start_date'):
-            where &= evaluation.evaluation_start >= \
-                Transaction().context['start_date']
-        if Transaction().context.get('end_date'):
-            where &= evaluation.evaluation_start <= \
-                Transaction().context['end_date']
-
-        return evaluation.select(
-            evaluation.specialty.as_('id'),
-            Max(evaluation.create_uid).as_('create_uid'),
-            Max(evaluation.create_date).as_('create_date'),
-            Max(evaluation.write_uid).as_('write_uid'),
-            Max(evaluation.write_date).as_('write_date'),
-            evaluation.specialty,
-            Count(evaluation.specialty).as_('evaluations'),
+        EvaluationsDaily = Pool().get('gnuhealth.evaluations.daily')
+        daily = EvaluationsDaily.__table__()
+        where = daily.specialty != None
+        where &= EvaluationsDaily.report_where(daily)
+
+        return daily.select(
+            daily.specialty.as_('id'),
+            Max(daily.create_uid).as_('create_uid'),
+            Max(daily.create_date).as_('create_date'),
+            Max(daily.write_uid).as_('write_uid'),
+            Max(daily.write_date).as_('write_date'),
+            daily.specialty,
+            Sum(daily.evaluations).as_('evaluations'),
             where=where,
-            group_by=evaluation.specialty)
+            group_by=daily.specialty)
 
 
 class EvaluationsSector(ModelSQL, ModelView):
@@ -259,36 +489,373 @@ class EvaluationsSector(ModelSQL, ModelView):
 
     @staticmethod
     def table_query():
+        EvaluationsDaily = Pool().get('gnuhealth.evaluations.daily')
+        daily = EvaluationsDaily.__table__()
+        where = daily.sector != None
+        where &= EvaluationsDaily.report_where(daily)
+
+        return daily.select(
+            daily.sector.as_('id'),
+            Max(daily.create_uid).as_('create_uid'),
+            Max(daily.create_date).as_('create_date'),
+            Max(daily.write_uid).as_('write_uid'),
+            Max(daily.write_date).as_('write_date'),
+            daily.sector,
+            Sum(daily.evaluations).as_('evaluations'),
+            where=where,
+            group_by=daily.sector)
+
+
+AGE_BANDS = [
+    (0, 4),
+    (5, 14),
+    (15, 24),
+    (25, 44),
+    (45, 64),
+    (65, None),
+    ]
+
+PERIODS = [
+    ('week', 'Week'),
+    ('month', 'Month'),
+    ]
+
+DIMENSIONS = [
+    ('pathology', 'Disease'),
+    ('disease_group', 'Disease Group'),
+    ('sector', 'Operational Sector'),
+    ('age_band', 'Age Band'),
+    ]
+
+SOURCES = [
+    ('evaluation', 'Evaluations'),
+    ('disease', 'Patient Diseases'),
+    ]
+
+
+class EpidemiologySeries(ModelSQL, ModelView):
+    'Epidemiological Series'
+    __name__ = 'gnuhealth.epidemiology.series'
+
+    # Number of cases per period (week or month) and per disease, disease
+    # group, operational sector or age band, with the moving average and
+    # the difference with the previous period.
+
+    start_date = fields.Date('Start Date', required=True)
+    end_date = fields.Date('End Date', required=True)
+    group = fields.Many2One('gnuhealth.pathology.group', 'Disease Group',
+        help='Only count the diseases of this group')
+    period = fields.Selection(PERIODS, 'Period', required=True, sort=False)
+    dimension = fields.Selection(DIMENSIONS, 'Per', required=True,
+        sort=False)
+    source = fields.Selection(SOURCES, 'Source', required=True, sort=False,
+        help='Diagnosis of the evaluations or date of diagnosis of the'
+        ' patient diseases')
+    average_periods = fields.Integer('Moving Average Periods',
+        required=True)
+    computed = fields.DateTime('Computed', readonly=True)
+    lines = fields.One2Many('gnuhealth.epidemiology.series.line', 'series',
+        'Lines', readonly=True)
+    csv_export = fields.Function(fields.Binary('CSV'), 'get_export')
+    json_export = fields.Function(fields.Binary('JSON'), 'get_export')
+
+    # Number of periods aggregated by each query, the series are computed
+    # chunk by chunk so the memory does not depend on the size of the
+    # evaluation table
+    _chunk_periods = 26
+
+    @classmethod
+    def __setup__(cls):
+        super(EpidemiologySeries, cls).__setup__()
+        cls._order.insert(0, ('computed', 'DESC'))
+        cls._sql_constraints += [
+            ('average_periods_positive', 'CHECK(average_periods > 0)',
+                'The moving average needs at least one period'),
+            ]
+        cls._buttons.update({
+                'compute': {},
+                })
+
+    @staticmethod
+    def default_period():
+        return 'week'
+
+    @staticmethod
+    def default_dimension():
+        return 'pathology'
+
+    @staticmethod
+    def default_source():
+        return 'evaluation'
+
+    @staticmethod
+    def default_average_periods():
+        return 4
+
+    def get_rec_name(self, name):
+        return '%s - %s' % (self.start_date, self.end_date)
+
+    def period_index(self, day):
+        # Consecutive periods have consecutive indexes
+        if self.period == 'month':
+            return day.year * 12 + day.month - 1
+        # date.toordinal() of mondays, the first day of the weeks, are
+        # multiple of 7 plus 1
+        return (day.toordinal() - 1) // 7
+
+    def period_start(self, index):
+        if self.period == 'month':
+            return date(index // 12, index % 12 + 1, 1)
+        return date.fromordinal(index * 7 + 1)
+
+    def _extract_query(self, start, end):
+        # Number of cases per period and dimension between start and end
         pool = Pool()
-        evaluation = pool.get('gnuhealth.patient.evaluation').__table__()
-        party = pool.get('party.party').__table__()
         patient = pool.get('gnuhealth.patient').__table__()
+        party = pool.get('party.party').__table__()
         du = pool.get('gnuhealth.du').__table__()
-        sector = pool.get('gnuhealth.operational_sector').__table__()
-        join1 = Join(evaluation, patient)
-        join1.condition = join1.right.id == evaluation.patient
-        join2 = Join(join1, party)
-        join2.condition = join2.right.id == join1.right.name
-        join3 = Join(join2, du)
-        join3.condition = join3.right.id == join2.right.du
-        join4 = Join(join3, sector)
-        join4.condition = join4.right.id == join3.right.operational_sector
-        where = Literal(True)
-        if Transaction().context.get('start_date'):
-            where &= evaluation.evaluation_start >= \
-                Transaction().context['start_date']
-        if Transaction().context.get('end_date'):
-            where &= evaluation.evaluation_start <= \
-                Transaction().context['end_date']
-
-        return join4.select(
-            join4.right.id,
-            Max(evaluation.create_uid).as_('create_uid'),
-            Max(evaluation.create_date).as_('create_date'),
-            Max(evaluation.write_uid).as_('write_uid'),
-            Max(evaluation.write_date).as_('write_date'),
-            join4.right.id.as_('sector'),
-            Count(join4.right.id).as_('evaluations'),
+        members = pool.get('gnuhealth.disease_group.members').__table__()
+
+        if self.source == 'evaluation':
+            source = pool.get('gnuhealth.patient.evaluation').__table__()
+            day, pathology, patient_id = (source.evaluation_start,
+                source.diagnosis, source.patient)
+        else:
+            source = pool.get('gnuhealth.patient.disease').__table__()
+            day, pathology, patient_id = (source.diagnosed_date,
+                source.pathology, source.name)
+
+        join = source.join(patient, 'LEFT',
+            condition=patient.id == patient_id
+            ).join(party, 'LEFT', condition=party.id == patient.name)
+        where = ((pathology != None) & (day >= start) & (day < end))
+        if self.group:
+            where &= pathology.in_(members.select(members.name,
+                    where=members.disease_group == self.group.id))
+
+        if self.dimension == 'pathology':
+            key = pathology
+        elif self.dimension == 'disease_group':
+            join = join.join(members,
+                condition=members.name == pathology)
+            key = members.disease_group
+            if self.group:
+                where &= members.disease_group == self.group.id
+        elif self.dimension == 'sector':
+            join = join.join(du, 'LEFT', condition=du.id == party.du)
+            key = du.operational_sector
+        else:
+            years = Extract('YEAR', Age(day, party.dob))
+            bands = []
+            for low, high in AGE_BANDS:
+                if high is None:
+                    bands.append((years >= low, '%s+' % low))
+                else:
+                    bands.append((years <= high, '%s-%s' % (low, high)))
+            key = Case(*bands, else_='unknown')
+
+        period = Cast(DateTrunc(self.period, day), 'DATE')
+        return join.select(key, period, Count(Literal(1)),
             where=where,
-            group_by=join4.right.id)
+            group_by=[key, period],
+            order_by=[key, period])
+
+    def compute_lines(self):
+        '''Yield the values of the lines of the series, one by period
+        between the start and the end date for each key with cases'''
+        cursor = Transaction().cursor
+
+        first = self.period_index(self.start_date)
+        last = self.period_index(self.end_date)
+        # The last period and number of cases of each key, within the window
+        windows = {}
+        for chunk in range(first, last + 1, self._chunk_periods):
+            start = max(self.period_start(chunk), self.start_date)
+            end = min(self.period_start(chunk + self._chunk_periods),
+                self.end_date + timedelta(days=1))
+            cursor.execute(*self._extract_query(start, end))
+            for key, period, cases in cursor.fetchall():
+                index = self.period_index(period)
+                last_index, counts = windows.get(key,
+                    (first - 1, deque(maxlen=self.average_periods)))
+                # Periods without cases
+                for empty in range(last_index + 1, index):
+                    yield self._line_values(key, empty, 0, counts)
+                yield self._line_values(key, index, cases, counts)
+                windows[key] = index, counts
+        for key, (last_index, counts) in windows.iteritems():
+            for empty in range(last_index + 1, last + 1):
+                yield self._line_values(key, empty, 0, counts)
+
+    def _line_values(self, key, index, cases, counts):
+        # Add the cases of the period index to counts, the cases of the
+        # previous periods of key
+        previous = counts[-1] if counts else None
+        counts.append(cases)
+        return {
+            'key': key,
+            'period_start': self.period_start(index),
+            'cases': cases,
+            'moving_average': float(sum(counts)) / len(counts),
+            'previous_cases': previous,
+            'delta': cases - previous if previous is not None else None,
+            }
+
+    @classmethod
+    @ModelView.button
+    def compute(cls, series):
+        pool = Pool()
+        Line = pool.get('gnuhealth.epidemiology.series.line')
+        cursor = Transaction().cursor
+        line = Line.__table__()
+
+        columns = [line.create_uid, line.create_date, line.series,
+            line.period_start, line.cases, line.moving_average,
+            line.previous_cases, line.delta]
+        for record in series:
+            cursor.execute(*line.delete(where=line.series == record.id))
+            key_column = getattr(line, record.dimension)
+            values = []
+            for values_ in record.compute_lines():
+                values.append([Transaction().user, Now(), record.id,
+                        values_['period_start'], values_['cases'],
+                        values_['moving_average'], values_['previous_cases'],
+                        values_['delta'], values_['key']])
+                if len(values) >= cursor.IN_MAX:
+                    cursor.execute(*line.insert(columns + [key_column],
+                            values))
+                    values = []
+            if values:
+                cursor.execute(*line.insert(columns + [key_column], values))
+        cls.write(series, {
+                'computed': datetime.now(),
+                })
+
+    def export(self, format_='csv'):
+        'Return the lines of the series as a CSV or JSON string'
+        header = ['period_start', self.dimension, 'cases', 'moving_average',
+            'previous_cases', 'delta']
+        rows = []
+        for line in self.lines:
+            key = getattr(line, self.dimension)
+            if self.dimension != 'age_band' and key:
+                key = key.rec_name
+            rows.append([line.period_start.isoformat(), key, line.cases,
+                    line.moving_average, line.previous_cases, line.delta])
+
+        if format_ == 'json':
+            return json.dumps([dict(zip(header, row)) for row in rows])
+        data = StringIO.StringIO()
+        writer = csv.writer(data)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow([x.encode('utf-8') if isinstance(x, unicode)
+                    else x for x in row])
+        return data.getvalue()
+
+    @classmethod
+    def get_export(cls, series, names):
+        result = {}
+        for name in names:
+            result[name] = {}
+            format_ = name[:-len('_export')]
+            for record in series:
+                result[name][record.id] = buffer(record.export(format_))
+        return result
+
+
+class EpidemiologySeriesLine(ModelSQL, ModelView):
+    'Epidemiological Series Line'
+    __name__ = 'gnuhealth.epidemiology.series.line'
+
+    series = fields.Many2One('gnuhealth.epidemiology.series', 'Series',
+        required=True, ondelete='CASCADE', select=True)
+    period_start = fields.Date('Period', required=True)
+    pathology = fields.Many2One('gnuhealth.pathology', 'Disease')
+    disease_group = fields.Many2One('gnuhealth.pathology.group',
+        'Disease Group')
+    sector = fields.Many2One('gnuhealth.operational_sector', 'Sector')
+    age_band = fields.Char('Age Band')
+    cases = fields.Integer('Cases', required=True)
+    moving_average = fields.Float('Moving Average', digits=(16, 2))
+    previous_cases = fields.Integer('Previous Period',
+        help='Cases of the previous period')
+    delta = fields.Integer('Delta',
+        help='Difference with the cases of the previous period')
+
+    @classmethod
+    def __setup__(cls):
+        super(EpidemiologySeriesLine, cls).__setup__()
+        cls._order.insert(0, ('period_start', 'ASC'))
+
+
+class OpenEpidemiologySeriesStart(ModelView):
+    'Open Epidemiological Series'
+    __name__ = 'gnuhealth.epidemiology.series.open.start'
+
+    start_date = fields.Date('Start Date', required=True)
+    end_date = fields.Date('End Date', required=True)
+    group = fields.Many2One('gnuhealth.pathology.group', 'Disease Group')
+    period = fields.Selection(PERIODS, 'Period', required=True, sort=False)
+    dimension = fields.Selection(DIMENSIONS, 'Per', required=True,
+        sort=False)
+    source = fields.Selection(SOURCES, 'Source', required=True, sort=False)
+    average_periods = fields.Integer('Moving Average Periods',
+        required=True, domain=[('average_periods', '>', 0)])
+
+    @staticmethod
+    def default_end_date():
+        return date.today()
+
+    @staticmethod
+    def default_start_date():
+        return date.today() - relativedelta(years=1)
+
+    @staticmethod
+    def default_period():
+        return 'week'
+
+    @staticmethod
+    def default_dimension():
+        return 'pathology'
 
+    @staticmethod
+    def default_source():
+        return 'evaluation'
+
+    @staticmethod
+    def default_average_periods():
+        return 4
+
+
+class OpenEpidemiologySeries(Wizard):
+    'Open Epidemiological Series'
+    __name__ = 'gnuhealth.epidemiology.series.open'
+
+    start = StateView('gnuhealth.epidemiology.series.open.start',
+        'health_reporting.epidemiology_series_open_start_view_form', [
+            Button('Cancel', 'end', 'tryton-cancel'),
+            Button('Open', 'open_', 'tryton-ok', default=True),
+            ])
+    open_ = StateAction('health_reporting.act_epidemiology_series_form')
+
+    def do_open_(self, action):
+        Series = Pool().get('gnuhealth.epidemiology.series')
+
+        series, = Series.create([{
+                    'start_date': self.start.start_date,
+                    'end_date': self.start.end_date,
+                    'group': self.start.group.id if self.start.group else None,
+                    'period': self.start.period,
+                    'dimension': self.start.dimension,
+                    'source': self.start.source,
+                    'average_periods': self.start.average_periods,
+                    }])
+        Series.compute([series])
+        action['pyson_domain'] = PYSONEncoder().encode([
+                ('id', '=', series.id),
+                ])
+        return action, {}
+
+    def transition_open_(self):
+        return 'end'
@@ -25,8 +25,12 @@ if os.path.isdir(DIR):
     sys.path.insert(0, os.path.dirname(DIR))
 
 import unittest
+from datetime import date, datetime
 import trytond.tests.test_tryton
 from trytond.tests.test_tryton import test_view, test_depends
+from trytond.tests.test_tryton import POOL, DB_NAME, USER, CONTEXT
+from trytond.transaction import Transaction
+from trytond.config import CONFIG
 
 
 class HealthReportingTestCase(unittest.TestCase):
@@ -49,6 +53,144 @@ class HealthReportingTestCase(unittest.TestCase):
         '''
         test_depends()
 
+    @unittest.skipIf(CONFIG['db_type'] != 'postgresql',
+        'The series truncate the dates by week with PostgreSQL')
+    def test0010series(self):
+        '''
+        Test the epidemiological series.
+        '''
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            Party = POOL.get('party.party')
+            Patient = POOL.get('gnuhealth.patient')
+            Pathology = POOL.get('gnuhealth.pathology')
+            Disease = POOL.get('gnuhealth.patient.disease')
+            Series = POOL.get('gnuhealth.epidemiology.series')
+
+            party, = Party.create([{
+                        'name': 'Patient',
+                        'is_person': True,
+                        'is_patient': True,
+                        'sex': 'm',
+                        'activation_date': date.today(),
+                        }])
+            patient, = Patient.create([{
+                        'name': party.id,
+                        'identification_code': 'PAC001',
+                        }])
+            pathology, dengue = Pathology.create([{
+                        'name': 'Influenza',
+                        'code': 'J11',
+                        }, {
+                        'name': 'Dengue',
+                        'code': 'A90',
+                        }])
+            Disease.create([{
+                        'name': patient.id,
+                        'pathology': pathology.id,
+                        'diagnosed_date': diagnosed_date,
+                        } for diagnosed_date in [date(2014, 1, 6),
+                        date(2014, 1, 20), date(2014, 3, 3),
+                        date(2014, 3, 31)]] + [{
+                        'name': patient.id,
+                        'pathology': dengue.id,
+                        'diagnosed_date': date(2014, 2, 10),
+                        }])
+
+            series, = Series.create([{
+                        'start_date': date(2014, 1, 1),
+                        'end_date': date(2014, 3, 31),
+                        'period': 'month',
+                        'dimension': 'pathology',
+                        'source': 'disease',
+                        'average_periods': 2,
+                        }])
+            Series.compute([series])
+            series = Series(series.id)
+            lines = [l for l in series.lines if l.pathology == pathology]
+            self.assertEqual([(l.period_start, l.cases, l.previous_cases,
+                        l.delta) for l in lines], [
+                    (date(2014, 1, 1), 2, None, None),
+                    (date(2014, 2, 1), 0, 2, -2),
+                    (date(2014, 3, 1), 2, 0, 2),
+                    ])
+            self.assertEqual([l.moving_average for l in lines],
+                [2.0, 1.0, 1.0])
+            # The periods without cases before and after the cases
+            lines = [l for l in series.lines if l.pathology == dengue]
+            self.assertEqual([(l.period_start, l.cases, l.previous_cases,
+                        l.delta) for l in lines], [
+                    (date(2014, 1, 1), 0, None, None),
+                    (date(2014, 2, 1), 1, 0, 1),
+                    (date(2014, 3, 1), 0, 1, -1),
+                    ])
+
+            transaction.cursor.rollback()
+
+    def test0020evaluations_daily(self):
+        '''
+        Test the counts of the daily evaluations.
+        '''
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            Party = POOL.get('party.party')
+            Patient = POOL.get('gnuhealth.patient')
+            Evaluation = POOL.get('gnuhealth.patient.evaluation')
+            EvaluationsDaily = POOL.get('gnuhealth.evaluations.daily')
+            HealthProf = POOL.get('gnuhealth.healthprofessional')
+
+            party, doctor_party = Party.create([{
+                        'name': 'Patient',
+                        'is_person': True,
+                        'is_patient': True,
+                        'sex': 'f',
+                        'activation_date': date.today(),
+                        }, {
+                        'name': 'Doctor',
+                        'is_person': True,
+                        'is_healthprof': True,
+                        'internal_user': USER,
+                        'sex': 'm',
+                        'activation_date': date.today(),
+                        }])
+            HealthProf.create([{'name': doctor_party.id}])
+            patient, = Patient.create([{
+                        'name': party.id,
+                        'identification_code': 'PAC001',
+                        }])
+            evaluations = Evaluation.create([{
+                        'patient': patient.id,
+                        'evaluation_start': evaluation_start,
+                        'evaluation_endtime': evaluation_start,
+                        } for evaluation_start in [
+                        datetime(2014, 1, 6, 9), datetime(2014, 1, 6, 11),
+                        datetime(2014, 1, 7, 9)]])
+
+            def counts():
+                return [(d.date, d.evaluations) for d in
+                    EvaluationsDaily.search([], order=[('date', 'ASC')])]
+            self.assertEqual(counts(),
+                [(date(2014, 1, 6), 2), (date(2014, 1, 7), 1)])
+
+            Evaluation.create([{
+                        'patient': patient.id,
+                        'evaluation_start': datetime(2014, 1, 6, 15),
+                        'evaluation_endtime': datetime(2014, 1, 6, 15),
+                        }])
+            self.assertEqual(counts(),
+                [(date(2014, 1, 6), 3), (date(2014, 1, 7), 1)])
+
+            Evaluation.write([evaluations[2]], {
+                    'evaluation_start': datetime(2014, 1, 6, 17),
+                    'evaluation_endtime': datetime(2014, 1, 6, 17),
+                    })
+            self.assertEqual(counts(), [(date(2014, 1, 6), 4)])
+
+            Evaluation.delete(evaluations[:2])
+            self.assertEqual(counts(), [(date(2014, 1, 6), 2)])
+
+            transaction.cursor.rollback()
+
 def suite():
     suite = trytond.tests.test_tryton.suite()
     suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
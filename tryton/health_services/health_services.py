@@ -75,15 +75,14 @@ class HealthService(ModelSQL, ModelView):
 
     @classmethod
     def create(cls, vlist):
-        Sequence = Pool().get('ir.sequence')
         Config = Pool().get('gnuhealth.sequences')
 
         vlist = [x.copy() for x in vlist]
-        for values in vlist:
-            if not values.get('name'):
-                config = Config(1)
-                values['name'] = Sequence.get_id(
-                    config.health_service_sequence.id)
+        to_number = [x for x in vlist if not x.get('name')]
+        codes = Config.get_sequence_codes('health_service_sequence',
+            len(to_number))
+        for values, code in zip(to_number, codes):
+            values['name'] = code
         return super(HealthService, cls).create(vlist)
 
 
@@ -30,7 +30,10 @@ def register():
     Pool.register(
         Medicament,
         Party,
+        Location,
         Lot,
+        ExpiringLot,
+        OpenExpiringLotsStart,
         Move,
         PatientAmbulatoryCare,
         PatientAmbulatoryCareMedicament,
@@ -42,7 +45,10 @@ def register():
         PatientRoundingVaccine,
         PatientPrescriptionOrder,
         CreatePrescriptionStockMoveInit,
+        CreatePrescriptionStockMoveResult,
         module='health_stock', type_='model')
     Pool.register(
         CreatePrescriptionStockMove,
+        OpenExpiringLots,
+        CloseCares,
         module='health_stock', type_='wizard')
@@ -21,21 +21,31 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 ##############################################################################
-from datetime import datetime
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sql import Literal
+from sql.aggregate import Sum
+from sql.conditionals import Case
 from trytond.model import Workflow, ModelView, ModelSQL, fields
-from trytond.wizard import Wizard, StateView, Button, StateTransition
-from trytond.pyson import If, Or, Eval, Not, Bool
+from trytond.wizard import Wizard, StateView, Button, StateTransition, \
+    StateAction
+from trytond.pyson import If, Or, Eval, Not, Bool, PYSONEncoder
 from trytond.exceptions import UserError
 from trytond.transaction import Transaction
 from trytond.pool import Pool, PoolMeta
+from trytond.tools import reduce_ids
+from trytond import backend
+from trytond.cache import Cache
 
-__all__ = ['Medicament', 'Party', 'Lot', 'Move',
+__all__ = ['Medicament', 'Party', 'Location', 'Lot', 'ExpiringLot',
+    'OpenExpiringLotsStart', 'OpenExpiringLots', 'Move',
     'PatientAmbulatoryCare', 'PatientAmbulatoryCareMedicament',
     'PatientAmbulatoryCareMedicalSupply', 'PatientAmbulatoryCareVaccine',
     'PatientRounding', 'PatientRoundingMedicament',
     'PatientRoundingMedicalSupply', 'PatientRoundingVaccine',
     'PatientPrescriptionOrder', 'CreatePrescriptionStockMoveInit',
-    'CreatePrescriptionStockMove']
+    'CreatePrescriptionStockMoveResult', 'CreatePrescriptionStockMove',
+    'CloseCares']
 __metaclass__ = PoolMeta
 
 _STATES = {
@@ -48,25 +58,85 @@ class Medicament:
     __name__ = 'gnuhealth.medicament'
     quantity = fields.Function(fields.Float('Quantity'), 'get_quantity')
 
-    def get_quantity(self, name):
+    _storage_locations_cache = Cache(
+        'gnuhealth.medicament.get_storage_locations', context=False)
+
+    @classmethod
+    def get_storage_locations(cls):
+        'Return the ids of the storage locations'
+        Location = Pool().get('stock.location')
+
+        location_ids = cls._storage_locations_cache.get('storage')
+        if location_ids is None:
+            location_ids = [l.id for l in Location.search([
+                        ('type', '=', 'storage'),
+                        ])]
+            cls._storage_locations_cache.set('storage', location_ids)
+        return location_ids
+
+    @staticmethod
+    def _products_by_location(location_ids, product_ids, with_childs):
         pool = Pool()
         Date = pool.get('ir.date')
-        Location = pool.get('stock.location')
         Product = pool.get('product.product')
 
-        locations = Location.search([('type', '=', 'storage')])
-        Transaction().set_context({'locations': [l.id for l in locations]})
-        context = {}
-        context['stock_date_end'] = Date.today()
-        Transaction().set_context(context)
+        with Transaction().set_context(stock_date_end=Date.today()):
+            return Product.products_by_location(location_ids=location_ids,
+                product_ids=product_ids, with_childs=with_childs)
+
+    @staticmethod
+    def _product_medicaments(medicaments):
+        product2medicaments = defaultdict(list)
+        for medicament in medicaments:
+            product2medicaments[medicament.name.id].append(medicament.id)
+        return product2medicaments
+
+    @classmethod
+    def get_quantity(cls, medicaments, name):
+        # The stock of the locations of the context, otherwise of all the
+        # storage locations, computed at once for all the medicaments
+        if Transaction().context.get('locations'):
+            location_ids = Transaction().context['locations']
+            with_childs = True
+        else:
+            # Each storage location counts only its own stock as its
+            # children are also storage locations
+            location_ids = cls.get_storage_locations()
+            with_childs = False
+
+        quantities = dict((m.id, 0.0) for m in medicaments)
+        if not location_ids:
+            return quantities
+        product2medicaments = cls._product_medicaments(medicaments)
+        pbl = cls._products_by_location(location_ids,
+            product2medicaments.keys(), with_childs)
+        for (location_id, product_id), quantity in pbl.iteritems():
+            for medicament_id in product2medicaments[product_id]:
+                quantities[medicament_id] += quantity
+        return quantities
 
-        pbl = Product.products_by_location(
-                location_ids=Transaction().context['locations'],
-                product_ids=[self.name.id], with_childs=True)
-        quantity = 0.00
-        if pbl.values():
-            quantity = reduce(lambda x, y: x + y, pbl.values())
-        return quantity
+    @classmethod
+    def get_quantity_by_warehouse(cls, medicaments):
+        '''Return the quantity of the medicaments in the storage zone of
+        each warehouse as {medicament id: {warehouse id: quantity}}'''
+        Location = Pool().get('stock.location')
+
+        warehouses = Location.search([('type', '=', 'warehouse')])
+        storage2warehouse = dict((w.storage_location.id, w.id)
+            for w in warehouses if w.storage_location)
+        quantities = dict((m.id, dict((w, 0.0)
+                        for w in storage2warehouse.itervalues()))
+            for m in medicaments)
+        if not storage2warehouse:
+            return quantities
+        product2medicaments = cls._product_medicaments(medicaments)
+        pbl = cls._products_by_location(storage2warehouse.keys(),
+            product2medicaments.keys(), True)
+        for (location_id, product_id), quantity in pbl.iteritems():
+            warehouse_id = storage2warehouse[location_id]
+            for medicament_id in product2medicaments[product_id]:
+                quantities[medicament_id][warehouse_id] += quantity
+        return quantities
 
 
 class Party:
@@ -87,25 +157,164 @@ class Party:
             return locations[0].id
 
 
+class Location:
+    __name__ = 'stock.location'
+
+    @classmethod
+    def create(cls, vlist):
+        Medicament = Pool().get('gnuhealth.medicament')
+        Medicament._storage_locations_cache.clear()
+        return super(Location, cls).create(vlist)
+
+    @classmethod
+    def write(cls, locations, values):
+        Medicament = Pool().get('gnuhealth.medicament')
+        Medicament._storage_locations_cache.clear()
+        return super(Location, cls).write(locations, values)
+
+    @classmethod
+    def delete(cls, locations):
+        Medicament = Pool().get('gnuhealth.medicament')
+        Medicament._storage_locations_cache.clear()
+        return super(Location, cls).delete(locations)
+
+
 class Lot:
     __name__ = 'stock.lot'
     expiration_date = fields.Date('Expiration Date')
     quantity = fields.Function(fields.Float('Quantity'), 'sum_lot_quantity')
 
-    def sum_lot_quantity(self, name):
-        Move = Pool().get('stock.move')
+    @classmethod
+    def __register__(cls, module_name):
+        TableHandler = backend.get('TableHandler')
+        cursor = Transaction().cursor
+
+        super(Lot, cls).__register__(module_name)
+
+        table = TableHandler(cursor, cls, module_name)
+        table.index_action(['product', 'expiration_date'], 'add')
+
+    @classmethod
+    def quantity_query(cls, lot_ids=None, expiration_date=None):
+        '''Return the query of the quantity of the lots in the storage
+        locations, in the default unit of their product, as columns id
+        and quantity. Like the stock quantity of the products, the done
+        moves are counted and the assigned moves leaving the storage.
+        The lots can be limited to the ids or to the expiration date'''
+        pool = Pool()
+        lot = cls.__table__()
+        move = pool.get('stock.move').__table__()
+        Location = pool.get('stock.location')
+        to_location = Location.__table__()
+        from_location = Location.__table__()
+
+        join = lot.join(move, condition=(move.lot == lot.id)
+            & (move.product == lot.product)
+            ).join(to_location, condition=to_location.id == move.to_location
+            ).join(from_location,
+                condition=from_location.id == move.from_location)
+        where = Literal(True)
+        if lot_ids is not None:
+            where &= reduce_ids(lot.id, lot_ids)
+        if expiration_date is not None:
+            where &= lot.expiration_date <= expiration_date
+        done = move.state == 'done'
+        return join.select(lot.id,
+            Sum(Case((done & (to_location.type == 'storage'),
+                        move.internal_quantity), else_=0.0)
+                - Case(((done | (move.state == 'assigned'))
+                        & (from_location.type == 'storage'),
+                        move.internal_quantity), else_=0.0)
+                ).as_('quantity'),
+            where=where,
+            group_by=lot.id)
+
+    @classmethod
+    def sum_lot_quantity(cls, lots, name):
+        cursor = Transaction().cursor
+
+        quantities = dict((l.id, 0.0) for l in lots)
+        ids = quantities.keys()
+        for i in range(0, len(ids), cursor.IN_MAX):
+            sub_ids = ids[i:i + cursor.IN_MAX]
+            cursor.execute(*cls.quantity_query(lot_ids=sub_ids))
+            quantities.update(cursor.fetchall())
+        return quantities
+
+
+class ExpiringLot(ModelSQL, ModelView):
+    'Expiring Lot'
+    __name__ = 'gnuhealth.lot.expiring'
+
+    lot = fields.Many2One('stock.lot', 'Lot')
+    product = fields.Many2One('product.product', 'Product')
+    expiration_date = fields.Date('Expiration Date')
+    quantity = fields.Float('Quantity')
+
+    @classmethod
+    def __setup__(cls):
+        super(ExpiringLot, cls).__setup__()
+        cls._order.insert(0, ('expiration_date', 'ASC'))
+
+    @staticmethod
+    def table_query():
+        # Lots with stock in the storage locations that expire within the
+        # number of days of the context, including the expired ones
+        pool = Pool()
+        Date = pool.get('ir.date')
+        Lot = pool.get('stock.lot')
+        lot = Lot.__table__()
+
+        days = Transaction().context.get('days') or 0
+        quantities = Lot.quantity_query(
+            expiration_date=Date.today() + timedelta(days=days))
+
+        join = lot.join(quantities, condition=quantities.id == lot.id)
+        return join.select(
+            lot.id,
+            lot.create_uid,
+            lot.create_date,
+            lot.write_uid,
+            lot.write_date,
+            lot.id.as_('lot'),
+            lot.product,
+            lot.expiration_date,
+            quantities.quantity,
+            where=quantities.quantity > 0)
+
+
+class OpenExpiringLotsStart(ModelView):
+    'Open Expiring Lots'
+    __name__ = 'gnuhealth.lot.expiring.open.start'
+
+    days = fields.Integer('Days', required=True,
+        help='Lots that expire within this number of days')
+
+    @staticmethod
+    def default_days():
+        return 30
+
 
-        moves = Move.search([
-            ('lot', '=', self.id),
-            ('product', '=', self.product.id)
-        ])
-        quantity = 0
-        for move in moves:
-            if move.to_location.type == 'storage':
-                quantity += move.quantity
-            if move.from_location.type == 'storage':
-                quantity -= move.quantity
-        return quantity
+class OpenExpiringLots(Wizard):
+    'Open Expiring Lots'
+    __name__ = 'gnuhealth.lot.expiring.open'
+
+    start = StateView('gnuhealth.lot.expiring.open.start',
+        'health_stock.expiring_lots_open_start_view_form', [
+            Button('Cancel', 'end', 'tryton-cancel'),
+            Button('Open', 'open_', 'tryton-ok', default=True),
+            ])
+    open_ = StateAction('health_stock.act_expiring_lots_form')
+
+    def do_open_(self, action):
+        action['pyson_context'] = PYSONEncoder().encode({
+                'days': self.start.days,
+                })
+        action['name'] += ' - %s' % self.start.days
+        return action, {}
+
+    def transition_open_(self):
+        return 'end'
 
 
 class Move:
@@ -120,9 +329,120 @@ class Move:
             ]
 
 
-class PatientAmbulatoryCare(Workflow, ModelSQL, ModelView):
+class CareStockMixin(object):
+    # Closing of ambulatory cares and roundings: the lines of all the
+    # records are checked, then the vaccinations and the stock moves are
+    # created at once, each move with the record of its line as origin.
+    # The location and the patient are read from the fields named by
+    # _stock_location_field and _stock_patient_field (a dotted path).
+    _stock_location_field = None
+    _stock_patient_field = None
+
+    def get_stock_location(self):
+        'Return the storage location the lines are taken from'
+        return getattr(self, self._stock_location_field)
+
+    def get_stock_patient(self):
+        'Return the patient who receives the lines'
+        patient = self
+        for name in self._stock_patient_field.split('.'):
+            patient = getattr(patient, name)
+        return patient
+
+    @classmethod
+    def check_lots_expiration(cls, records):
+        Date = Pool().get('ir.date')
+
+        today = Date.today()
+        checked = set()
+        for record in records:
+            for lines, error in (
+                    (record.medicaments, 'Expired medicaments'),
+                    (record.medical_supplies, 'Expired supplies'),
+                    (record.vaccines, 'Expired vaccines')):
+                for line in lines:
+                    if not line.lot or line.lot.id in checked:
+                        continue
+                    checked.add(line.lot.id)
+                    if (line.lot.expiration_date
+                            and line.lot.expiration_date < today):
+                        raise UserError(error)
+
+    @classmethod
+    def create_vaccinations(cls, records):
+        Vaccination = Pool().get('gnuhealth.vaccination')
+
+        vaccinations = []
+        for record in records:
+            patient = record.get_stock_patient()
+            for vaccine in record.vaccines:
+                vaccinations.append({
+                        'name': patient.id,
+                        'vaccine': vaccine.vaccine.id,
+                        'vaccine_lot': (vaccine.lot.number or ''
+                            if vaccine.lot else ''),
+                        'institution': Transaction().context.get('company')
+                            or None,
+                        'date': datetime.now(),
+                        'dose': vaccine.dose,
+                        'next_dose_date': vaccine.next_dose_date,
+                        'vaccine_expiration_date': (
+                            vaccine.lot.expiration_date
+                            if vaccine.lot else None),
+                        'admin_route': vaccine.admin_route,
+                        })
+        if vaccinations:
+            Vaccination.create(vaccinations)
+
+    @staticmethod
+    def _get_stock_move(record, product, quantity, lot):
+        return {
+            'origin': str(record),
+            'product': product.id,
+            'uom': product.default_uom.id,
+            'quantity': quantity,
+            'from_location': record.get_stock_location().id,
+            'to_location':
+                record.get_stock_patient().name.customer_location.id,
+            'unit_price': product.list_price,
+            'lot': lot.id if lot else None,
+            }
+
+    @classmethod
+    def create_stock_moves(cls, records):
+        pool = Pool()
+        Move = pool.get('stock.move')
+        Date = pool.get('ir.date')
+
+        moves = []
+        for record in records:
+            for medicament in record.medicaments:
+                moves.append(cls._get_stock_move(record,
+                        medicament.medicament.name, medicament.quantity,
+                        medicament.lot))
+            for medical_supply in record.medical_supplies:
+                moves.append(cls._get_stock_move(record,
+                        medical_supply.product, medical_supply.quantity,
+                        medical_supply.lot))
+            for vaccine in record.vaccines:
+                moves.append(cls._get_stock_move(record, vaccine.vaccine,
+                        vaccine.quantity, vaccine.lot))
+        if not moves:
+            return True
+
+        new_moves = Move.create(moves)
+        Move.write(new_moves, {
+            'state': 'done',
+            'effective_date': Date.today(),
+            })
+        return True
+
+
+class PatientAmbulatoryCare(CareStockMixin, Workflow, ModelSQL, ModelView):
     'Patient Ambulatory Care'
     __name__ = 'gnuhealth.patient.ambulatory_care'
+    _stock_location_field = 'care_location'
+    _stock_patient_field = 'patient'
 
     care_location = fields.Many2One('stock.location', 'Care Location',
         domain=[('type', '=', 'storage')],
@@ -176,120 +496,9 @@ class PatientAmbulatoryCare(Workflow, ModelSQL, ModelView):
     @ModelView.button
     @Workflow.transition('done')
     def done(cls, ambulatory_cares):
-        pool = Pool()
-        Patient = pool.get('gnuhealth.patient')
-        Vaccination = pool.get('gnuhealth.vaccination')
-
-        lines_to_ship = {}
-        medicaments_to_ship = []
-        supplies_to_ship = []
-        vaccines_to_ship = []
-
-        for ambulatory in ambulatory_cares:
-            patient = Patient(ambulatory.patient.id)
-            for medicament in ambulatory.medicaments:
-                medicaments_to_ship.append(medicament)
-
-            for medical_supply in ambulatory.medical_supplies:
-                supplies_to_ship.append(medical_supply)
-
-            vaccinations = []
-            for vaccine in ambulatory.vaccines:
-                lot_number = ''
-                expiration_date = ''
-                if vaccine.lot:
-                    if vaccine.lot.number:
-                        lot_number = vaccine.lot.number
-                    if vaccine.lot.expiration_date:
-                        expiration_date = vaccine.lot.expiration_date
-                vaccination_data = {
-                    'name': patient.id,
-                    'vaccine': vaccine.vaccine.id,
-                    'vaccine_lot': lot_number,
-                    'institution': Transaction().context.get('company')
-                        or None,
-                    'date': datetime.now(),
-                    'dose': vaccine.dose,
-                    'next_dose_date': vaccine.next_dose_date,
-                    'vaccine_expiration_date': expiration_date,
-                    'admin_route': vaccine.admin_route,
-                    }
-                vaccinations.append(vaccination_data)
-                vaccines_to_ship.append(vaccine)
-            Vaccination.create(vaccinations)
-
-        lines_to_ship['medicaments'] = medicaments_to_ship
-        lines_to_ship['supplies'] = supplies_to_ship
-        lines_to_ship['vaccines'] = vaccines_to_ship
-
-        cls.create_stock_moves(ambulatory_cares, lines_to_ship)
-
-    @classmethod
-    def create_stock_moves(cls, ambulatory_cares, lines):
-        pool = Pool()
-        Move = pool.get('stock.move')
-        Date = pool.get('ir.date')
-        moves = []
-        for ambulatory in ambulatory_cares:
-            for medicament in lines['medicaments']:
-                move_info = {}
-                move_info['origin'] = str(ambulatory)
-                move_info['product'] = medicament.medicament.name.id
-                move_info['uom'] = medicament.medicament.name.default_uom.id
-                move_info['quantity'] = medicament.quantity
-                move_info['from_location'] = ambulatory.care_location.id
-                move_info['to_location'] = \
-                    ambulatory.patient.name.customer_location.id
-                move_info['unit_price'] = \
-                    medicament.medicament.name.list_price
-                if medicament.lot:
-                    if  medicament.lot.expiration_date \
-                    and medicament.lot.expiration_date < Date.today():
-                        raise UserError('Expired medicaments')
-                    move_info['lot'] = medicament.lot.id
-                moves.append(move_info)
-
-            for medical_supply in lines['supplies']:
-                move_info = {}
-                move_info['origin'] = str(ambulatory)
-                move_info['product'] = medical_supply.product.id
-                move_info['uom'] = medical_supply.product.default_uom.id
-                move_info['quantity'] = medical_supply.quantity
-                move_info['from_location'] = ambulatory.care_location.id
-                move_info['to_location'] = \
-                    ambulatory.patient.name.customer_location.id
-                move_info['unit_price'] = medical_supply.product.list_price
-                if medical_supply.lot:
-                    if  medical_supply.lot.expiration_date \
-                    and medical_supply.lot.expiration_date < Date.today():
-                        raise UserError('Expired supplies')
-                    move_info['lot'] = medical_supply.lot.id
-                moves.append(move_info)
-
-            for vaccine in lines['vaccines']:
-                move_info = {}
-                move_info['origin'] = str(ambulatory)
-                move_info['product'] = vaccine.vaccine.id
-                move_info['uom'] = vaccine.vaccine.default_uom.id
-                move_info['quantity'] = vaccine.quantity
-                move_info['from_location'] = ambulatory.care_location.id
-                move_info['to_location'] = \
-                    ambulatory.patient.name.customer_location.id
-                move_info['unit_price'] = vaccine.vaccine.list_price
-                if vaccine.lot:
-                    if  vaccine.lot.expiration_date \
-                    and vaccine.lot.expiration_date < Date.today():
-                        raise UserError('Expired vaccines')
-                    move_info['lot'] = vaccine.lot.id
-                moves.append(move_info)
-
-        new_moves = Move.create(moves)
-        Move.write(new_moves, {
-            'state': 'done',
-            'effective_date': Date.today(),
-        })
-
-        return True
+        cls.check_lots_expiration(ambulatory_cares)
+        cls.create_vaccinations(ambulatory_cares)
+        cls.create_stock_moves(ambulatory_cares)
 
 
 class PatientAmbulatoryCareMedicament(ModelSQL, ModelView):
@@ -372,9 +581,11 @@ class PatientAmbulatoryCareVaccine(ModelSQL, ModelView):
         return 1
 
 
-class PatientRounding(Workflow, ModelSQL, ModelView):
+class PatientRounding(CareStockMixin, Workflow, ModelSQL, ModelView):
     'Patient Ambulatory Care'
     __name__ = 'gnuhealth.patient.rounding'
+    _stock_location_field = 'hospitalization_location'
+    _stock_patient_field = 'name.patient'
 
     hospitalization_location = fields.Many2One('stock.location',
         'Hospitalization Location', domain=[('type', '=', 'storage')],
@@ -427,118 +638,9 @@ class PatientRounding(Workflow, ModelSQL, ModelView):
     @ModelView.button
     @Workflow.transition('done')
     def done(cls, roundings):
-        pool = Pool()
-        Patient = pool.get('gnuhealth.patient')
-        Vaccination = pool.get('gnuhealth.vaccination')
-
-        lines_to_ship = {}
-        medicaments_to_ship = []
-        supplies_to_ship = []
-        vaccines_to_ship = []
-
-        for rounding in roundings:
-            patient = Patient(rounding.name.patient.id)
-
-            for medicament in rounding.medicaments:
-                medicaments_to_ship.append(medicament)
-
-            for medical_supply in rounding.medical_supplies:
-                supplies_to_ship.append(medical_supply)
-
-            for vaccine in rounding.vaccines:
-                lot_number = ''
-                expiration_date = ''
-                if vaccine.lot:
-                    if vaccine.lot.number:
-                        lot_number = vaccine.lot.number
-                    if vaccine.lot.expiration_date:
-                        expiration_date = vaccine.lot.expiration_date
-                vaccination_data = {
-                    'name': patient.id,
-                    'vaccine': vaccine.vaccine.id,
-                    'vaccine_lot': lot_number,
-                    'institution': Transaction().context.get('company')
-                        or None,
-                    'date': datetime.now(),
-                    'dose': vaccine.dose,
-                    'next_dose_date': vaccine.next_dose_date,
-                    'vaccine_expiration_date': expiration_date,
-                    'admin_route': vaccine.admin_route,
-                    }
-                Vaccination.create([vaccination_data])
-                vaccines_to_ship.append(vaccine)
-
-        lines_to_ship['medicaments'] = medicaments_to_ship
-        lines_to_ship['supplies'] = supplies_to_ship
-        lines_to_ship['vaccines'] = vaccines_to_ship
-
-        cls.create_stock_moves(roundings, lines_to_ship)
-
-    @classmethod
-    def create_stock_moves(cls, roundings, lines):
-        pool = Pool()
-        Move = pool.get('stock.move')
-        Date = pool.get('ir.date')
-        moves = []
-        for rounding in roundings:
-            for medicament in lines['medicaments']:
-                move_info = {}
-                move_info['origin'] = str(rounding)
-                move_info['product'] = medicament.medicament.name.id
-                move_info['uom'] = medicament.medicament.name.default_uom.id
-                move_info['quantity'] = medicament.quantity
-                move_info['from_location'] = \
-                    rounding.hospitalization_location.id
-                move_info['to_location'] = \
-                rounding.name.patient.name.customer_location.id
-                move_info['unit_price'] = medicament.medicament.name.list_price
-                if medicament.lot:
-                    if  medicament.lot.expiration_date \
-                    and medicament.lot.expiration_date < Date.today():
-                        raise UserError('Expired medicaments')
-                    move_info['lot'] = medicament.lot.id
-                moves.append(move_info)
-            for medical_supply in lines['supplies']:
-                move_info = {}
-                move_info['origin'] = str(rounding)
-                move_info['product'] = medical_supply.product.id
-                move_info['uom'] = medical_supply.product.default_uom.id
-                move_info['quantity'] = medical_supply.quantity
-                move_info['from_location'] = \
-                    rounding.hospitalization_location.id
-                move_info['to_location'] = \
-                rounding.name.patient.name.customer_location.id
-                move_info['unit_price'] = medical_supply.product.list_price
-                if medical_supply.lot:
-                    if  medical_supply.lot.expiration_date \
-                    and medical_supply.lot.expiration_date < Date.today():
-                        raise UserError('Expired supplies')
-                    move_info['lot'] = medical_supply.lot.id
-                moves.append(move_info)
-            for vaccine in lines['vaccines']:
-                move_info = {}
-                move_info['origin'] = str(rounding)
-                move_info['product'] = vaccine.vaccine.id
-                move_info['uom'] = vaccine.vaccine.default_uom.id
-                move_info['quantity'] = vaccine.quantity
-                move_info['from_location'] = \
-                    rounding.hospitalization_location.id
-                move_info['to_location'] = \
-                rounding.name.patient.name.customer_location.id
-                move_info['unit_price'] = vaccine.vaccine.list_price
-                if vaccine.lot:
-                    if  vaccine.lot.expiration_date \
-                    and vaccine.lot.expiration_date < Date.today():
-                        raise UserError('Expired vaccines')
-                    move_info['lot'] = vaccine.lot.id
-                moves.append(move_info)
-        new_moves = Move.create(moves)
-        Move.write(new_moves, {
-            'state': 'done',
-            'effective_date': Date.today(),
-            })
-
-        return True
+        cls.check_lots_expiration(roundings)
+        cls.create_vaccinations(roundings)
+        cls.create_stock_moves(roundings)
 
 
 class PatientRoundingMedicament(ModelSQL, ModelView):
@@ -637,6 +739,14 @@ class CreatePrescriptionStockMoveInit(ModelView):
     __name__ = 'gnuhealth.prescription.stock.move.init'
 
 
+class CreatePrescriptionStockMoveResult(ModelView):
+    'Create Prescription Stock Move Result'
+    __name__ = 'gnuhealth.prescription.stock.move.result'
+
+    dispensed = fields.Integer('Dispensed Prescriptions', readonly=True)
+    skipped = fields.Text('Skipped Prescriptions', readonly=True)
+
+
 class CreatePrescriptionStockMove(Wizard):
     'Create Prescription Stock Move'
     __name__ = 'gnuhealth.prescription.stock.move.create'
@@ -648,43 +758,101 @@ class CreatePrescriptionStockMove(Wizard):
                 'tryton-ok', True),
             ])
     create_stock_move = StateTransition()
+    result = StateView('gnuhealth.prescription.stock.move.result',
+            'health_stock.view_create_prescription_stock_move_result', [
+            Button('Close', 'end', 'tryton-close', True),
+            ])
+
+    @classmethod
+    def __setup__(cls):
+        super(CreatePrescriptionStockMove, cls).__setup__()
+        cls._error_messages.update({
+                'moves_exist': 'Stock moves already exist',
+                'no_pharmacy': 'No pharmacy',
+                'no_storage': 'The pharmacy has no warehouse storage',
+                'no_customer_location': 'The patient has no customer'
+                ' location',
+                })
+
+    def check_prescription(self, prescription):
+        'Return the error message that prevents the dispensing, if any'
+        if prescription.moves:
+            error = 'moves_exist'
+        elif not prescription.pharmacy:
+            error = 'no_pharmacy'
+        elif (not prescription.pharmacy.warehouse
+                or not prescription.pharmacy.warehouse.storage_location):
+            error = 'no_storage'
+        elif not prescription.patient.name.customer_location:
+            error = 'no_customer_location'
+        else:
+            return None
+        return self.raise_user_error(error, raise_exception=False)
+
+    @staticmethod
+    def _get_stock_moves(prescription):
+        moves = []
+        for line in prescription.prescription_line:
+            moves.append({
+                    'origin': str(prescription),
+                    'from_location':
+                        prescription.pharmacy.warehouse.storage_location.id,
+                    'to_location':
+                        prescription.patient.name.customer_location.id,
+                    'product': line.medicament.name.id,
+                    'unit_price': line.medicament.name.list_price,
+                    'quantity': line.quantity,
+                    'uom': line.medicament.name.default_uom.id,
+                    'state': 'draft',
+                    })
+        return moves
 
     def transition_create_stock_move(self):
         pool = Pool()
         StockMove = pool.get('stock.move')
         Prescription = pool.get('gnuhealth.prescription.order')
 
+        # All the prescriptions are checked first, the moves of the valid
+        # ones are dispensed together and the others are reported
         prescriptions = Prescription.browse(Transaction().context.get(
             'active_ids'))
+        lines = []
+        dispensed = 0
+        skipped = []
         for prescription in prescriptions:
-
-            if prescription.moves:
-                raise Exception('Stock moves already exists!.')
-
-            if not prescription.pharmacy:
-                raise Exception('You need to enter a pharmacy.')
-
-            lines = []
-            for line in prescription.prescription_line:
-                line_data = {}
-                line_data['origin'] = str(prescription)
-                line_data['from_location'] = \
-                    prescription.pharmacy.warehouse.storage_location.id
-                line_data['to_location'] = \
-                    prescription.patient.name.customer_location.id
-                line_data['product'] = \
-                    line.medicament.name.id
-                line_data['unit_price'] = \
-                    line.medicament.name.list_price
-                line_data['quantity'] = line.quantity
-                line_data['uom'] = \
-                    line.medicament.name.default_uom.id
-                line_data['state'] = 'draft'
-                lines.append(line_data)
+            error = self.check_prescription(prescription)
+            if error:
+                skipped.append('%s: %s' % (prescription.rec_name, error))
+                continue
+            lines.extend(self._get_stock_moves(prescription))
+            dispensed += 1
+
+        if lines:
             moves = StockMove.create(lines)
             StockMove.assign(moves)
             StockMove.do(moves)
 
-        return 'end'
+        self.result.dispensed = dispensed
+        self.result.skipped = '\n'.join(skipped)
+        return 'result'
+
+    def default_result(self, fields):
+        return {
+            'dispensed': self.result.dispensed,
+            'skipped': self.result.skipped,
+            }
 
 
+class CloseCares(Wizard):
+    'Close Cares'
+    __name__ = 'gnuhealth.care.close'
+
+    # Close at once the ambulatory cares or the roundings selected
+    start_state = 'close'
+    close = StateTransition()
+
+    def transition_close(self):
+        Model = Pool().get(Transaction().context['active_model'])
+
+        Model.done(Model.browse(Transaction().context.get('active_ids')))
+        return 'end'
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#    Copyright (C) 2008-2014 Luis Falcon
+#    Copyright (C) 2011-2014 GNU Solidario <health@gnusolidario.org>
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Measure the generation of the work schedule (free appointment slots)
+# of the health_calendar module, for example a year of 10 minutes slots
+# for a clinic of 40 health professionals.
+# The transaction is rolled back, nothing is kept in the database.
+
+from datetime import date, time, timedelta
+import time as time_
+
+from trytond.pool import Pool
+
+from benchmark import option_parser, parse_args, init_pool, transaction, \
+    QueryCounter, print_table
+
+
+def main(options):
+    init_pool(options)
+    rows = []
+    with transaction(options):
+        pool = Pool()
+        Appointment = pool.get('gnuhealth.appointment')
+        HealthProfessional = pool.get('gnuhealth.healthprofessional')
+        Party = pool.get('party.party')
+
+        healthprofs = HealthProfessional.search([],
+            limit=options.healthprofs)
+        institutions = Party.search([('is_institution', '=', True)],
+            limit=1)
+        institution = institutions[0].id if institutions else None
+
+        date_start = date.today()
+        date_end = date_start + timedelta(days=options.days - 1)
+        slots = []
+        for healthprof in healthprofs:
+            specialty = (healthprof.main_specialty.specialty.id
+                if healthprof.main_specialty else None)
+            slots.extend(Appointment.generate_slots(healthprof.id,
+                    specialty, institution, date_start, date_end,
+                    time(8, 0), time(17, 0), options.minutes,
+                    [0, 1, 2, 3, 4]))
+
+        # Second run checks the overlap detection, all slots are skipped
+        for run in ('bulk', 'bulk (overlapping)'):
+            with QueryCounter() as counter:
+                start = time_.time()
+                created, skipped = Appointment.create_free_slots(slots)
+                duration = time_.time() - start
+            rows.append((run, len(healthprofs), len(slots), created,
+                    skipped, counter.count, '%.2f' % duration,
+                    '%.0f' % (len(slots) / max(duration, 1e-6))))
+
+    if options.orm:
+        # Per record creation with the ORM, on a sample of the slots
+        with transaction(options):
+            Appointment = Pool().get('gnuhealth.appointment')
+            sample = slots[:options.orm]
+            with QueryCounter() as counter:
+                start = time_.time()
+                Appointment.create(sample)
+                duration = time_.time() - start
+            rows.append(('orm', len(healthprofs), len(sample), len(sample),
+                    0, counter.count, '%.2f' % duration,
+                    '%.0f' % (len(sample) / max(duration, 1e-6))))
+
+    print_table(('mode', 'healthprofs', 'slots', 'created', 'skipped',
+            'queries', 'seconds', 'slots/s'), rows)
+
+
+if __name__ == '__main__':
+    parser = option_parser()
+    parser.add_option('--healthprofs', dest='healthprofs', type='int',
+        default=40, help='number of health professionals [default: %default]')
+    parser.add_option('--days', dest='days', type='int',
+        default=365, help='days of the schedule [default: %default]')
+    parser.add_option('--minutes', dest='minutes', type='int',
+        default=10, help='minutes of each slot [default: %default]')
+    parser.add_option('--orm', dest='orm', type='int',
+        default=0, help='also create this number of slots with '
+        'Appointment.create to compare')
+    options = parse_args(parser)
+    main(options)
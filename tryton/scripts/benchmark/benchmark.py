@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#    Copyright (C) 2008-2014 Luis Falcon
+#    Copyright (C) 2011-2014 GNU Solidario <health@gnusolidario.org>
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Common helpers for the GNU Health benchmark scripts.
+# The scripts run against a trytond instance in the same process, so
+# the number of SQL queries sent by the ORM can be counted.
+
+import time
+from contextlib import contextmanager
+from optparse import OptionParser
+import sys
+
+from trytond.config import CONFIG
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+
+
+def option_parser(usage="Usage: %prog [options]"):
+    parser = OptionParser(usage=usage)
+    parser.add_option('-d', '--database', dest='database',
+        default='gnuhealth_demo', help='database name [default: %default]')
+    parser.add_option('-c', '--config', dest='config',
+        default=None, help='trytond configuration file')
+    parser.add_option('-u', '--user', dest='user', type='int',
+        default=1, help='user id [default: %default]')
+    parser.add_option('-r', '--repeat', dest='repeat', type='int',
+        default=5, help='repetitions of each measure [default: %default]')
+    return parser
+
+
+def parse_args(parser):
+    options, args = parser.parse_args()
+    if len(args) > 0:
+        parser.error('Too much args!')
+    sys.argv = []  # clean argv for trytond
+    return options
+
+
+def init_pool(options):
+    if options.config:
+        CONFIG.update_etc(options.config)
+    Pool.start()
+    pool = Pool(options.database)
+    pool.init()
+    return pool
+
+
+@contextmanager
+def transaction(options, context=None, commit=False):
+    Transaction().start(options.database, options.user,
+        context=context or {})
+    try:
+        yield Transaction()
+        if commit:
+            Transaction().cursor.commit()
+        else:
+            Transaction().cursor.rollback()
+    finally:
+        Transaction().stop()
+
+
+class QueryCounter(object):
+    'Count the SQL queries executed on the current transaction cursor'
+
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        cursor = Transaction().cursor
+        execute = cursor.execute
+
+        def counted_execute(*args, **kwargs):
+            self.count += 1
+            return execute(*args, **kwargs)
+        cursor.execute = counted_execute
+        self.cursor = cursor
+        return self
+
+    def __exit__(self, type, value, traceback):
+        del self.cursor.execute
+
+
+def measure(options, func, context=None):
+    # Run func in a fresh transaction for each repetition so the record
+    # cache does not hide the queries.
+    # Return the median duration in seconds and the number of queries
+    durations = []
+    queries = 0
+    for i in range(options.repeat):
+        with transaction(options, context=context):
+            with QueryCounter() as counter:
+                start = time.time()
+                func()
+                durations.append(time.time() - start)
+            queries = counter.count
+    durations.sort()
+    return durations[len(durations) // 2], queries
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = int(round((len(values) - 1) * percent / 100.0))
+    return values[index]
+
+
+def print_table(header, rows):
+    widths = [max(len(str(x)) for x in column)
+        for column in zip(header, *rows)]
+    line = '  '.join('%%%ds' % w for w in widths)
+    print(line % tuple(header))
+    for row in rows:
+        print(line % tuple(row))
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+#    Copyright (C) 2008-2014 Luis Falcon
+#    Copyright (C) 2011-2014 GNU Solidario <health@gnusolidario.org>
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Measure the ICU scoring engine (health_icu scoring.py) on synthetic
+# vitals, by columns and row by row as the forms do, and optionally the
+# back-fill of the scores stored in the database.
+# The transaction is rolled back, nothing is kept in the database.
+
+import random
+import time
+
+from sql import Column
+
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+
+from benchmark import option_parser, parse_args, init_pool, transaction, \
+    QueryCounter, print_table
+
+# Synthetic ranges of the variables, and the decimals of the measures
+RANGES = {
+    'age': (16, 95, None),
+    'temperature': (30.0, 42.0, 1),
+    'mean_ap': (40, 180, None),
+    'heart_rate': (30, 200, None),
+    'respiratory_rate': (4, 55, None),
+    'fio2': (0.21, 1.0, 2),
+    'pao2': (40, 120, None),
+    'aado2': (50, 600, None),
+    'ph': (7.0, 7.8, 2),
+    'serum_sodium': (110, 185, None),
+    'serum_potassium': (2.0, 7.5, 1),
+    'serum_creatinine': (0.4, 6.0, 1),
+    'hematocrit': (15.0, 65.0, 1),
+    'wbc': (0.5, 45.0, 1),
+    'platelets': (10, 400, None),
+    'bilirubin': (0.3, 15.0, 1),
+    'gcs': (3, 15, None),
+    'urine_output': (50, 3000, None),
+    }
+
+
+def synthetic_columns(rows):
+    columns = {}
+    for name, (low, high, digits) in RANGES.items():
+        if digits is None:
+            columns[name] = [random.randint(low, high) for i in range(rows)]
+        else:
+            columns[name] = [round(random.uniform(low, high), digits)
+                for i in range(rows)]
+    columns['arf'] = [random.random() < 0.1 for i in range(rows)]
+    columns['chronic_condition'] = [random.random() < 0.2
+        for i in range(rows)]
+    columns['hospital_admission_type'] = [random.choice(['me', 'el'])
+        for i in range(rows)]
+    columns['mechanical_ventilation'] = [random.random() < 0.3
+        for i in range(rows)]
+    columns['vasopressors'] = [random.choice([None, 'low', 'medium', 'high'])
+        for i in range(rows)]
+    columns['glasgow_eyes'] = [str(random.randint(1, 4))
+        for i in range(rows)]
+    columns['glasgow_verbal'] = [str(random.randint(1, 5))
+        for i in range(rows)]
+    columns['glasgow_motor'] = [str(random.randint(1, 6))
+        for i in range(rows)]
+    return columns
+
+
+def main(options):
+    init_pool(options)
+    from trytond.modules.health_icu.scoring import APACHE2_FIELDS, \
+        GLASGOW_FIELDS, SOFA_FIELDS, apache2_scores, apache2_score, \
+        glasgow_scores, sofa_scores
+
+    columns = synthetic_columns(options.rows)
+    rows = []
+    for name, func, fields in (
+            ('apache2', apache2_scores, APACHE2_FIELDS),
+            ('glasgow', glasgow_scores, GLASGOW_FIELDS),
+            ('sofa', sofa_scores, SOFA_FIELDS)):
+        sub_columns = dict((f, columns[f]) for f in fields)
+        start = time.time()
+        func(sub_columns)
+        duration = time.time() - start
+        rows.append(('%s (columns)' % name, options.rows, '-',
+                '%.2f' % duration,
+                '%.0f' % (options.rows / max(duration, 1e-6))))
+
+    if options.single:
+        # Row by row, as on_change_with_apache_score
+        sample = min(options.single, options.rows)
+        start = time.time()
+        for i in range(sample):
+            apache2_score(dict((f, columns[f][i]) for f in APACHE2_FIELDS))
+        duration = time.time() - start
+        rows.append(('apache2 (rows)', sample, '-', '%.2f' % duration,
+                '%.0f' % (sample / max(duration, 1e-6))))
+
+    if options.update:
+        for model in ('gnuhealth.icu.glasgow', 'gnuhealth.icu.apache2',
+                'gnuhealth.icu.sofa'):
+            with transaction(options):
+                Model = Pool().get(model)
+                table = Model.__table__()
+                cursor = Transaction().cursor
+                # Clear the stored scores so all of them are written
+                cursor.execute(*table.update(
+                        [Column(table, Model._score_field)], [None]))
+                records = Model.search_count([])
+                with QueryCounter() as counter:
+                    start = time.time()
+                    Model.update_scores()
+                    duration = time.time() - start
+            rows.append(('%s (update)' % model, records, counter.count,
+                    '%.2f' % duration,
+                    '%.0f' % (records / max(duration, 1e-6))))
+
+    print_table(('scoring', 'rows', 'queries', 'seconds', 'rows/s'), rows)
+
+
+if __name__ == '__main__':
+    parser = option_parser()
+    parser.add_option('-n', '--rows', dest='rows', type='int',
+        default=1000000, help='number of synthetic rows [default: %default]')
+    parser.add_option('--single', dest='single', type='int',
+        default=0, help='also score this number of rows one by one '
+        'to compare')
+    parser.add_option('--update', dest='update', action='store_true',
+        default=False, help='also recompute the scores stored in the '
+        'database')
+    options = parse_args(parser)
+    main(options)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#    Copyright (C) 2008-2014 Luis Falcon
+#    Copyright (C) 2011-2014 GNU Solidario <health@gnusolidario.org>
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Measure the generation of the imaging results of a worklist of requests
+# (health_imaging), in batch and optionally with the per record workflow
+# of the former Generate Result wizard.
+# The transaction is rolled back, nothing is kept in the database.
+
+from datetime import datetime
+import time
+
+from trytond.pool import Pool
+
+from benchmark import option_parser, parse_args, init_pool, transaction, \
+    QueryCounter, print_table
+
+
+def create_requests(number):
+    pool = Pool()
+    Request = pool.get('gnuhealth.imaging.test.request')
+    Patient = pool.get('gnuhealth.patient')
+    Test = pool.get('gnuhealth.imaging.test')
+    HealthProfessional = pool.get('gnuhealth.healthprofessional')
+
+    patients = Patient.search([], limit=100)
+    tests = Test.search([])
+    doctors = HealthProfessional.search([], limit=10)
+    now = datetime.now()
+    return Request.create([{
+                'patient': patients[i % len(patients)].id,
+                'requested_test': tests[i % len(tests)].id,
+                'doctor': doctors[i % len(doctors)].id,
+                'date': now,
+                'state': 'requested',
+                } for i in range(number)])
+
+
+def main(options):
+    init_pool(options)
+    rows = []
+    for size in options.sizes:
+        with transaction(options):
+            Request = Pool().get('gnuhealth.imaging.test.request')
+            requests = create_requests(size)
+            with QueryCounter() as counter:
+                start = time.time()
+                Request.create_results(requests)
+                duration = time.time() - start
+            rows.append(('batch', size, counter.count, '%.2f' % duration,
+                    '%.0f' % (size / max(duration, 1e-6))))
+
+        if options.orm:
+            # One result created and one workflow transition by request
+            with transaction(options):
+                pool = Pool()
+                Request = pool.get('gnuhealth.imaging.test.request')
+                Result = pool.get('gnuhealth.imaging.test.result')
+                requests = create_requests(size)
+                with QueryCounter() as counter:
+                    start = time.time()
+                    for request in requests:
+                        Result.create([{
+                                    'patient': request.patient.id,
+                                    'date': datetime.now(),
+                                    'request_date': request.date,
+                                    'requested_test': request.requested_test,
+                                    'request': request.id,
+                                    'doctor': request.doctor,
+                                    }])
+                        Request.done([request])
+                    duration = time.time() - start
+                rows.append(('orm', size, counter.count, '%.2f' % duration,
+                        '%.0f' % (size / max(duration, 1e-6))))
+
+    print_table(('mode', 'requests', 'queries', 'seconds', 'requests/s'),
+        rows)
+
+
+if __name__ == '__main__':
+    parser = option_parser()
+    parser.add_option('-s', '--size', dest='sizes', type='int',
+        action='append', help='number of requests of the worklist, '
+        'can be repeated [default: 100, 500]')
+    parser.add_option('--orm', dest='orm', action='store_true',
+        default=False, help='also measure the per request creation')
+    options = parse_args(parser)
+    if not options.sizes:
+        options.sizes = [100, 500]
+    main(options)
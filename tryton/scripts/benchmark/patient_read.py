@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#    Copyright (C) 2008-2014 Luis Falcon
+#    Copyright (C) 2011-2014 GNU Solidario <health@gnusolidario.org>
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Measure how the number of queries and the latency of
+# gnuhealth.patient read grow with the size of the patient list.
+
+from datetime import date, timedelta
+import random
+
+from trytond.pool import Pool
+
+from benchmark import option_parser, parse_args, init_pool, transaction, \
+    measure, print_table
+
+FIELDS = ['name', 'lastname', 'ssn', 'identification_code', 'dob', 'sex',
+    'marital_status', 'age', 'childbearing_age', 'critical_summary']
+
+
+def populate(options, number):
+    # Create synthetic patients with some diseases each
+    with transaction(options, commit=True):
+        pool = Pool()
+        Party = pool.get('party.party')
+        Patient = pool.get('gnuhealth.patient')
+        Pathology = pool.get('gnuhealth.pathology')
+
+        pathologies = Pathology.search([], limit=200)
+        parties = Party.create([{
+                    'name': 'Patient %s' % i,
+                    'lastname': 'Benchmark %s' % i,
+                    'is_person': True,
+                    'is_patient': True,
+                    'sex': random.choice(['m', 'f']),
+                    'dob': date(1940, 1, 1) + timedelta(
+                        days=random.randint(0, 25000)),
+                    } for i in range(number)])
+        Patient.create([{
+                    'name': party.id,
+                    'diseases': [('create', [{
+                                    'pathology': pathology.id,
+                                    'status': random.choice(['a', 'c', 'h']),
+                                    } for pathology in random.sample(
+                                    pathologies, min(5, len(pathologies)))])],
+                    } for party in parties])
+
+
+def main(options):
+    init_pool(options)
+    if options.populate:
+        populate(options, options.populate)
+
+    with transaction(options):
+        Patient = Pool().get('gnuhealth.patient')
+        ids = [p.id for p in Patient.search([], limit=max(options.sizes))]
+
+    rows = []
+    for size in options.sizes:
+        sub_ids = ids[:size]
+
+        def read():
+            Pool().get('gnuhealth.patient').read(sub_ids, FIELDS)
+        duration, queries = measure(options, read)
+        rows.append((len(sub_ids), queries, '%.3f' % duration,
+                '%.3f' % (1000 * duration / max(len(sub_ids), 1))))
+    print_table(('patients', 'queries', 'seconds', 'ms/patient'), rows)
+
+
+if __name__ == '__main__':
+    parser = option_parser()
+    parser.add_option('-s', '--size', dest='sizes', action='append',
+        type='int', help='number of patients to read', default=[])
+    parser.add_option('--populate', dest='populate', type='int',
+        default=0, help='create this number of synthetic patients first')
+    options = parse_args(parser)
+    if not options.sizes:
+        options.sizes = [10, 50, 100, 500, 1000]
+    main(options)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+#    Copyright (C) 2008-2014 Luis Falcon
+#    Copyright (C) 2011-2014 GNU Solidario <health@gnusolidario.org>
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Measure the p50 / p99 latency of the patient name / SSN / code lookup
+# used by the client autocompletion.
+# The synthetic parties and patients are inserted directly in SQL so
+# millions of them can be created in a reasonable time.
+
+import random
+import time
+
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+
+from benchmark import option_parser, parse_args, init_pool, transaction, \
+    percentile, print_table
+
+
+def populate(options, number):
+    with transaction(options, commit=True):
+        cursor = Transaction().cursor
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM party_party')
+        start, = cursor.fetchone()
+        cursor.execute('INSERT INTO party_party '
+            '(create_uid, create_date, name, lastname, code, ref, '
+                'active, is_person, is_patient, sex) '
+            'SELECT 0, now(), '
+                '\'Name\' || md5(i::text), \'Lastname\' || md5((-i)::text), '
+                '\'BENCH\' || i, \'SSN\' || i, '
+                'True, True, True, \'f\' '
+            'FROM generate_series(%s, %s) AS i',
+            (start + 1, start + number))
+        cursor.execute('INSERT INTO gnuhealth_patient '
+            '(create_uid, create_date, name, identification_code) '
+            'SELECT 0, now(), id, \'PAC\' || id '
+            'FROM party_party WHERE id > %s AND is_patient',
+            (start,))
+        cursor.execute('ANALYZE party_party')
+        cursor.execute('ANALYZE gnuhealth_patient')
+
+
+def sample_terms(options):
+    # Use prefixes and fragments of existing names, lastnames,
+    # SSN and codes as the search terms
+    with transaction(options):
+        cursor = Transaction().cursor
+        cursor.execute('SELECT party.name, party.lastname, party.ref, '
+                'patient.identification_code '
+            'FROM gnuhealth_patient AS patient '
+            'JOIN party_party AS party ON party.id = patient.name '
+            'ORDER BY random() LIMIT %s', (options.lookups,))
+        terms = []
+        for row in cursor.fetchall():
+            value = random.choice([x for x in row if x])
+            size = random.randint(3, max(3, len(value)))
+            start = random.randint(0, len(value) - size)
+            terms.append(value[start:start + size])
+    return terms
+
+
+def main(options):
+    init_pool(options)
+    if options.populate:
+        populate(options, options.populate)
+
+    terms = sample_terms(options)
+    rows = []
+    for model in ('party.party', 'gnuhealth.patient'):
+        durations = []
+        with transaction(options):
+            Model = Pool().get(model)
+            for term in terms:
+                start = time.time()
+                Model.search([('rec_name', 'ilike', '%' + term + '%')],
+                    limit=options.limit)
+                durations.append(time.time() - start)
+        rows.append((model, len(durations),
+                '%.2f' % (1000 * percentile(durations, 50)),
+                '%.2f' % (1000 * percentile(durations, 99))))
+    print_table(('model', 'lookups', 'p50 (ms)', 'p99 (ms)'), rows)
+
+
+if __name__ == '__main__':
+    parser = option_parser()
+    parser.add_option('--populate', dest='populate', type='int',
+        default=0, help='insert this number of synthetic patients first, '
+        'for example 1000000')
+    parser.add_option('-n', '--lookups', dest='lookups', type='int',
+        default=1000, help='number of lookups [default: %default]')
+    parser.add_option('-l', '--limit', dest='limit', type='int',
+        default=10, help='search limit, as the client autocompletion '
+        '[default: %default]')
+    options = parse_args(parser)
+    main(options)